@@ -2,10 +2,18 @@
 import time
 import logging
 import openai
+from queue import Queue
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 
 # Import utility files
-from .response_audio import split_text, speak_sentences, stream_audio, google_generate_audio, default_audio
-from .moderation import moderate_output
+from .response_audio import split_text, split_text_stream, speak_sentences, stream_audio, google_generate_audio, default_audio
+from .moderation import moderate_output, check_moderation, screen_input
+from .models.queue_monitor import PlaybackTurn
+from .models.session_store import SessionStore, DEFAULT_SESSION_ID
+from .tracing import span, add_span, with_current_trace
+from .metrics import track_upstream, upstream_errors
+from .models.chat_history import count_tokens, count_message_tokens, truncate_to_tokens, get_context_window, TOKENS_PER_MESSAGE, TOKENS_PER_REPLY
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -16,14 +24,17 @@ from .config.load_settings import settings
 
 # Import settings variables
 MAX_MESSAGES = settings['MAIN_AI_SETTINGS']['MAX_MESSAGES']
+MAX_SESSIONS = settings['MAIN_AI_SETTINGS']['MAX_SESSIONS']
 accumulated_sentiment = settings['SENTIMENT_ANALYSIS_SETTINGS']['accumulated_sentiment']
 ai_mood = settings['SENTIMENT_ANALYSIS_SETTINGS']['ai_mood']
 TEMPERATURE = settings['MAIN_AI_SETTINGS']['TEMPERATURE']
 OPENAI_MODEL = settings['MAIN_AI_SETTINGS']['OPENAI_MODEL']
 MAX_TOKENS = settings['MAIN_AI_SETTINGS']['MAX_TOKENS']
+STREAM_RESPONSE = settings['MAIN_AI_SETTINGS']['STREAM_RESPONSE']
 USE_ELABS = settings['AI_AUDIO_SETTINGS']['USE_ELABS']
 ELABS_STREAM = settings['AI_AUDIO_SETTINGS']['ELABS_STREAM']
 USE_GOOGLE = settings['AI_AUDIO_SETTINGS']['USE_GOOGLE']
+MODERATE_INPUT = settings['MODERATION_SETTINGS']['MODERATE_INPUT']
 
 # Import sentiment analysis
 from .sentiment_analysis import update_ai_mood, analyze_sentiment_vader
@@ -31,8 +42,12 @@ from .sentiment_analysis import update_ai_mood, analyze_sentiment_vader
 # Import embeddings
 from .embeddings.embedding_functions import search_query
 
-# Initialize an empty list to store chat messages
-chat_history = []
+# Initialize the store of per-session chat history, AI mood and accumulated sentiment
+session_store = SessionStore(MAX_SESSIONS, MAX_MESSAGES, ai_mood, accumulated_sentiment, OPENAI_MODEL)
+
+# Thread pool for the network calls made alongside each response (input moderation, embeddings, output moderation)
+PRESCREEN_WORKERS = 8
+prescreen_executor = ThreadPoolExecutor(max_workers=PRESCREEN_WORKERS, thread_name_prefix="prescreen")
 
 # Function to check if the text is a question
 def is_question(text):
@@ -54,41 +69,77 @@ def is_question(text):
   return False
 
 # Function to generate AI response based on user input
-def get_ai_response(message_input, message_role, image_description=None):
+# on_partial is called with the moderated text spoken so far when STREAM_RESPONSE is enabled
+# turn is the PlaybackTurn that keeps audio and chat history in arrival order when responses are generated concurrently
+# session is the ConversationSession to use, defaults to the shared default session
+# user_sentiment is the (sentiment, intensity) of the message if it was already scored, e.g. by the YouTube poller
+def get_ai_response(message_input, message_role, image_description=None, on_partial=None, turn=None, session=None, user_sentiment=None):
 
   logging.info("\n==========================\nGetting AI Response\n==========================")
-  
-  # Global variables
-  global chat_history, ai_mood, accumulated_sentiment
+
+  # Use the default session if none was given
+  session = session or session_store.get(DEFAULT_SESSION_ID)
+
+  # Play as soon as ready if no turn was given
+  turn = turn or PlaybackTurn()
 
   # Start the ai response monitoring timer
   start_response_time = time.time()
 
+  # Moderate the user's message while the embeddings and sentiment are worked out
+  moderation_future = None
+  if MODERATE_INPUT and message_role == "user" and message_input:
+    moderation_future = prescreen_executor.submit(with_current_trace(traced_screen_input), message_input)
+
+  # Check embeddings for better context if the message is a question
+  context_future = None
+  with span("question_detection") as attributes:
+    attributes['question'] = message_input is not None and is_question(message_input)
+  if attributes['question']:
+    context_future = prescreen_executor.submit(with_current_trace(search_query), message_input)
+
   # Sentiment Analysis if user sent message
   if message_role == "user" and message_input is not None:
 
     # Select using VADER or non VADER analysis
     # user_sentiment = analyze_sentiment(message_input)
-    user_sentiment = analyze_sentiment_vader(message_input)
+    with span("sentiment", precomputed=user_sentiment is not None):
+      if user_sentiment is None:
+        user_sentiment = analyze_sentiment_vader(message_input)
     
     logging.info(user_sentiment)
 
     # Update AI's mood based on user sentiment
-    ai_mood, accumulated_sentiment = update_ai_mood(user_sentiment, ai_mood, accumulated_sentiment)
+    with session.lock:
+      session.ai_mood, session.accumulated_sentiment = update_ai_mood(user_sentiment, session.ai_mood, session.accumulated_sentiment)
+
+  # Answer flagged messages with the personality's canned reply, without calling the chat model
+  if moderation_future is not None:
+    try:
+      moderation_reply = moderation_future.result()
+    except Exception as e:
+      logging.error(f"An error occurred while moderating the user message: {e}")
+      moderation_reply = None
+
+    if moderation_reply is not None:
+      if context_future is not None:
+        context_future.cancel()
+      return speak_moderation_reply(message_input, message_role, moderation_reply, session, turn, on_partial)
 
   # Initialize chat messages
   messages = []
 
   # Add AI background/personality and ai mood to system template
-  system_template = f"{AI_PERSONALITY['description']}\n\nYou will emulate feeling {ai_mood}"
+  system_template = f"{AI_PERSONALITY['description']}\n\nYou will emulate feeling {session.ai_mood}"
 
-  # Check if the message is a question
-  if message_input is not None and is_question(message_input):
+  # Add the context found for questions
+  if context_future is not None:
 
     system_template = system_template + "\n\nChat Context:"
         
-    # Check embeddings for better context
-    matches = search_query(message_input)
+    # Wait for the embeddings lookup
+    with span("context_wait"):
+      matches = context_future.result()
     for match in matches:
       system_template = f"{system_template}\n{match['metadata']}"
 
@@ -97,22 +148,6 @@ def get_ai_response(message_input, message_role, image_description=None):
   # Add the system template to messages
   messages.append({"role": "system", "content": system_template})
 
-  # Set chat history
-  if chat_history:
-    
-    # Non-system messages
-    non_system_messages = [msg for msg in chat_history if msg["role"] != "system"]
-    
-    # Trim non-system messages
-    trimmed_non_system_messages = non_system_messages[-MAX_MESSAGES:]
-
-    # Combine system and non-system messages
-    chat_history_str = f"Chat History:\n{trimmed_non_system_messages}"
-    logging.info(chat_history_str)
-
-    # Add chat history to messages
-    messages += trimmed_non_system_messages # Use += to concatenate the lists
-
   # Check for message input
   if not message_input:
 
@@ -121,25 +156,72 @@ def get_ai_response(message_input, message_role, image_description=None):
     
   logging.info(f"Incoming Message: {message_input}")
 
+  # Messages that follow the chat history
+  latest_messages = []
+
   # Add uploaded image generated description
   if image_description is not None:
-    messages.append({"role": "system", "content": f"An image has been uploaded. You MUST pretend to being able to see the image. Here's a description of the image from an Image-To-Text engine that you can use to describe what you see: '{image_description}'. Tell the user what you see."})
+    latest_messages.append({"role": "system", "content": f"An image has been uploaded. You MUST pretend to being able to see the image. Here's a description of the image from an Image-To-Text engine that you can use to describe what you see: '{image_description}'. Tell the user what you see."})
     logging.info(f"Added uploaded image description: {image_description}")
+
+  # Tokens left for the chat history once the reply and the other messages are accounted for
+  history_budget = get_context_window(OPENAI_MODEL) - MAX_TOKENS - TOKENS_PER_REPLY
+  history_budget -= sum(count_message_tokens(msg, OPENAI_MODEL) for msg in messages + latest_messages)
+  history_budget -= count_tokens(message_input, OPENAI_MODEL) + TOKENS_PER_MESSAGE
+
+  # Trim the incoming message if it doesn't fit in the context window even without chat history
+  if history_budget < 0:
+    logging.warning(f"Incoming message exceeds the context window by {-history_budget} tokens, trimming it.")
+    message_input = truncate_to_tokens(message_input, count_tokens(message_input, OPENAI_MODEL) + history_budget, OPENAI_MODEL)
+    history_budget = 0
+
+  # Set chat history, trimmed to the token budget before it is sent
+  chat_history = session.get_chat_history(history_budget)
+  if chat_history:
+
+    # Log the chat history that will be sent
+    chat_history_str = f"Chat History:\n{chat_history}"
+    logging.info(chat_history_str)
+
+    # Add chat history to messages
+    messages += chat_history # Use += to concatenate the lists
+
+  messages += latest_messages
   
   # Add formatted message to AI bot into messages 
   messages.append({"role": message_role, "content": message_input})
   logging.info(f"Messages: {messages}")
 
+  # Stream the response and speak each sentence as soon as it is complete
+  if STREAM_RESPONSE:
+    try:
+      ai_response = stream_ai_response(messages, start_response_time, on_partial, turn)
+
+    # Error handling for failed completions
+    except Exception as e:
+      logging.error("An error occurred while streaming the AI response.", exc_info=True)
+      return AI_PERSONALITY["error_message"]
+
+    # Save messages to memory (in-memory chat history) once earlier responses are saved
+    turn.wait()
+    session.save_chat_history(message_input, message_role, ai_response)
+
+    # Monitor memory variable
+    logging.info(f"Number of messages before writing to memory: {len(session.chat_history)}\n==========================")
+
+    return ai_response
+
   # Use OpenAI's model to predict sentiment
-  ai_response = openai.ChatCompletion.create(
-    model=OPENAI_MODEL,
-    temperature=TEMPERATURE,
-    max_tokens=MAX_TOKENS,
-    top_p=1,
-    frequency_penalty=0,
-    presence_penalty=0,
-    messages=messages
-  )
+  with span("completion", model=OPENAI_MODEL, stream=False), track_upstream("openai_chat"):
+    ai_response = openai.ChatCompletion.create(
+      model=OPENAI_MODEL,
+      temperature=TEMPERATURE,
+      max_tokens=MAX_TOKENS,
+      top_p=1,
+      frequency_penalty=0,
+      presence_penalty=0,
+      messages=messages
+    )
 
   try:
     
@@ -148,32 +230,200 @@ def get_ai_response(message_input, message_role, image_description=None):
     logging.info(f"AI response: {ai_response}")
 
     # Moderate AI response
-    ai_response = moderate_output(ai_response)
+    with span("output_moderation"):
+      ai_response = moderate_output(ai_response)
 
     # End the ai response monitoring timer
     end_response_time = time.time()  
     ai_response_time = end_response_time - start_response_time
     logging.info(f"AI response time: {ai_response_time:.2f} seconds")
 
-    # Save messages to memory (in-memory chat history)
-    chat_history.append({"role": message_role, "content": message_input})
-    chat_history.append({"role": "assistant", "content": ai_response})
-
-    # Trim the chat history to only keep the latest MAX_MESSAGES
-    chat_history = chat_history[-MAX_MESSAGES:]
-
-  # Error handling for exceeding OpenAI max token use
+  # Error handling for failed completions
   except Exception as e:
-    logging.error("An error occurred, possibly due to token limit. Clearing message history and restarting.", exc_info=True)
+    logging.error("An error occurred while getting the AI response.", exc_info=True)
     
     ai_response = AI_PERSONALITY["error_message"]
 
     return ai_response
 
-  # Convert the AI's text response into audio using ElevenLabs
+  # Wait for earlier responses to finish playing
+  turn.wait()
+
+  # Save messages to memory (in-memory chat history)
+  session.save_chat_history(message_input, message_role, ai_response)
+
   # Start the text-to-speech monitoring timer
   start_text_to_speech_time = time.time()
 
+  # Convert the AI's text response into audio
+  with span("speech", characters=len(ai_response)):
+    ai_response = speak_response(ai_response)
+
+  # End the text-to-speech monitoring timer
+  end_text_to_speech_time = time.time()
+  text_to_speech_time = end_text_to_speech_time - start_text_to_speech_time
+  logging.info(f"Text-to-Speech Generation Time: {text_to_speech_time:.2f} seconds")
+
+  # Monitor memory variable
+  logging.info(f"Number of messages before writing to memory: {len(session.chat_history)}\n==========================")
+
+  
+  return ai_response
+
+# Function to start the lookups get_ai_response makes for a user message ahead of time, so their results are cached
+# by the time the message is final. Used with the partial transcripts of streaming listen mode
+def prefetch_user_message(message_input):
+  if not message_input:
+    return
+
+  prescreen_executor.submit(analyze_sentiment_vader, message_input)
+  if is_question(message_input):
+    prescreen_executor.submit(search_query, message_input)
+
+# Function to speak the canned reply for a flagged user message
+def speak_moderation_reply(message_input, message_role, moderation_reply, session, turn, on_partial=None):
+
+  # Wait for earlier responses to finish playing
+  turn.wait()
+
+  # Save messages to memory (in-memory chat history)
+  session.save_chat_history(message_input, message_role, moderation_reply)
+
+  if on_partial is not None:
+    on_partial(moderation_reply)
+
+  with span("speech", characters=len(moderation_reply), moderation_reply=True):
+    return speak_response(moderation_reply)
+
+# Function to moderate the user's message as its own span
+def traced_screen_input(message_input):
+  with span("input_moderation") as attributes:
+    moderation_reply = screen_input(message_input)
+    attributes['flagged'] = moderation_reply is not None
+    return moderation_reply
+
+# Function to moderate a streamed sentence as its own span
+def traced_check_moderation(sentence):
+  with span("output_moderation", characters=len(sentence)) as attributes:
+    sentence, flagged = check_moderation(sentence)
+    attributes['flagged'] = flagged
+    return sentence, flagged
+
+# Function to stream the AI response and speak it sentence by sentence while later tokens are still arriving
+def stream_ai_response(messages, start_response_time, on_partial=None, turn=None):
+  turn = turn or PlaybackTurn()
+
+  # Request the completion as a token stream
+  completion_start = time.time()
+  completion_attributes = {'model': OPENAI_MODEL, 'stream': True, 'sentences': 0}
+  with track_upstream("openai_chat"):
+    completion = openai.ChatCompletion.create(
+      model=OPENAI_MODEL,
+      temperature=TEMPERATURE,
+      max_tokens=MAX_TOKENS,
+      top_p=1,
+      frequency_penalty=0,
+      presence_penalty=0,
+      messages=messages,
+      stream=True
+    )
+
+  # Sentences waiting to be moderated and spoken, None marks the end of the stream
+  sentence_queue = Queue()
+  spoken_sentences = []
+  speaker_state = {'flagged': False, 'error': None}
+
+  # Moderate and speak each sentence in arrival order
+  def speak_worker():
+    while True:
+      queued_sentence = sentence_queue.get()
+      if queued_sentence is None:
+        break
+
+      # Skip the rest of the response once a sentence was replaced by moderation or failed
+      if speaker_state['flagged'] or speaker_state['error']:
+        continue
+
+      try:
+        # Wait for the moderation that started when the sentence arrived
+        sentence, flagged = queued_sentence.result()
+
+        # Wait for earlier responses to finish playing
+        turn.wait()
+
+        # Log the time until the first sentence is ready to be spoken
+        if not spoken_sentences:
+          logging.info(f"Time to first sentence: {time.time() - start_response_time:.2f} seconds")
+
+        spoken_sentences.append(sentence)
+        speaker_state['flagged'] = flagged
+
+        # Send the moderated partial response to the client
+        if on_partial is not None:
+          on_partial(" ".join(spoken_sentences))
+
+        with span("speech", characters=len(sentence)):
+          spoken_sentences[-1] = speak_response(sentence)
+
+      except Exception as e:
+        speaker_state['error'] = e
+
+  speaker_thread = Thread(target=with_current_trace(speak_worker))
+  speaker_thread.start()
+
+  try:
+
+    # Cut the token stream into sentences and hand them to the speaker thread.
+    # Each sentence is moderated right away, while earlier sentences are still being spoken
+    traced_moderation = with_current_trace(traced_check_moderation)
+    for sentence in split_text_stream(iter_completion_tokens(completion, completion_attributes, completion_start)):
+      sentence_queue.put(prescreen_executor.submit(traced_moderation, sentence))
+      completion_attributes['sentences'] += 1
+
+      # Stop reading the stream once moderation replaced the response
+      if speaker_state['flagged']:
+        break
+
+  finally:
+
+    # The completion span runs from the request until the stream is read, the time to the first token is one of its attributes
+    add_span("completion", completion_start, time.time(), **completion_attributes)
+
+    # Wait for the remaining sentences to be spoken
+    sentence_queue.put(None)
+    speaker_thread.join()
+
+  if speaker_state['error'] is not None:
+    raise speaker_state['error']
+
+  ai_response = " ".join(spoken_sentences)
+  logging.info(f"AI response: {ai_response}")
+
+  # End the ai response monitoring timer
+  ai_response_time = time.time() - start_response_time
+  logging.info(f"AI response time (including Text-to-Speech): {ai_response_time:.2f} seconds")
+
+  return ai_response
+
+# Function to extract the text tokens from a streamed completion
+# attributes is the completion span's attributes, the time to the first token is recorded in it
+def iter_completion_tokens(completion, attributes=None, start=None):
+  try:
+    for chunk in completion:
+      token = chunk["choices"][0]["delta"].get("content")
+      if token:
+        if attributes is not None and 'first_token' not in attributes:
+          attributes['first_token'] = round(time.time() - start, 6)
+        yield token
+
+  # Count streams that broke off as chat errors
+  except Exception:
+    upstream_errors.inc("openai_chat")
+    raise
+
+# Function to convert the AI's text response into audio. Returns the response with the error message added if TTS failed
+def speak_response(ai_response):
+
   # ElevenLabs text-to-speech functions
   if USE_ELABS:
     try:
@@ -211,13 +461,4 @@ def get_ai_response(message_input, message_role, image_description=None):
   else:
     default_audio(ai_response)
 
-  # End the text-to-speech monitoring timer
-  end_text_to_speech_time = time.time()
-  text_to_speech_time = end_text_to_speech_time - start_text_to_speech_time
-  logging.info(f"Text-to-Speech Generation Time: {text_to_speech_time:.2f} seconds")
-
-  # Monitor memory variable
-  logging.info(f"Number of messages before writing to memory: {len(chat_history)}\n==========================")
-
-  
   return ai_response
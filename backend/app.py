@@ -4,14 +4,13 @@ import os
 import time
 import logging
 from threading import Thread
-from multiprocessing import Process, Queue
+from queue import Queue
 from flask import Flask
 from flask_cors import CORS
 from dotenv import load_dotenv
 from elevenlabs import set_api_key
+from flask import request
 from flask_socketio import SocketIO
-import pytchat
-import random
 import signal
 import sys
 
@@ -35,231 +34,155 @@ logging.info("Starting the application...")
 
 # Import settings
 from .config.load_settings import settings
-from .config.settings_api import settings_app
+from .config.settings_api import settings_app, register_runtime_stats
+
+# Import embeddings
+from .embeddings.embedding_functions import get_embedding_cache_stats
+
+# Import sentiment analysis
+from .sentiment_analysis import sentiment_engine
+
+# Import moderation
+from .moderation import get_moderation_stats
 
 # Import models
 from .models.voice_listener import VoiceListener
+from .models.audio_capture import AudioCaptureManager
+from .models.queue_monitor import QueueMonitor, PlaybackGate
+from .models.youtube_manager import YouTubeManager
+from .models.chat_replay import make_replay_chat_factory
+from .models.session_store import DEFAULT_SESSION_ID
 
 # Import settings variables
 OPENAI_WHISPER_MODEL = settings['AI_AUDIO_SETTINGS']['OPENAI_WHISPER_MODEL']
 LISTEN_KEYWORD_QUIT = settings['AI_AUDIO_SETTINGS']['LISTEN_KEYWORD_QUIT']
 LISTEN_PERIODIC_MESSAGE_TIMER = settings['AI_AUDIO_SETTINGS']['LISTEN_PERIODIC_MESSAGE_TIMER']
+RESPONSE_WORKERS = settings['MAIN_AI_SETTINGS']['RESPONSE_WORKERS']
+USE_ELABS = settings['AI_AUDIO_SETTINGS']['USE_ELABS']
+ELABS_STREAM = settings['AI_AUDIO_SETTINGS']['ELABS_STREAM']
+USE_GOOGLE = settings['AI_AUDIO_SETTINGS']['USE_GOOGLE']
+AUDIO_CACHE_PREWARM = settings['AI_AUDIO_SETTINGS']['AUDIO_CACHE_PREWARM']
+YOUTUBE_REPLAY_DIR = settings['YOUTUBE_SETTINGS']['YOUTUBE_REPLAY_DIR']
 
 # Import AI answer functions
 from .ai_response import *
+from .response_audio import audio_engine, audio_cache, prewarm_audio_cache
+from .transcription import preload_transcriber
+from .personalities import AI_PERSONALITY
 from .image_reader import *
+from .tracing import traced_request, trace_exporter
+from .metrics import register_queue_metrics, register_cache_metrics, register_moderation_metrics, register_chat_metrics
 
 # Initialize Queue
-shared_queue = Queue(maxsize=2)
+# The YouTube queue only holds the next message, the best candidates wait in the chat pollers' ranked buffers
+shared_queue = Queue(maxsize=1)
 high_priority_queue = Queue(maxsize=3)
 
+# Playback order shared by the queued responses and the ones requested directly (greeting, voice, listen mode),
+# so a direct response never plays over a queued one
+playback_gate = PlaybackGate()
+
 # Import routes
 from .routes.greeting_route import greeting_app
 from .routes.input_message_route import input_message_app
 from .routes.periodic_message_route import periodic_message_app
 from .routes.voice_route import voice_app
+from .routes.metrics_route import metrics_app
 
 # Register Blueprints with your main app
 app.register_blueprint(greeting_app, url_prefix='/greeting')
 app.register_blueprint(input_message_app, url_prefix='/input_message')
 app.register_blueprint(periodic_message_app, url_prefix='/periodic_message')
 app.register_blueprint(settings_app, url_prefix='/settings')
+app.register_blueprint(metrics_app, url_prefix='/metrics')
 app.register_blueprint(voice_app, url_prefix='/voice')
 
-# Monitor Queue Class
-class QueueMonitor:
-  def __init__(self, regular_queue, priority_queue):
-    self.regular_queue = regular_queue
-    self.priority_queue = priority_queue
-    self.stop_monitor_thread = False
-    self.monitor_thread = None
-
-  def start(self):
-    self.stop_monitor_thread = False
-    self.monitor_thread = Thread(target=monitor_queue, args=(self, self.regular_queue, self.priority_queue))
-    self.monitor_thread.start()
-
-  def stop(self):
-    self.stop_monitor_thread = True
-
-    if self.monitor_thread:
-      self.monitor_thread.join()
-      self.monitor_thread = None
-
-# YouTube Manager Class
-class YouTubeManager:
-
-  # Initialization function
-  def __init__(self, queue):
-    logging.info("YouTubeManager initialized.")
-
-    # Instance variable for the queue
-    self.queue = queue
-
-    # Set streaming status to inactive initially
-    self.is_active = False
-
-    # Placeholder for multiprocessing process
-    self.process = None
-
-  # Function to start streaming
-  def start_streaming(self, video_id):
-    logging.info("Attempting to start streaming.")
-
-    # Check if streaming is already active
-    if not self.is_active:
-
-      # Set streaming status to active
-      self.is_active = True
-
-      # Create a new process for YouTube live chat and start it
-      self.process = Process(target=self.youtube_live_chat, args=(video_id,))
-      self.process.start()
-
-  # Function to stop streaming
-  def stop_streaming(self):
-    logging.info("Attempting to stop streaming.")
-
-    # Set streaming status to inactive
-    self.is_active = False
-
-    # Terminate the process if it exists
-    if self.process:
-      self.process.terminate()
-      self.process.join()
-      self.process = None
-
-  # Function to check if streaming is active
-  def is_streaming_active(self):
-    return self.is_active
-
-  # Function to manage YouTube live chat
-  def youtube_live_chat(self, video_id):
-    logging.info("Starting YouTube live chat management.")
-
-    # Create a chat object using pytchat
-    chat = pytchat.create(video_id=video_id)
-
-    # Loop to fetch chat as long as the chat and stream are alive
-    while chat.is_alive() and self.is_active:
-      try:
-
-        # Initialize an empty list to collect chat messages
-        chat_messages = []
-
-        # Fetch each chat item
-        for c in chat.get().sync_items():
-
-          # Collect the chat messages in the list
-          chat_messages.append({
-            'author': c.author.name,
-            'message': c.message
-          })
-
-        # Randomly select a chat message and check if queue is full
-        if len(chat_messages) > 0:
-          selected_message = random.choice(chat_messages)
-
-          # Trim the selected message to 200 characters if it exceeds that
-          selected_message['message'] = selected_message['message'][:200]
-          
-          # Check if the queue is full
-          if self.queue.full():
-            _ = self.queue.get()  # Remove the oldest item
-          
-          selected_message['source'] = 'youtube'
-          self.queue.put(selected_message)  # Put the new item
-
-      # Terminate chat on manual interrupt
-      except KeyboardInterrupt:
-        chat.terminate()
-        break
-
-      # Print any other exceptions
-      except Exception as e:
-        logging.error(f"An error occurred: {e}")
-
-      time.sleep(5)
-
-# Worker for monitoring and enqueueing the queue
-def monitor_queue(queue_monitor, regular_queue, priority_queue):
-  
-  # Main loop to monitor queues
-  while True:
+# Send the partial AI response to the client while the rest is still being generated
+def emit_partial_response(source, partial_response, sid=None):
+  try:
+    socketio.emit('partial_response', {'source': source, 'ai_response': partial_response}, namespace='/', to=sid)
+  except Exception as e:
+    logging.error(f"Specific error: {e}")
 
-    # If the stop flag is set, break the loop
-    if queue_monitor.stop_monitor_thread:
-      break
+# Process a single item on a QueueMonitor response worker, traced from the moment the message came in
+def process_queue_item(queue_item, turn):
+  now = time.time()
+  queued_at = queue_item.get("queued_at", now)
+  posted_at = queue_item.get("posted_at", queued_at)
 
-    # First, check if the priority queue is not empty
-    if not priority_queue.empty():
+  with traced_request(queue_item["source"], queue_item.get("request_id"), posted_at) as trace:
+    if trace is not None:
+      trace.attributes.update({'session_id': queue_item.get("session_id"), 'video_id': queue_item.get("video_id")})
 
-      # Get the next item from the priority queue
-      queue_item = priority_queue.get()
+      # Time the YouTube message spent ranked in the chat buffer, then waiting in the queue
+      if posted_at < queued_at:
+        trace.add_span("chat_buffer", posted_at, queued_at)
+      trace.add_span("queue_wait", queued_at, now)
 
-      # Extract the 'source' field from the queue item
-      source = queue_item["source"]
+    answer_queue_item(queue_item, turn)
 
-      # Check if the source is 'input' (user input)
-      if source == 'input':
+# Get the AI response to a queue item and send it to the client
+def answer_queue_item(queue_item, turn):
 
-        # Extract user input and optional image description from the queue item
-        user_input = queue_item["input"]
-        image_description = queue_item.get("image_description", "")
+  # Extract the 'source' field from the queue item
+  source = queue_item["source"]
 
-        # Get the AI response for the user input
-        ai_response = get_ai_response(user_input, 'user', image_description)
+  # Get the conversation session and the Socket.IO client to reply to (None sends to every client)
+  session = session_store.get(queue_item.get("session_id", DEFAULT_SESSION_ID))
+  sid = queue_item.get("sid")
 
-        # Try to emit the AI response to the client
-        try:
-          socketio.emit('receive_input', ai_response, namespace='/')
-        # Handle any exceptions during the emit
-        except Exception as e:
-          logging.error(f"Specific error: {e}")
+  # Check if the source is 'input' (user input)
+  if source == 'input':
 
-    # If the priority queue is empty, check the regular queue
-    elif not regular_queue.empty():
+    # Extract user input and optional image description from the queue item
+    user_input = queue_item["input"]
+    image_description = queue_item.get("image_description", "")
 
-      # Get the next item from the regular queue
-      queue_item = regular_queue.get()
+    # Get the AI response for the user input
+    ai_response = get_ai_response(user_input, 'user', image_description, on_partial=lambda partial: emit_partial_response(source, partial, sid), turn=turn, session=session)
 
-      # Extract the 'source' field from the queue item
-      source = queue_item["source"]
+    # Try to emit the AI response to the client
+    try:
+      socketio.emit('receive_input', ai_response, namespace='/', to=sid)
+    # Handle any exceptions during the emit
+    except Exception as e:
+      logging.error(f"Specific error: {e}")
 
-      # Check if the source is 'youtube' (YouTube chat)
-      if source == 'youtube':
+  # Check if the source is 'youtube' (YouTube chat)
+  elif source == 'youtube':
 
-        # Extract author and message from the queue item
-        selected_message_author = queue_item["author"]
-        selected_message_content = queue_item["message"]
+    # Extract author and message from the queue item
+    selected_message_author = queue_item["author"]
+    selected_message_content = queue_item["message"]
 
-        # Get the AI response for the YouTube message
-        ai_response = get_ai_response(f"Comment from the Youtube Live Stream. Please respond using 50 characters or less. {selected_message_author}: {selected_message_content}", 'user')
+    # Get the AI response for the YouTube message
+    ai_response = get_ai_response(f"Comment from the Youtube Live Stream. Please respond using 50 characters or less. {selected_message_author}: {selected_message_content}", 'user', on_partial=lambda partial: emit_partial_response(source, partial, sid), turn=turn, session=session, user_sentiment=queue_item.get("sentiment"))
 
-        # Prepare data to emit
-        data_to_emit = {
-          'ai_response': ai_response,
-          'selected_message_author': selected_message_author,
-          'selected_message_content': selected_message_content
-        }
+    # Record how long the chat waited for the reply
+    youtube_manager.record_reply(queue_item.get("video_id"), time.time() - queue_item.get("posted_at", queue_item["queued_at"]))
 
-        # Try to emit the prepared data to the client
-        try:
-          socketio.emit('new_message', data_to_emit, namespace='/')
+    # Prepare data to emit, tagged with the stream the message came from
+    data_to_emit = {
+      'stream_id': queue_item.get("video_id"),
+      'ai_response': ai_response,
+      'selected_message_author': selected_message_author,
+      'selected_message_content': selected_message_content
+    }
 
-        # Handle any exceptions during the emit
-        except Exception as e:
-          logging.error(f"Specific error: {e}")
+    # Try to emit the prepared data to the client
+    try:
+      socketio.emit('new_message', data_to_emit, namespace='/')
 
-    # Sleep for 1 second before the next iteration
-    time.sleep(1)
+    # Handle any exceptions during the emit
+    except Exception as e:
+      logging.error(f"Specific error: {e}")
 
 # Handle YouTube start stream
 @socketio.on('start_youtube_stream')
 def handle_start_youtube_stream(data):
 
-  # Extract video_id from the data
-  video_id = data.get('videoID')
+  # Extract the video ids from the data, several streams can be given separated by commas
+  video_ids = data.get('videoID')
 
   # Return a message indicating the streaming state has changed
   try:
@@ -267,13 +190,14 @@ def handle_start_youtube_stream(data):
   except Exception as e:
     socketio.emit('error_streaming_toast', {"toast_message": str(e)})
 
-  youtube_manager.start_streaming(video_id)
+  youtube_manager.start_streaming(video_ids)
 
 # Handle YouTube stop stream
 @socketio.on('stop_youtube_stream')
-def handle_stop_youtube_stream():
+def handle_stop_youtube_stream(data=None):
 
-  youtube_manager.stop_streaming()
+  # Stop the given streams, or every stream if none are given
+  youtube_manager.stop_streaming((data or {}).get('videoID'))
   logging.info("Stopped streaming, now attempting to emit toast message.")
 
   # Return a message indicating the streaming state has changed
@@ -285,20 +209,73 @@ def handle_stop_youtube_stream():
     logging.info("Backend encountered an error:", str(e))
     socketio.emit('error_streaming_toast', {"toast_message": str(e)})
 
-# Initialize the QueueMonitor
-queue_monitor = QueueMonitor(shared_queue, high_priority_queue)
-
-# Initialize the YouTube Manager
-youtube_manager = YouTubeManager(shared_queue)
+# Drop the conversation session and the listen state of a Socket.IO client when it disconnects
+@socketio.on('disconnect')
+def handle_disconnect():
+  session_store.remove(request.sid)
+  voice_listener.remove_client(request.sid)
 
-# Initialize the Voice Listener
-voice_listener = VoiceListener()
+# Initialize the QueueMonitor
+queue_monitor = QueueMonitor(shared_queue, high_priority_queue, process_queue_item, regular_buffer_size=1, pool_size=RESPONSE_WORKERS, regular_backpressure=True, playback_gate=playback_gate)
+register_runtime_stats('queues', queue_monitor.get_metrics)
+register_runtime_stats('workers', queue_monitor.get_worker_stats)
+register_runtime_stats('sessions', session_store.get_stats)
+register_runtime_stats('embedding_cache', get_embedding_cache_stats)
+register_runtime_stats('audio_cache', audio_cache.get_stats)
+register_runtime_stats('sentiment_cache', sentiment_engine.get_stats)
+register_runtime_stats('moderation', get_moderation_stats)
+register_runtime_stats('tracing', trace_exporter.get_stats)
+
+# Expose the queues and the cache hit rates as metrics, they are read from the stats above when /metrics is scraped
+register_queue_metrics({'youtube': shared_queue, 'priority': high_priority_queue}, queue_monitor)
+
+# Audio cache hits from memory or disk
+def get_audio_cache_counts():
+  stats = audio_cache.get_stats()
+  return {'hits': stats['memory_hits'] + stats['disk_hits'], 'misses': stats['misses']}
+
+# Moderation verdicts served from the cache, every other verdict was worked out
+def get_moderation_cache_counts():
+  stats = get_moderation_stats()['moderator']
+  return {'hits': stats['cache_hits'], 'misses': stats['local_clean'] + stats['escalated'] + stats['remote_flagged'] + stats['remote_errors']}
+
+register_cache_metrics({
+  'embedding': get_embedding_cache_stats,
+  'sentiment': sentiment_engine.get_stats,
+  'audio': get_audio_cache_counts,
+  'moderation': get_moderation_cache_counts
+})
+
+# Expose the moderation decisions per category
+register_moderation_metrics(lambda: get_moderation_stats()['policy'])
+
+# Synthesize the personality's canned responses in the background so they play instantly
+if AUDIO_CACHE_PREWARM:
+  canned_lines = [AI_PERSONALITY["profanity_moderation"], AI_PERSONALITY["error_message"]]
+  canned_lines += [line for replies in AI_PERSONALITY["ai_moderation"].values() for line in replies]
+  Thread(target=prewarm_audio_cache, args=(canned_lines, USE_ELABS, ELABS_STREAM, USE_GOOGLE), daemon=True).start()
+
+# Load a local speech-to-text model in the background so the first utterance doesn't wait for it
+Thread(target=preload_transcriber, daemon=True).start()
+
+# Initialize the YouTube Manager, replaying recorded chats instead of connecting to YouTube if a replay folder is set
+if YOUTUBE_REPLAY_DIR:
+  youtube_manager = YouTubeManager(shared_queue, make_replay_chat_factory(YOUTUBE_REPLAY_DIR))
+else:
+  youtube_manager = YouTubeManager(shared_queue)
+register_runtime_stats('youtube', youtube_manager.get_stats)
+register_chat_metrics(youtube_manager.get_ingest_stats)
+
+# Initialize the Voice Listener, the microphones stay open between listening rounds
+audio_capture = AudioCaptureManager()
+voice_listener = VoiceListener(audio_capture, playback_gate)
+register_runtime_stats('microphones', audio_capture.get_stats)
 
 # Endpoints to handle voice-based user prompts and stopping voice listening
 socketio.on('start_listening')(voice_listener.handle_start_listening)
 socketio.on('stop_listening')(voice_listener.handle_stop_listening)
 
-# Start the monitor_queue thread using the QueueMonitor instance
+# Start the queue monitor threads using the QueueMonitor instance
 queue_monitor.start()
 logging.info("Queue starting...")
 
@@ -306,19 +283,19 @@ logging.info("Queue starting...")
 def cleanup(signum, frame): 
   logging.info("Cleanup initiated...")
   
-  # Stop the monitor_queue thread
-  queue_monitor.stop()
-  
-  # Stop streaming if active
+  # Stop streaming if active, before the queue monitor so no poller is left waiting on the queue
   if youtube_manager.is_streaming_active():
     youtube_manager.stop_streaming()
+
+  # Stop the queue monitor threads
+  queue_monitor.stop()
       
   # Stop any listening activities
-  voice_listener.handle_stop_listening()
-  
-  # Close the shared queue
-  shared_queue.close()
-  shared_queue.join_thread()
+  voice_listener.stop_all()
+  audio_capture.close_all()
+
+  # Release the audio output device
+  audio_engine.close()
   
   sys.exit(0)
 
@@ -0,0 +1,140 @@
+# Import necessary libraries
+import time
+import random
+from threading import Lock
+
+# Categories reported by the fake moderation endpoint
+MODERATION_CATEGORIES = [
+  "sexual", "hate", "harassment", "self-harm", "sexual/minors", "hate/threatening",
+  "violence/graphic", "self-harm/intent", "self-harm/instructions", "harassment/threatening", "violence"
+]
+
+# Words the fake chat model builds its replies from
+REPLY_WORDS = ["honestly", "that", "is", "a", "really", "good", "question", "and", "I", "think", "the", "stream", "chat", "today", "fun"]
+
+# Latency distribution given as "<kind>:<parameters>", in seconds:
+#   const:0.2, uniform:0.1,0.3, normal:0.2,0.05, lognormal:0.2,0.5 (median, sigma), exp:0.2 (mean)
+class LatencyModel:
+  def __init__(self, spec, rng=None):
+    self.spec = spec
+    kind, _, params = spec.partition(":")
+    self.kind = kind
+    self.params = [float(param) for param in params.split(",") if param]
+    self.rng = rng or random.Random()
+
+    if kind not in ("const", "uniform", "normal", "lognormal", "exp"):
+      raise ValueError(f"Unknown latency distribution: {spec}")
+
+  # Draw a latency in seconds, never negative
+  def sample(self):
+    if self.kind == "const":
+      value = self.params[0]
+    elif self.kind == "uniform":
+      value = self.rng.uniform(*self.params)
+    elif self.kind == "normal":
+      value = self.rng.gauss(*self.params)
+    elif self.kind == "lognormal":
+      median, sigma = self.params
+      value = median * self.rng.lognormvariate(0, sigma)
+    else:
+      value = self.rng.expovariate(1 / self.params[0])
+    return max(value, 0.0)
+
+  # Sleep for a drawn latency
+  def wait(self):
+    time.sleep(self.sample())
+
+  def __repr__(self):
+    return self.spec
+
+# Stand-ins for the OpenAI endpoints the response pipeline calls, with configurable latency
+class FakeOpenAI:
+  def __init__(self, chat_latency, token_latency, moderation_latency, embedding_latency, flag_rate=0.0, reply_tokens=20, seed=None):
+    self.chat_latency = chat_latency # Time to the first token
+    self.token_latency = token_latency # Time between tokens
+    self.moderation_latency = moderation_latency
+    self.embedding_latency = embedding_latency
+    self.flag_rate = flag_rate # Share of moderation calls that come back flagged
+    self.reply_tokens = reply_tokens
+    self.rng = random.Random(seed)
+    self.lock = Lock() # random.Random isn't safe to share between threads
+    self.calls = {'chat': 0, 'moderation': 0, 'embedding': 0}
+
+  def count(self, name):
+    with self.lock:
+      self.calls[name] += 1
+
+  # Make up a reply of a few sentences
+  def make_reply(self, max_tokens):
+    with self.lock:
+      words = [self.rng.choice(REPLY_WORDS) for _ in range(min(self.reply_tokens, max_tokens or self.reply_tokens))]
+
+    # End a sentence every eight words
+    tokens = []
+    for index, word in enumerate(words):
+      tokens.append((" " if index else "") + word + ("." if index % 8 == 7 or index == len(words) - 1 else ""))
+    return tokens
+
+  # Fake of openai.ChatCompletion.create, streams chunks like the real endpoint when stream=True
+  def chat_completion_create(self, messages=None, max_tokens=None, stream=False, **kwargs):
+    self.count('chat')
+    tokens = self.make_reply(max_tokens)
+    self.chat_latency.wait()
+
+    if not stream:
+      for _ in tokens[1:]:
+        self.token_latency.wait()
+      return {"choices": [{"message": {"role": "assistant", "content": "".join(tokens)}}]}
+
+    def chunks():
+      for index, token in enumerate(tokens):
+        if index:
+          self.token_latency.wait()
+        yield {"choices": [{"delta": {"content": token}}]}
+
+    return chunks()
+
+  # Fake of openai.Moderation.create
+  def moderation_create(self, input=None, **kwargs):
+    self.count('moderation')
+    self.moderation_latency.wait()
+
+    with self.lock:
+      flagged = self.rng.random() < self.flag_rate
+      flagged_category = self.rng.choice(MODERATION_CATEGORIES)
+
+    return {"results": [{
+      "flagged": flagged,
+      "categories": {category: flagged and category == flagged_category for category in MODERATION_CATEGORIES},
+      "category_scores": {category: 0.9 if flagged and category == flagged_category else 0.001 for category in MODERATION_CATEGORIES}
+    }]}
+
+  # Fake of the embeddings lookup done for questions
+  def search_query(self, query, top_k=2):
+    self.count('embedding')
+    self.embedding_latency.wait()
+    return [{'id': str(index), 'score': 0.5, 'metadata': {'content': "Benchmark context."}} for index in range(top_k)]
+
+  # Replace the OpenAI endpoints on the openai module
+  def install(self, openai):
+    openai.ChatCompletion.create = self.chat_completion_create
+    openai.Moderation.create = self.moderation_create
+
+# Stand-in for text-to-speech and playback: waits for synthesis, then for as long as the text takes to say
+class FakeSpeech:
+  def __init__(self, synthesis_latency, characters_per_second=15.0):
+    self.synthesis_latency = synthesis_latency
+    self.characters_per_second = characters_per_second
+    self.lock = Lock() # Only one utterance plays at a time, like the audio engine
+    self.utterances = 0
+
+  # Fake of speak_response
+  def speak_response(self, ai_response):
+    self.synthesis_latency.wait()
+
+    with self.lock:
+      self.utterances += 1
+      if self.characters_per_second:
+        time.sleep(len(ai_response) / self.characters_per_second)
+
+    return ai_response
@@ -0,0 +1,264 @@
+# # # # #
+# To use this file, run `python -m backend.benchmark.replay_benchmark` from the folder that contains `backend`
+# This file is not used within the app, instead, it is used to measure the YouTube chat → response pipeline offline
+#
+# Chat is replayed from recorded logs (JSON lines, see models/chat_replay.py) or generated at a given rate, and goes
+# through the same YouTubeManager → QueueMonitor → get_ai_response path as the app. OpenAI chat, moderation and
+# embeddings, and text-to-speech are replaced by fakes with configurable latency distributions, so nothing leaves the
+# machine. Reports reply latency and queue wait percentiles, the drop rate, CPU and memory.
+# # # # #
+
+# Import necessary libraries
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import resource
+from queue import Queue
+from threading import Lock
+
+from .fake_backends import LatencyModel, FakeOpenAI, FakeSpeech
+
+# Folder the app runs from, settings are loaded relative to it
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Message templates of the synthetic chat
+QUESTION_TEMPLATES = ["what do you think about {topic}?", "how was your day with {topic}?", "can you tell me about {topic}?", "why is {topic} so good?"]
+COMMENT_TEMPLATES = ["I really love {topic} today", "this stream about {topic} is great", "{topic} is my favourite thing", "hello from the {topic} fan club"]
+SPAM_MESSAGES = ["check out www.free-subs.com", "LOOOOOOOOOOOOL", ":smile::smile::smile:"]
+TOPICS = ["games", "music", "anime", "cooking", "cats", "space", "coding", "movies"]
+
+# Generate a chat log of rate messages per second for duration seconds
+def synthetic_chat(rate, duration, authors=200, question_ratio=0.3, spam_ratio=0.05, duplicate_ratio=0.05, member_ratio=0.05, seed=None):
+  rng = random.Random(seed)
+  records = []
+  posted = []
+
+  for index in range(int(rate * duration)):
+    author = f"viewer{rng.randrange(authors)}"
+    roll = rng.random()
+
+    if roll < spam_ratio:
+      message = rng.choice(SPAM_MESSAGES)
+    elif roll < spam_ratio + duplicate_ratio and posted:
+      message = rng.choice(posted)
+    else:
+      templates = QUESTION_TEMPLATES if rng.random() < question_ratio else COMMENT_TEMPLATES
+      message = f"{rng.choice(templates).format(topic=rng.choice(TOPICS))} {index}"
+      posted.append(message)
+
+    records.append({
+      'time': index / rate,
+      'author': author,
+      'author_id': author,
+      'message': message,
+      'member': rng.random() < member_ratio
+    })
+
+  return records
+
+# Nearest rank percentile of a list of values
+def percentile(values, pct):
+  if not values:
+    return 0.0
+  ordered = sorted(values)
+  return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+# Summary of a list of durations in seconds
+def summarize(values):
+  return {
+    'count': len(values),
+    'p50': percentile(values, 50),
+    'p95': percentile(values, 95),
+    'p99': percentile(values, 99),
+    'max': max(values, default=0.0)
+  }
+
+# Collects the timings of every reply
+class BenchmarkRecorder:
+  def __init__(self):
+    self.lock = Lock()
+    self.reply_latencies = [] # From the chat message being posted to the reply being spoken
+    self.queue_waits = [] # From the message entering the response queue to a worker picking it up
+
+  def record(self, queue_wait, reply_latency):
+    with self.lock:
+      self.queue_waits.append(queue_wait)
+      self.reply_latencies.append(reply_latency)
+
+# CPU time used by the process so far, in seconds
+def cpu_time():
+  usage = resource.getrusage(resource.RUSAGE_SELF)
+  return usage.ru_utime + usage.ru_stime
+
+# Peak memory of the process in MB, ru_maxrss is in KB on Linux and in bytes on macOS
+def peak_memory_mb():
+  max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+# Load the response pipeline with the fake backends in place of OpenAI and text-to-speech
+def load_pipeline(args, fake_openai, fake_speech):
+  os.chdir(BACKEND_DIR)
+
+  # Settings are read when the modules are imported, so they are overridden first
+  from ..config.load_settings import settings
+  settings['AI_EMBEDDING_SETTINGS']['VECTOR_BACKEND'] = "local"
+  settings['AI_EMBEDDING_SETTINGS']['EMBEDDER'] = "stub"
+  settings['AI_AUDIO_SETTINGS']['AUDIO_CACHE_DIR'] = ""
+  settings['MAIN_AI_SETTINGS']['STREAM_RESPONSE'] = not args.no_stream
+  settings['YOUTUBE_SETTINGS']['YOUTUBE_STREAM_RATE_LIMIT'] = args.stream_rate_limit
+  settings['MODERATION_SETTINGS']['LOCAL_MODERATION'] = not args.remote_moderation
+
+  import openai
+  fake_openai.install(openai)
+
+  from .. import ai_response
+  ai_response.speak_response = fake_speech.speak_response
+  ai_response.search_query = fake_openai.search_query
+
+  return ai_response
+
+# Replay the chat through the pipeline and measure it
+def run_benchmark(args):
+  fake_openai = FakeOpenAI(LatencyModel(args.chat_latency), LatencyModel(args.token_latency),
+                           LatencyModel(args.moderation_latency), LatencyModel(args.embedding_latency),
+                           flag_rate=args.flag_rate, reply_tokens=args.reply_tokens, seed=args.seed)
+  fake_speech = FakeSpeech(LatencyModel(args.tts_latency), args.speech_rate)
+
+  ai_response = load_pipeline(args, fake_openai, fake_speech)
+
+  from ..models.queue_monitor import QueueMonitor
+  from ..models.youtube_manager import YouTubeManager
+  from ..models.chat_replay import ReplayChat
+  from ..models.session_store import YOUTUBE_SESSION_ID
+
+  # One chat log per stream, recorded or synthetic
+  if args.chat_log:
+    chat_logs = {os.path.splitext(os.path.basename(path))[0]: path for path in args.chat_log}
+  else:
+    chat_logs = {f"bench-{index}": synthetic_chat(args.rate, args.duration, seed=None if args.seed is None else args.seed + index) for index in range(args.streams)}
+
+  def create_chat(video_id, **kwargs):
+    chat_log = chat_logs[video_id]
+    if isinstance(chat_log, str):
+      return ReplayChat.from_file(chat_log, args.speed)
+    return ReplayChat(chat_log, args.speed)
+
+  recorder = BenchmarkRecorder()
+  session = ai_response.session_store.get(YOUTUBE_SESSION_ID)
+  youtube_queue = Queue(maxsize=1)
+  priority_queue = Queue()
+  youtube_manager = YouTubeManager(youtube_queue, create_chat)
+
+  # Same handling as the app's YouTube queue items, timed
+  def handle_item(queue_item, turn):
+    queue_wait = time.time() - queue_item['queued_at']
+    ai_response.get_ai_response(f"Comment from the Youtube Live Stream. Please respond using 50 characters or less. {queue_item['author']}: {queue_item['message']}",
+                                'user', turn=turn, session=session, user_sentiment=queue_item.get('sentiment'))
+
+    reply_latency = time.time() - queue_item['posted_at']
+    recorder.record(queue_wait, reply_latency)
+    youtube_manager.record_reply(queue_item['video_id'], reply_latency)
+
+  queue_monitor = QueueMonitor(youtube_queue, priority_queue, handle_item, regular_buffer_size=1, pool_size=args.workers, regular_backpressure=True)
+
+  print(f"Replaying {len(chat_logs)} stream(s) for {args.duration} seconds...")
+  cpu_start = cpu_time()
+  wall_start = time.time()
+
+  queue_monitor.start()
+  youtube_manager.start_streaming(list(chat_logs))
+  time.sleep(args.duration)
+
+  # Stop taking chat, then let the replies already queued finish
+  stream_stats = youtube_manager.get_stats()
+  youtube_manager.stop_streaming()
+  drain_deadline = time.time() + args.drain_timeout
+  while time.time() < drain_deadline:
+    metrics = queue_monitor.get_metrics()
+    if not queue_monitor.get_worker_stats()['in_flight'] and not any(queue_metrics['pending'] for queue_metrics in metrics.values()) and youtube_queue.empty():
+      break
+    time.sleep(0.1)
+  queue_monitor.stop()
+
+  wall_time = time.time() - wall_start
+  cpu_used = cpu_time() - cpu_start
+
+  seen = sum(stats['seen'] for stats in stream_stats.values())
+  filtered = sum(stats['dropped'] for stats in stream_stats.values())
+  replies = len(recorder.reply_latencies)
+
+  return {
+    'streams': len(chat_logs),
+    'workers': args.workers,
+    'duration': wall_time,
+    'messages_seen': seen,
+    'messages_filtered': filtered,
+    'replies': replies,
+    'replies_per_second': replies / wall_time if wall_time else 0.0,
+    'drop_rate': 1 - replies / seen if seen else 0.0,
+    'reply_latency': summarize(recorder.reply_latencies),
+    'queue_wait': summarize(recorder.queue_waits),
+    'cpu_percent': 100 * cpu_used / wall_time if wall_time else 0.0,
+    'peak_memory_mb': peak_memory_mb(),
+    'backend_calls': dict(fake_openai.calls, tts=fake_speech.utterances)
+  }
+
+# Print the report in a readable form
+def print_report(report):
+  print(f"Streams: {report['streams']}, workers: {report['workers']}, duration: {report['duration']:.1f} s")
+  print(f"Messages seen: {report['messages_seen']}, filtered: {report['messages_filtered']}, replies: {report['replies']} ({report['replies_per_second']:.2f}/s)")
+  print(f"Drop rate: {report['drop_rate']:.1%}")
+  for name in ('reply_latency', 'queue_wait'):
+    stats = report[name]
+    print(f"{name.replace('_', ' ').capitalize()}: p50 {stats['p50']:.3f} s, p95 {stats['p95']:.3f} s, p99 {stats['p99']:.3f} s, max {stats['max']:.3f} s")
+  print(f"CPU: {report['cpu_percent']:.1f}%, peak memory: {report['peak_memory_mb']:.1f} MB")
+  print(f"Backend calls: {report['backend_calls']}")
+
+# Parse the command line arguments
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description="Replay YouTube chat through the response pipeline with fake backends and report latency and throughput.")
+  parser.add_argument("--chat-log", action="append", help="Recorded chat (JSON lines) to replay, once per stream. Synthetic chat is used if not given")
+  parser.add_argument("--rate", type=float, default=10, help="Synthetic chat messages per second, per stream")
+  parser.add_argument("--streams", type=int, default=1, help="Number of synthetic streams")
+  parser.add_argument("--duration", type=float, default=60, help="Seconds of chat to replay")
+  parser.add_argument("--speed", type=float, default=1.0, help="Replay speed of the chat logs")
+  parser.add_argument("--drain-timeout", type=float, default=30, help="Seconds to wait for queued replies once the chat stops")
+  parser.add_argument("--workers", type=int, default=3, help="Number of response workers")
+  parser.add_argument("--stream-rate-limit", type=float, default=600, help="Max replies per minute per stream, 0 for no limit")
+  parser.add_argument("--no-stream", action="store_true", help="Wait for the whole completion instead of streaming it")
+  parser.add_argument("--remote-moderation", action="store_true", help="Send every text to the moderation endpoint instead of clearing clean text locally")
+  parser.add_argument("--chat-latency", default="lognormal:0.4,0.3", help="Time to the first token of the chat model")
+  parser.add_argument("--token-latency", default="const:0.02", help="Time between streamed tokens")
+  parser.add_argument("--moderation-latency", default="lognormal:0.15,0.3", help="Moderation endpoint latency")
+  parser.add_argument("--embedding-latency", default="lognormal:0.1,0.3", help="Embeddings lookup latency")
+  parser.add_argument("--tts-latency", default="lognormal:0.3,0.3", help="Text-to-speech synthesis latency")
+  parser.add_argument("--speech-rate", type=float, default=15, help="Characters spoken per second (0 to skip playback time)")
+  parser.add_argument("--reply-tokens", type=int, default=20, help="Tokens per fake reply")
+  parser.add_argument("--flag-rate", type=float, default=0.0, help="Share of moderation calls that come back flagged")
+  parser.add_argument("--seed", type=int, default=None, help="Random seed for the synthetic chat and the fakes")
+  parser.add_argument("--output", help="Also write the report to this JSON file")
+  parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's info logs")
+  return parser.parse_args(argv)
+
+if __name__ == "__main__":
+  args = parse_args()
+
+  # Paths are given relative to where the command runs, the benchmark runs from the backend folder
+  args.chat_log = [os.path.abspath(path) for path in args.chat_log or []]
+  args.output = os.path.abspath(args.output) if args.output else None
+
+  # The pipeline logs every response, which would drown the report
+  logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+  if not args.verbose:
+    logging.getLogger().setLevel(logging.WARNING)
+
+  report = run_benchmark(args)
+  print_report(report)
+
+  if args.output:
+    with open(args.output, "w") as file:
+      json.dump(report, file, indent=2)
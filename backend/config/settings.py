@@ -7,22 +7,42 @@ USER_NAME = "Ronald"
 CHAR_LENGTH = 100                                   # Set character length for AI response (set in the system message)
 MIN_SENTENCE_LENGTH = 50                            # For non-streaming mode
 MAX_MESSAGES = 8                                    # Set max number of message to store in chat_history
+MAX_SESSIONS = 100                                  # Max number of conversations kept in memory, the least recently used is dropped first
 
 # ChatOpenAI Settings
 TEMPERATURE = 0.9                                   # Set from 0 to 1 (the closer to 1 the more creative the responses)
 OPENAI_MODEL = "gpt-3.5-turbo"                      # OpenAI chatbot engine
 MAX_TOKENS = 50                                     # Set max tockens for response from chatbot
+STREAM_RESPONSE = True                              # Stream the response and start speaking each sentence as soon as it is complete
+RESPONSE_WORKERS = 3                                # Number of queued messages that can be answered at once (replies still play in order)
 
 
 #####################
 # AI AUDIO SETTINGS #
 #####################
 OPENAI_WHISPER_MODEL = "whisper-1"                  # OpenAI transcription engine
+WHISPER_UPLOAD_SAMPLE_RATE = 16000                  # Recorded speech is downsampled to this rate before it is uploaded, Whisper works at 16 kHz
+WHISPER_UPLOAD_FORMAT = "flac"                      # Format recorded speech is uploaded in, "flac" (about half the size) or "wav"
+
+# Speech-to-text engine
+STT_ENGINE = "whisper_api"                          # "whisper_api", or a local CPU engine: "faster_whisper" (pip install faster-whisper) or "vosk" (pip install vosk)
+LOCAL_STT_MODEL = "base.en"                         # faster-whisper model size or path (ie. "tiny.en", "base.en", "small.en"), or the path of the unpacked Vosk model folder
+LOCAL_STT_COMPUTE_TYPE = "int8"                     # faster-whisper quantization, int8 is the fastest on CPU
+LOCAL_STT_THREADS = 0                               # CPU threads used by faster-whisper, 0 for the default
 LISTEN_KEYWORD_QUIT = "goodbye"                     # Best to use a word with more than 2 sylables + keep it lowercase
 
 # Periodic timer in listen mode
 LISTEN_PERIODIC_MESSAGE_TIMER = 60                  # Checks if it's time in seconds to send a periodic message
 
+# Streaming listen mode
+LISTEN_STREAMING = False                            # Set to True to transcribe while the user is still speaking, best with a local STT_ENGINE since every partial transcript is a transcription
+LISTEN_PARTIAL_INTERVAL = 1.0                       # Seconds between partial transcripts while the user is speaking
+LISTEN_PAUSE_THRESHOLD = 0.8                        # Seconds of silence that end an utterance
+
+# Microphone capture
+LISTEN_RECALIBRATE_DRIFT = 0.5                      # The energy threshold is recalibrated in the background once the ambient noise level changed by this fraction
+LISTEN_DEVICE_IDLE_TIMEOUT = 5                      # Seconds a microphone stays open after a listening round, so the next round doesn't reopen it (0 closes it right away). Its calibration is kept either way
+
 # ElevenLabs Settings
 USE_ELABS = False                                   # Set to True if you want to use ElevenLabs, set to False for testing
 ELABS_STREAM = True                                 # Set to True for voice streaming mode
@@ -30,6 +50,14 @@ AI_VOICE = "Freya"                                  # For standard client output
 AI_VOICE_ID = "jsCqWAovK2LkecY7zXl4"                # ID required for streaming (For stream_audio function)
 ELABS_MODEL = "eleven_monolingual_v1"               # Voice engine
 USE_GOOGLE = True                                   # Set to True if you want to use Google Cloud's TTS
+AUDIO_SAMPLE_RATE = 24000                           # Sample rate of the audio output stream (ElevenLabs streaming and Google TTS)
+GOOGLE_RAW_PCM = False                              # Set to True to get raw PCM from Google TTS instead of WAV (needs a client library that supports AudioEncoding.PCM)
+
+# Synthesized audio cache
+AUDIO_CACHE_MEMORY_MB = 32                          # Max size of the in-memory audio cache
+AUDIO_CACHE_DISK_MB = 256                           # Max size of the on-disk audio cache, least recently used files are deleted first
+AUDIO_CACHE_DIR = "audio_cache"                     # Folder of the on-disk audio cache, relative to the backend folder (empty to disable)
+AUDIO_CACHE_PREWARM = True                          # Synthesize the personality's canned responses at startup
 
 
 #########################
@@ -39,6 +67,9 @@ OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"   # OpenAI embedding engine
 
 # Vector Database Settings
 PINECONE_INDEX_NAME = "openai-embeddings"           # Name of vector database (index name)
+VECTOR_BACKEND = "pinecone"                         # "pinecone" or "local" (searches embeddings.txt in memory)
+EMBEDDER = "openai"                                 # "openai" or "stub" (offline embeddings for testing)
+EMBEDDING_CACHE_SIZE = 256                          # Number of query embeddings to keep in memory
 
 
 ###############################
@@ -59,6 +90,7 @@ ai_mood = "neutral"                                 # Initial AI mood
 # Sentiment analysis max levels
 MAX_LEVEL = 10                                      # Max level on the sentiment scale
 MIN_LEVEL = -10                                     # Min level on the sentiment scale
+SENTIMENT_CACHE_SIZE = 1024                         # Number of message scores to keep, repeated chat messages are only scored once
 
 
 #######################
@@ -67,3 +99,32 @@ MIN_LEVEL = -10                                     # Min level on the sentiment
 
 MOD_REPLACE_RESPONSE = False                        # Set variable to True if you want the whole ai_response to be replaced
 MOD_REPLACE_PROFANITY = "-"                         # Set text to replace profanity, ie. Using "-", result in "What the ----!"
+MODERATE_INPUT = True                               # Set variable to True to moderate user messages before the AI responds to them
+LOCAL_MODERATION = True                             # Set variable to True to clear clean text locally and only send ambiguous text to OpenAI's moderation
+MODERATION_CACHE_SIZE = 1024                        # Number of moderation verdicts cached by text hash
+MODERATION_TIMEOUT = 3                              # Seconds to wait for OpenAI's moderation before using the local verdict
+MODERATION_PRIORITY = [                             # Order used to pick a category when several are violated with the same score
+  "sexual", "hate", "harassment", "self-harm", "sexual/minors", "hate/threatening", "violence/graphic",
+  "self-harm/intent", "self-harm/instructions", "harassment/threatening", "violence"
+]
+MODERATION_THRESHOLDS = {}                          # Minimum score per category before a canned reply is used, ie. {"harassment": 0.8}. Unset categories use OpenAI's decision
+
+
+#########################
+# YOUTUBE CHAT SETTINGS #
+#########################
+YOUTUBE_BUFFER_SIZE = 20                            # Max number of ranked chat messages waiting to be answered
+YOUTUBE_MAX_MESSAGE_AGE = 60                        # Seconds before a chat message is too old to answer
+YOUTUBE_MIN_POLL_INTERVAL = 1                       # Fastest chat polling, used while replies keep up with the chat
+YOUTUBE_MAX_POLL_INTERVAL = 10                      # Slowest chat polling, used while replies are backed up
+YOUTUBE_STREAM_RATE_LIMIT = 0                       # Max replies per minute to each stream, 0 for no limit. Streams take turns when several are watched either way
+YOUTUBE_REPLAY_DIR = ""                             # Folder of recorded chats (<video id>.jsonl) to replay instead of connecting to YouTube, for testing
+
+
+####################
+# TRACING SETTINGS #
+####################
+TRACING_ENABLED = True                              # Record how long each stage of a response takes (queue wait, sentiment, completion, moderation, TTS, playback...)
+TRACE_FILE = ""                                     # File in the backend folder the traces are appended to as JSON lines (ie. "traces.jsonl"), "" to disable
+TRACE_FILE_MAX_MB = 10                              # Size at which the trace file is rotated to <TRACE_FILE>.1, replacing the previous one
+TRACE_COLLECTOR_URL = ""                            # URL the traces are also posted to in batches, ie. a local collector. "" to disable
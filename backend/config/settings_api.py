@@ -12,21 +12,44 @@ MAX_MESSAGES = settings['MAIN_AI_SETTINGS']['MAX_MESSAGES']
 TEMPERATURE = settings['MAIN_AI_SETTINGS']['TEMPERATURE']
 OPENAI_MODEL = settings['MAIN_AI_SETTINGS']['OPENAI_MODEL']
 MAX_TOKENS = settings['MAIN_AI_SETTINGS']['MAX_TOKENS']
+STREAM_RESPONSE = settings['MAIN_AI_SETTINGS']['STREAM_RESPONSE']
+RESPONSE_WORKERS = settings['MAIN_AI_SETTINGS']['RESPONSE_WORKERS']
+MAX_SESSIONS = settings['MAIN_AI_SETTINGS']['MAX_SESSIONS']
 
 # Import AI audio settings variables
 OPENAI_WHISPER_MODEL = settings['AI_AUDIO_SETTINGS']['OPENAI_WHISPER_MODEL']
+WHISPER_UPLOAD_SAMPLE_RATE = settings['AI_AUDIO_SETTINGS']['WHISPER_UPLOAD_SAMPLE_RATE']
+WHISPER_UPLOAD_FORMAT = settings['AI_AUDIO_SETTINGS']['WHISPER_UPLOAD_FORMAT']
+STT_ENGINE = settings['AI_AUDIO_SETTINGS']['STT_ENGINE']
+LOCAL_STT_MODEL = settings['AI_AUDIO_SETTINGS']['LOCAL_STT_MODEL']
+LOCAL_STT_COMPUTE_TYPE = settings['AI_AUDIO_SETTINGS']['LOCAL_STT_COMPUTE_TYPE']
+LOCAL_STT_THREADS = settings['AI_AUDIO_SETTINGS']['LOCAL_STT_THREADS']
 LISTEN_KEYWORD_QUIT = settings['AI_AUDIO_SETTINGS']['LISTEN_KEYWORD_QUIT']
 LISTEN_PERIODIC_MESSAGE_TIMER = settings['AI_AUDIO_SETTINGS']['LISTEN_PERIODIC_MESSAGE_TIMER']
+LISTEN_STREAMING = settings['AI_AUDIO_SETTINGS']['LISTEN_STREAMING']
+LISTEN_PARTIAL_INTERVAL = settings['AI_AUDIO_SETTINGS']['LISTEN_PARTIAL_INTERVAL']
+LISTEN_PAUSE_THRESHOLD = settings['AI_AUDIO_SETTINGS']['LISTEN_PAUSE_THRESHOLD']
+LISTEN_RECALIBRATE_DRIFT = settings['AI_AUDIO_SETTINGS']['LISTEN_RECALIBRATE_DRIFT']
+LISTEN_DEVICE_IDLE_TIMEOUT = settings['AI_AUDIO_SETTINGS']['LISTEN_DEVICE_IDLE_TIMEOUT']
 USE_ELABS = settings['AI_AUDIO_SETTINGS']['USE_ELABS']
 ELABS_STREAM = settings['AI_AUDIO_SETTINGS']['ELABS_STREAM']
 AI_VOICE = settings['AI_AUDIO_SETTINGS']['AI_VOICE']
 AI_VOICE_ID = settings['AI_AUDIO_SETTINGS']['AI_VOICE_ID']
 ELABS_MODEL = settings['AI_AUDIO_SETTINGS']['ELABS_MODEL']
 USE_GOOGLE = settings['AI_AUDIO_SETTINGS']['USE_GOOGLE']
+AUDIO_SAMPLE_RATE = settings['AI_AUDIO_SETTINGS']['AUDIO_SAMPLE_RATE']
+GOOGLE_RAW_PCM = settings['AI_AUDIO_SETTINGS']['GOOGLE_RAW_PCM']
+AUDIO_CACHE_MEMORY_MB = settings['AI_AUDIO_SETTINGS']['AUDIO_CACHE_MEMORY_MB']
+AUDIO_CACHE_DISK_MB = settings['AI_AUDIO_SETTINGS']['AUDIO_CACHE_DISK_MB']
+AUDIO_CACHE_DIR = settings['AI_AUDIO_SETTINGS']['AUDIO_CACHE_DIR']
+AUDIO_CACHE_PREWARM = settings['AI_AUDIO_SETTINGS']['AUDIO_CACHE_PREWARM']
 
 # Import AI embedding settings variables
 OPENAI_EMBEDDING_MODEL = settings['AI_EMBEDDING_SETTINGS']['OPENAI_EMBEDDING_MODEL']
 PINECONE_INDEX_NAME = settings['AI_EMBEDDING_SETTINGS']['PINECONE_INDEX_NAME']
+VECTOR_BACKEND = settings['AI_EMBEDDING_SETTINGS']['VECTOR_BACKEND']
+EMBEDDER = settings['AI_EMBEDDING_SETTINGS']['EMBEDDER']
+EMBEDDING_CACHE_SIZE = settings['AI_EMBEDDING_SETTINGS']['EMBEDDING_CACHE_SIZE']
 
 # Import AI sentiment settings variables
 SENTIMENT_SCORES = settings['SENTIMENT_ANALYSIS_SETTINGS']['SENTIMENT_SCORES']
@@ -34,10 +57,31 @@ accumulated_sentiment = settings['SENTIMENT_ANALYSIS_SETTINGS']['accumulated_sen
 ai_mood = settings['SENTIMENT_ANALYSIS_SETTINGS']['ai_mood']
 MAX_LEVEL = settings['SENTIMENT_ANALYSIS_SETTINGS']['MAX_LEVEL']
 MIN_LEVEL = settings['SENTIMENT_ANALYSIS_SETTINGS']['MIN_LEVEL']
+SENTIMENT_CACHE_SIZE = settings['SENTIMENT_ANALYSIS_SETTINGS']['SENTIMENT_CACHE_SIZE']
 
 # Import AI moderation settings variables
 MOD_REPLACE_RESPONSE = settings['MODERATION_SETTINGS']['MOD_REPLACE_RESPONSE']
 MOD_REPLACE_PROFANITY = settings['MODERATION_SETTINGS']['MOD_REPLACE_PROFANITY']
+MODERATE_INPUT = settings['MODERATION_SETTINGS']['MODERATE_INPUT']
+LOCAL_MODERATION = settings['MODERATION_SETTINGS']['LOCAL_MODERATION']
+MODERATION_CACHE_SIZE = settings['MODERATION_SETTINGS']['MODERATION_CACHE_SIZE']
+MODERATION_TIMEOUT = settings['MODERATION_SETTINGS']['MODERATION_TIMEOUT']
+MODERATION_PRIORITY = settings['MODERATION_SETTINGS']['MODERATION_PRIORITY']
+MODERATION_THRESHOLDS = settings['MODERATION_SETTINGS']['MODERATION_THRESHOLDS']
+
+# Import YouTube live chat settings variables
+YOUTUBE_BUFFER_SIZE = settings['YOUTUBE_SETTINGS']['YOUTUBE_BUFFER_SIZE']
+YOUTUBE_MAX_MESSAGE_AGE = settings['YOUTUBE_SETTINGS']['YOUTUBE_MAX_MESSAGE_AGE']
+YOUTUBE_MIN_POLL_INTERVAL = settings['YOUTUBE_SETTINGS']['YOUTUBE_MIN_POLL_INTERVAL']
+YOUTUBE_MAX_POLL_INTERVAL = settings['YOUTUBE_SETTINGS']['YOUTUBE_MAX_POLL_INTERVAL']
+YOUTUBE_STREAM_RATE_LIMIT = settings['YOUTUBE_SETTINGS']['YOUTUBE_STREAM_RATE_LIMIT']
+YOUTUBE_REPLAY_DIR = settings['YOUTUBE_SETTINGS']['YOUTUBE_REPLAY_DIR']
+
+# Import tracing settings variables
+TRACING_ENABLED = settings['TRACING_SETTINGS']['TRACING_ENABLED']
+TRACE_FILE = settings['TRACING_SETTINGS']['TRACE_FILE']
+TRACE_FILE_MAX_MB = settings['TRACING_SETTINGS']['TRACE_FILE_MAX_MB']
+TRACE_COLLECTOR_URL = settings['TRACING_SETTINGS']['TRACE_COLLECTOR_URL']
 
 settings_app = Blueprint('settings_app', __name__)
 
@@ -50,26 +94,73 @@ settings_data = {
   "TEMPERATURE": TEMPERATURE,
   "OPENAI_MODEL": OPENAI_MODEL,
   "MAX_TOKENS": MAX_TOKENS,
+  "STREAM_RESPONSE": STREAM_RESPONSE,
+  "RESPONSE_WORKERS": RESPONSE_WORKERS,
+  "MAX_SESSIONS": MAX_SESSIONS,
   "OPENAI_WHISPER_MODEL": OPENAI_WHISPER_MODEL,
+  "WHISPER_UPLOAD_SAMPLE_RATE": WHISPER_UPLOAD_SAMPLE_RATE,
+  "WHISPER_UPLOAD_FORMAT": WHISPER_UPLOAD_FORMAT,
+  "STT_ENGINE": STT_ENGINE,
+  "LOCAL_STT_MODEL": LOCAL_STT_MODEL,
+  "LOCAL_STT_COMPUTE_TYPE": LOCAL_STT_COMPUTE_TYPE,
+  "LOCAL_STT_THREADS": LOCAL_STT_THREADS,
   "LISTEN_KEYWORD_QUIT": LISTEN_KEYWORD_QUIT,
   "LISTEN_PERIODIC_MESSAGE_TIMER": LISTEN_PERIODIC_MESSAGE_TIMER,
+  "LISTEN_STREAMING": LISTEN_STREAMING,
+  "LISTEN_PARTIAL_INTERVAL": LISTEN_PARTIAL_INTERVAL,
+  "LISTEN_PAUSE_THRESHOLD": LISTEN_PAUSE_THRESHOLD,
+  "LISTEN_RECALIBRATE_DRIFT": LISTEN_RECALIBRATE_DRIFT,
+  "LISTEN_DEVICE_IDLE_TIMEOUT": LISTEN_DEVICE_IDLE_TIMEOUT,
   "USE_ELABS": USE_ELABS,
   "USE_GOOGLE": USE_GOOGLE,
   "ELABS_STREAM": ELABS_STREAM,
   "AI_VOICE": AI_VOICE,
   "AI_VOICE_ID": AI_VOICE_ID,
   "ELABS_MODEL": ELABS_MODEL,
+  "AUDIO_SAMPLE_RATE": AUDIO_SAMPLE_RATE,
+  "GOOGLE_RAW_PCM": GOOGLE_RAW_PCM,
+  "AUDIO_CACHE_MEMORY_MB": AUDIO_CACHE_MEMORY_MB,
+  "AUDIO_CACHE_DISK_MB": AUDIO_CACHE_DISK_MB,
+  "AUDIO_CACHE_DIR": AUDIO_CACHE_DIR,
+  "AUDIO_CACHE_PREWARM": AUDIO_CACHE_PREWARM,
   "OPENAI_EMBEDDING_MODEL": OPENAI_EMBEDDING_MODEL,
   "PINECONE_INDEX_NAME": PINECONE_INDEX_NAME,
+  "VECTOR_BACKEND": VECTOR_BACKEND,
+  "EMBEDDER": EMBEDDER,
+  "EMBEDDING_CACHE_SIZE": EMBEDDING_CACHE_SIZE,
   "accumulated_sentiment": accumulated_sentiment,
   "SENTIMENT_SCORES": SENTIMENT_SCORES,
   "ai_mood": ai_mood,
   "MAX_LEVEL": MAX_LEVEL,
   "MIN_LEVEL": MIN_LEVEL,
+  "SENTIMENT_CACHE_SIZE": SENTIMENT_CACHE_SIZE,
   "MOD_REPLACE_RESPONSE": MOD_REPLACE_RESPONSE,
-  "MOD_REPLACE_PROFANITY": MOD_REPLACE_PROFANITY
+  "MOD_REPLACE_PROFANITY": MOD_REPLACE_PROFANITY,
+  "MODERATE_INPUT": MODERATE_INPUT,
+  "LOCAL_MODERATION": LOCAL_MODERATION,
+  "MODERATION_CACHE_SIZE": MODERATION_CACHE_SIZE,
+  "MODERATION_TIMEOUT": MODERATION_TIMEOUT,
+  "MODERATION_PRIORITY": MODERATION_PRIORITY,
+  "MODERATION_THRESHOLDS": MODERATION_THRESHOLDS,
+  "YOUTUBE_BUFFER_SIZE": YOUTUBE_BUFFER_SIZE,
+  "YOUTUBE_MAX_MESSAGE_AGE": YOUTUBE_MAX_MESSAGE_AGE,
+  "YOUTUBE_MIN_POLL_INTERVAL": YOUTUBE_MIN_POLL_INTERVAL,
+  "YOUTUBE_MAX_POLL_INTERVAL": YOUTUBE_MAX_POLL_INTERVAL,
+  "YOUTUBE_STREAM_RATE_LIMIT": YOUTUBE_STREAM_RATE_LIMIT,
+  "YOUTUBE_REPLAY_DIR": YOUTUBE_REPLAY_DIR,
+  "TRACING_ENABLED": TRACING_ENABLED,
+  "TRACE_FILE": TRACE_FILE,
+  "TRACE_FILE_MAX_MB": TRACE_FILE_MAX_MB,
+  "TRACE_COLLECTOR_URL": TRACE_COLLECTOR_URL
 }
 
+# Functions that report runtime stats, keyed by name
+runtime_stats = {}
+
+# Register a function that reports runtime stats through the settings API
+def register_runtime_stats(name, get_stats):
+  runtime_stats[name] = get_stats
+
 @settings_app.route('/get_settings', methods=['GET'])
 def get_settings():
   try:
@@ -77,6 +168,14 @@ def get_settings():
   except Exception as e:
     return jsonify({"error": str(e)}), 400
 
+@settings_app.route('/get_runtime_stats', methods=['GET'])
+def get_runtime_stats():
+  try:
+    stats = {name: get_stats() for name, get_stats in runtime_stats.items()}
+    return jsonify({"message": "Runtime stats fetched successfully", "stats": stats}), 200
+  except Exception as e:
+    return jsonify({"error": str(e)}), 400
+
 @settings_app.route('/update_settings', methods=['POST'])
 def update_settings(): 
   try:
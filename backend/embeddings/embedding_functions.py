@@ -1,37 +1,87 @@
 # Import necessary libraries
 import os
 import openai
-import pinecone
+import logging
+from functools import lru_cache
 from dotenv import load_dotenv
 
 # Import settings variables
 from ..config.load_settings import settings
+from .local_index import LocalVectorIndex, stub_embed
+from ..tracing import span
+from ..metrics import track_upstream
 
 # Import settings variables
 OPENAI_EMBEDDING_MODEL = settings['AI_EMBEDDING_SETTINGS']['OPENAI_EMBEDDING_MODEL']
 PINECONE_INDEX_NAME = settings['AI_EMBEDDING_SETTINGS']['PINECONE_INDEX_NAME']
+VECTOR_BACKEND = settings['AI_EMBEDDING_SETTINGS']['VECTOR_BACKEND']
+EMBEDDER = settings['AI_EMBEDDING_SETTINGS']['EMBEDDER']
+EMBEDDING_CACHE_SIZE = settings['AI_EMBEDDING_SETTINGS']['EMBEDDING_CACHE_SIZE']
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Load environment variables
 load_dotenv("../config/.env")
 
 # Initialize API keys
 openai.api_key = os.environ.get("OPENAI_EMBEDDINGS_API_KEY")
-pinecone_api_key = os.environ.get("PINECONE_API_KEY")
-pinecone_environment = os.environ.get("PINECONE_API_ENVIRONMENT")
-
-# Initialize Pinecone
-pinecone.init(api_key=pinecone_api_key, environment=pinecone_environment)
-
-# Connect to index
-index = pinecone.Index(PINECONE_INDEX_NAME)
-
-# Create embedding for query
-def search_query(query):
-  xq = res = openai.Embedding.create(
-    input=[query],
-    engine=OPENAI_EMBEDDING_MODEL
-  )['data'][0]['embedding']
-  
-  res = index.query([xq], top_k=2, include_metadata=True)
-  
+
+# Files used by the local vector index
+EMBEDDINGS_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_CORPUS_PATH = os.path.join(EMBEDDINGS_DIR, "embeddings.txt")
+LOCAL_INDEX_CACHE_PATH = os.path.join(EMBEDDINGS_DIR, "local_index.npz")
+
+# Create embeddings for a list of texts
+def embed_texts(texts):
+  if EMBEDDER == "stub":
+    return stub_embed(texts)
+
+  with track_upstream("openai_embeddings"):
+    res = openai.Embedding.create(
+      input=texts,
+      engine=OPENAI_EMBEDDING_MODEL
+    )
+  return [record['embedding'] for record in res['data']]
+
+# Create embedding for query, repeated queries are served from the cache
+@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def embed_query(query):
+  return tuple(embed_texts([query])[0])
+
+# Connect to the selected vector database
+if VECTOR_BACKEND == "local":
+
+  # Load the knowledge base into memory
+  index = LocalVectorIndex.from_file(LOCAL_CORPUS_PATH, embed_texts, f"{EMBEDDER}:{OPENAI_EMBEDDING_MODEL}", LOCAL_INDEX_CACHE_PATH)
+
+else:
+  import pinecone
+
+  pinecone_api_key = os.environ.get("PINECONE_API_KEY")
+  pinecone_environment = os.environ.get("PINECONE_API_ENVIRONMENT")
+
+  # Initialize Pinecone
+  pinecone.init(api_key=pinecone_api_key, environment=pinecone_environment)
+
+  # Connect to index
+  index = pinecone.Index(PINECONE_INDEX_NAME)
+
+# Find the knowledge base entries closest to the query
+def search_query(query, top_k=2):
+  with span("embedding", embedder=EMBEDDER):
+    xq = list(embed_query(query.strip()))
+
+  with span("vector_query", backend=VECTOR_BACKEND, top_k=top_k):
+    if VECTOR_BACKEND == "local":
+      return index.query(xq, top_k=top_k)
+
+    with track_upstream("pinecone"):
+      res = index.query([xq], top_k=top_k, include_metadata=True)
+
   return res['matches']
+
+# Get the query embedding cache stats
+def get_embedding_cache_stats():
+  cache_info = embed_query.cache_info()
+  return {'hits': cache_info.hits, 'misses': cache_info.misses, 'size': cache_info.currsize, 'max_size': cache_info.maxsize}
@@ -1,110 +1,199 @@
 # # # # #
-# To use this file, you must run `python generate_pinecone_embeddings.py` in terminal in the directory that this file is in
+# To use this file, run `python -m backend.embeddings.generate_pinecone_embeddings` from the folder that contains `backend`
 # This file is not used within the app, instead, it is used to generate embeddings and store them in our Pinecone index
-# Uncomment the code that you need to use
+#
+# Each line of the input file is stored with the hash of its content as id, so adding, removing or moving lines leaves
+# the other vectors alone and duplicate lines share one vector. An edited line is a new line: its old vector is deleted
+# and a new one is inserted, vectors are never updated in place. Lines already stored by a previous run are skipped, the
+# vectors of lines that are gone are deleted, and progress is saved to a checkpoint file after every upsert, so an
+# interrupted run picks up where it stopped. Use `--index local` to ingest into a local JSON file instead.
+#
+# Indexes filled by the old version of this script use line numbers as ids and have no checkpoint. Run it once with
+# `--reset` to clear them, otherwise every line would be stored twice.
 # # # # #
 
 # Import necessary libraries
 import os
+import json
+import hashlib
+import logging
+import argparse
 import openai
-import pinecone
 from dotenv import load_dotenv
 from tqdm.auto import tqdm
 
 # Import settings variables
 from ..config.load_settings import settings
+from .local_index import InMemoryIndex, stub_embed
 
 # Import settings variables
 OPENAI_EMBEDDING_MODEL = settings['AI_EMBEDDING_SETTINGS']['OPENAI_EMBEDDING_MODEL']
 PINECONE_INDEX_NAME = settings['AI_EMBEDDING_SETTINGS']['PINECONE_INDEX_NAME']
 
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
 # Load environment variables
 load_dotenv("../config/.env")
 
 # Initialize API keys
 openai.api_key = os.environ.get("OPENAI_EMBEDDINGS_API_KEY")
-pinecone_api_key = os.environ.get("PINECONE_API_KEY")
-pinecone_environment = os.environ.get("PINECONE_API_ENVIRONMENT")
-
-# Initialize Pinecone
-pinecone.init(api_key=pinecone_api_key, environment=pinecone_environment)
-
-# Connect to index
-index = pinecone.Index(PINECONE_INDEX_NAME)
-
-# # # # #
-# Generate and store embeddings
-# # # # #
-
-## Read the embeddings.txt file
-## This file contains the data we want to embed
-# with open("embeddings.txt", "r") as file:
-#   lines = file.readlines()
-
-# for i, line in enumerate(tqdm(lines)):
-
-#   # Create embeddings
-#   res = openai.Embedding.create(
-#     input=[line],
-#     engine=OPENAI_EMBEDDING_MODEL
-#   )
-
-#   # Extract embeddings to a list
-#   embeds = [record['embedding'] for record in res['data']]
-
-#   # Prep metadata and upsert batch
-#   meta = [{'content': line}]
-#   to_upsert = [(str(i), embeds[0], meta[0])]  # Each record is a tuple of (id, vector, metadata)
-
-#   # Upsert to Pinecone
-#   index.upsert(vectors=list(to_upsert))
-
-# # # # #
-
-# # # # #
-# Sample Query function
-# # # # #
-
-# def search_query(query):
-#   xq = res = openai.Embedding.create(
-#     input=[query],
-#     engine=OPENAI_EMBEDDING_MODEL
-#   )['data'][0]['embedding']
-#   res = index.query([xq], top_k=2, include_metadata=True)
-#   return res['matches']
-
-# matches = search_query("What's your easter egg?")
-# for match in matches:
-#   print(f"{match['score']:.2f}: {match['metadata']}")
-
-# # # # #
-
-# # # # #
-# View index stats
-# # # # #
-# print(index.describe_index_stats())
-
-# # # # #
-
-# # # # #
-# Sample view data by id and output to a txt file
-# # # # #
-# with open("output.txt", "w") as f:
-#   f.write(str(index.fetch(ids=["0"])))
-
-# # # # #
-
-# # # # #
-# Sample view update data by id
-# # # # #
-# index.update(id="0", set_metadata={"content": "Ronald Lopez is a Product Designer, a father, and a self-taught developer."})
-# print(index.fetch(["0"]))
-
-# # # # #
-
-# # # # #
-# Delete data by id
-# # # # #
-# index.delete(ids=["0", "1"])
 
-# # # # #
\ No newline at end of file
+# Default files
+EMBEDDINGS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INPUT_PATH = os.path.join(EMBEDDINGS_DIR, "embeddings.txt")
+DEFAULT_CHECKPOINT_PATH = os.path.join(EMBEDDINGS_DIR, "ingest_checkpoint.json")
+DEFAULT_LOCAL_INDEX_PATH = os.path.join(EMBEDDINGS_DIR, "local_index.json")
+
+# Connect to the index that receives the vectors
+def connect_index(index_type, local_index_path):
+  if index_type == "local":
+    return InMemoryIndex(local_index_path)
+
+  import pinecone
+
+  # Initialize Pinecone
+  pinecone.init(api_key=os.environ.get("PINECONE_API_KEY"), environment=os.environ.get("PINECONE_API_ENVIRONMENT"))
+
+  # Connect to index
+  return pinecone.Index(PINECONE_INDEX_NAME)
+
+# Create embeddings for a batch of lines
+def embed_batch(lines, embedder):
+  if embedder == "stub":
+    return [vector.tolist() for vector in stub_embed(lines)]
+
+  res = openai.Embedding.create(
+    input=lines,
+    engine=OPENAI_EMBEDDING_MODEL
+  )
+  return [record['embedding'] for record in res['data']]
+
+# Id of a line's vector, the hash of its content
+def line_id(line):
+  return hashlib.sha256(line.encode()).hexdigest()
+
+# Embedder and model a vector was made with, lines stored by another one are embedded again
+def embedder_key(embedder):
+  return f"{embedder}:{OPENAI_EMBEDDING_MODEL}"
+
+# Load the checkpoint of a previous run, it maps each stored id to the embedder_key it was made with.
+# It is ignored if it was made for a different index
+def load_checkpoint(path, index_name):
+  if os.path.exists(path):
+    with open(path, "r") as file:
+      checkpoint = json.load(file)
+    if checkpoint.get('index') == index_name:
+
+      # Checkpoints of line number ids only list ids to delete
+      ids = checkpoint.get('ids', {})
+      ids.update({vector_id: None for vector_id in checkpoint.pop('hashes', {})})
+      checkpoint['ids'] = ids
+      return checkpoint
+
+  return {'index': index_name, 'ids': {}}
+
+# Save the checkpoint, replacing the old file only once the new one is fully written
+def save_checkpoint(path, checkpoint):
+  temp_path = f"{path}.tmp"
+  with open(temp_path, "w") as file:
+    json.dump(checkpoint, file)
+  os.replace(temp_path, path)
+
+# Embed and upsert a batch of (id, line) records
+def ingest_batch(index, records, checkpoint, args):
+  embeds = embed_batch([line for _, line in records], args.embedder)
+  key = embedder_key(args.embedder)
+
+  # Upsert in chunks, saving progress after each one
+  for start in range(0, len(records), args.upsert_batch_size):
+    chunk = records[start:start + args.upsert_batch_size]
+
+    # Each record is a tuple of (id, vector, metadata)
+    chunk_embeds = embeds[start:start + args.upsert_batch_size]
+    index.upsert(vectors=[(vector_id, embed, {'content': line}) for (vector_id, line), embed in zip(chunk, chunk_embeds)])
+
+    for vector_id, _ in chunk:
+      checkpoint['ids'][vector_id] = key
+    save_checkpoint(args.checkpoint, checkpoint)
+
+# Generate and store embeddings for every new or changed line of the input file
+def ingest(args):
+  index = connect_index(args.index, args.local_index_path)
+  index_name = args.local_index_path if args.index == "local" else PINECONE_INDEX_NAME
+
+  # Start over from an empty index if requested, otherwise resume from the last checkpoint
+  if args.reset:
+    index.delete(delete_all=True)
+    checkpoint = {'index': index_name, 'ids': {}}
+    save_checkpoint(args.checkpoint, checkpoint)
+  else:
+    checkpoint = load_checkpoint(args.checkpoint, index_name)
+
+    # Without a checkpoint the vectors already in the index can't be told apart, they may be line number ids of the old script
+    if not checkpoint['ids'] and index.describe_index_stats()['total_vector_count']:
+      raise SystemExit(f"Index {index_name} already has vectors but there is no checkpoint for it at {args.checkpoint}. "
+                       "Run again with --reset to clear the index and embed every line again.")
+
+  key = embedder_key(args.embedder)
+  seen_ids = set()
+  pending = []
+  skipped = 0
+  upserted = 0
+
+  # Stream the input file line by line
+  with open(args.input, "r") as file:
+    for line in tqdm(file):
+      line = line.strip()
+      if not line:
+        continue
+
+      # Skip duplicate lines and lines that are already stored
+      vector_id = line_id(line)
+      if vector_id in seen_ids:
+        skipped += 1
+        continue
+      seen_ids.add(vector_id)
+
+      if checkpoint['ids'].get(vector_id) == key:
+        skipped += 1
+        continue
+
+      pending.append((vector_id, line))
+
+      if len(pending) >= args.embed_batch_size:
+        ingest_batch(index, pending, checkpoint, args)
+        upserted += len(pending)
+        pending = []
+
+  if pending:
+    ingest_batch(index, pending, checkpoint, args)
+    upserted += len(pending)
+
+  # Delete the vectors of lines that were removed
+  stale_ids = [vector_id for vector_id in checkpoint['ids'] if vector_id not in seen_ids]
+  if stale_ids:
+    index.delete(ids=stale_ids)
+    for vector_id in stale_ids:
+      del checkpoint['ids'][vector_id]
+    save_checkpoint(args.checkpoint, checkpoint)
+
+  logging.info(f"Ingestion finished. Upserted: {upserted}, unchanged: {skipped}, deleted: {len(stale_ids)}")
+  logging.info(index.describe_index_stats())
+
+# Parse the command line arguments
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description="Embed a text file line by line and store the vectors in Pinecone. "
+                                   "Vectors are keyed by the hash of their line, an edited line is deleted and inserted again.")
+  parser.add_argument("--input", default=DEFAULT_INPUT_PATH, help="Text file with one entry per line")
+  parser.add_argument("--embed-batch-size", type=int, default=100, help="Number of lines per embedding request")
+  parser.add_argument("--upsert-batch-size", type=int, default=100, help="Number of vectors per upsert request")
+  parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH, help="File used to resume an interrupted run")
+  parser.add_argument("--index", choices=["pinecone", "local"], default="pinecone", help="Store vectors in Pinecone or in a local JSON file")
+  parser.add_argument("--local-index-path", default=DEFAULT_LOCAL_INDEX_PATH, help="JSON file used by the local index")
+  parser.add_argument("--embedder", choices=["openai", "stub"], default="openai", help="Use OpenAI or offline stub embeddings")
+  parser.add_argument("--reset", action="store_true", help="Clear the index and embed every line again, needed once for an index filled without a checkpoint")
+  return parser.parse_args(argv)
+
+if __name__ == "__main__":
+  ingest(parse_args())
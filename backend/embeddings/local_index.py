@@ -0,0 +1,126 @@
+# Import necessary libraries
+import os
+import json
+import re
+import hashlib
+import logging
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Size of the vectors made by the stub embedder, same as text-embedding-ada-002
+STUB_DIMENSIONS = 1536
+
+# Offline embedder for tests. Hashes each word into a bucket, so texts sharing words get similar vectors
+def stub_embed(texts, dimensions=STUB_DIMENSIONS):
+  vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+  for row, text in enumerate(texts):
+    for word in re.findall(r"\w+", text.lower()):
+      bucket = int.from_bytes(hashlib.md5(word.encode()).digest()[:4], "little")
+      vectors[row, bucket % dimensions] += 1.0
+  return vectors
+
+# In-process vector index that searches the whole corpus with a single matrix product
+class LocalVectorIndex:
+  def __init__(self, vectors, metadata):
+    vectors = np.asarray(vectors, dtype=np.float32)
+
+    # Normalize once, so cosine similarity is a plain dot product at query time
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    self.vectors = vectors / np.where(norms == 0, 1, norms)
+    self.metadata = metadata
+
+  # Build the index from a text file with one entry per line.
+  # Vectors are saved to cache_path and reused while the file and the embedding model don't change
+  @classmethod
+  def from_file(cls, corpus_path, embed_texts, model_name, cache_path=None, batch_size=100):
+    with open(corpus_path, "r") as file:
+      lines = [line.strip() for line in file if line.strip()]
+
+    # Fingerprint of the corpus and model the vectors were made with
+    fingerprint = hashlib.sha256("\n".join([model_name] + lines).encode()).hexdigest()
+
+    # Reuse the saved vectors if they are still up to date
+    if cache_path and os.path.exists(cache_path):
+      saved = np.load(cache_path)
+      if str(saved["fingerprint"]) == fingerprint:
+        logging.info(f"Loaded {len(lines)} local embeddings from {cache_path}")
+        return cls(saved["vectors"], [{'content': line} for line in lines])
+
+    # Embed the corpus in batches
+    vectors = []
+    for start in range(0, len(lines), batch_size):
+      vectors.extend(embed_texts(lines[start:start + batch_size]))
+    vectors = np.asarray(vectors, dtype=np.float32)
+
+    if cache_path:
+      np.savez(cache_path, vectors=vectors, fingerprint=fingerprint)
+
+    logging.info(f"Embedded {len(lines)} lines into the local index")
+    return cls(vectors, [{'content': line} for line in lines])
+
+  def __len__(self):
+    return len(self.metadata)
+
+  # Get the top_k most similar entries, in the same format as Pinecone matches
+  def query(self, vector, top_k=2):
+    if not len(self):
+      return []
+
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    scores = self.vectors @ (vector / norm if norm else vector)
+
+    # Partially sort to find the best top_k, then order them by score
+    top_k = min(top_k, len(scores))
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    best = best[np.argsort(-scores[best])]
+
+    return [{'id': str(i), 'score': float(scores[i]), 'metadata': self.metadata[i]} for i in best]
+
+# Stand-in for a Pinecone index that keeps vectors in memory and optionally in a JSON file
+class InMemoryIndex:
+  def __init__(self, path=None):
+    self.path = path
+    self.records = {} # id -> {'values': vector, 'metadata': metadata}
+
+    if path and os.path.exists(path):
+      with open(path, "r") as file:
+        self.records = json.load(file)
+
+  # Insert or update vectors given as (id, vector, metadata) tuples
+  def upsert(self, vectors):
+    for vector_id, values, metadata in vectors:
+      self.records[vector_id] = {'values': [float(value) for value in values], 'metadata': metadata}
+    self.save()
+    return {'upserted_count': len(vectors)}
+
+  # Delete vectors by id, or every vector like Pinecone's delete_all
+  def delete(self, ids=(), delete_all=False):
+    if delete_all:
+      self.records.clear()
+    for vector_id in ids:
+      self.records.pop(vector_id, None)
+    self.save()
+
+  def fetch(self, ids):
+    return {'vectors': {vector_id: self.records[vector_id] for vector_id in ids if vector_id in self.records}}
+
+  def describe_index_stats(self):
+    return {'total_vector_count': len(self.records)}
+
+  # Query in the same format as Pinecone
+  def query(self, queries, top_k=2, include_metadata=True):
+    ids = list(self.records)
+    local_index = LocalVectorIndex([self.records[i]['values'] for i in ids], [self.records[i]['metadata'] for i in ids])
+    matches = local_index.query(queries[0], top_k=top_k) if ids else []
+    for match in matches:
+      match['id'] = ids[int(match['id'])]
+    return {'matches': matches}
+
+  # Save the records to the JSON file
+  def save(self):
+    if self.path:
+      with open(self.path, "w") as file:
+        json.dump(self.records, file)
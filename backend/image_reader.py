@@ -6,6 +6,7 @@ import tempfile
 import base64
 from transformers import pipeline
 from dotenv import load_dotenv
+from .metrics import track_upstream
 
 # Load environment variables from .env file
 load_dotenv("config/.env")
@@ -71,7 +72,9 @@ def image2text(filename):
       data = f.read()
 
     # Get response from image-to-text model
-    response = requests.post(API_URL, headers=headers, data=data)
+    with track_upstream("huggingface"):
+      response = requests.post(API_URL, headers=headers, data=data)
+      response.raise_for_status()
 
   except Exception as e:
     logging.error(f"An error occurred while using Image-To-Text model: {e}")
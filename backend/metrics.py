@@ -0,0 +1,218 @@
+# Import necessary libraries
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Format the labels of a sample, ie. {source="input"}
+def format_labels(label_names, label_values, extra=""):
+  labels = [f'{name}="{escape_label(value)}"' for name, value in zip(label_names, label_values)]
+  if extra:
+    labels.append(extra)
+  return "{" + ",".join(labels) + "}" if labels else ""
+
+# Escape a label value for the Prometheus text format
+def escape_label(value):
+  return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# Format a sample value, Prometheus wants +Inf instead of inf
+def format_value(value):
+  if value == float("inf"):
+    return "+Inf"
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+# A value that only goes up, one per combination of label values
+class Counter:
+  type = "counter"
+
+  def __init__(self, name, description, label_names=()):
+    self.name = name
+    self.description = description
+    self.label_names = tuple(label_names)
+    self.values = {}
+    self.lock = Lock()
+
+  def inc(self, *label_values, amount=1):
+    with self.lock:
+      self.values[label_values] = self.values.get(label_values, 0) + amount
+
+  # Get the samples as (suffix, labels, value)
+  def samples(self):
+    with self.lock:
+      values = list(self.values.items())
+    return [("", format_labels(self.label_names, label_values), value) for label_values, value in values]
+
+# Counts observations into cumulative buckets, one set of buckets per combination of label values
+class Histogram:
+  type = "histogram"
+
+  def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+    self.name = name
+    self.description = description
+    self.label_names = tuple(label_names)
+    self.buckets = tuple(buckets)
+    self.values = {} # Label values -> [bucket counts, sum, count]
+    self.lock = Lock()
+
+  def observe(self, value, *label_values):
+    index = bisect_left(self.buckets, value)
+    with self.lock:
+      entry = self.values.get(label_values)
+      if entry is None:
+        entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+      entry[0][index] += 1
+      entry[1] += value
+      entry[2] += 1
+
+  # Time a block of code
+  @contextmanager
+  def time(self, *label_values):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - start, *label_values)
+
+  # Get the samples as (suffix, labels, value), buckets are cumulative
+  def samples(self):
+    with self.lock:
+      values = [(label_values, list(counts), total, count) for label_values, (counts, total, count) in self.values.items()]
+
+    samples = []
+    for label_values, counts, total, count in values:
+      cumulative = 0
+      for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+        cumulative += bucket_count
+        samples.append(("_bucket", format_labels(self.label_names, label_values, f'le="{format_value(bound)}"'), cumulative))
+      samples.append(("_sum", format_labels(self.label_names, label_values), total))
+      samples.append(("_count", format_labels(self.label_names, label_values), count))
+    return samples
+
+# A metric read from a function when the metrics are scraped, for stats that are already counted elsewhere.
+# The function returns a list of (label values, value)
+class CallbackMetric:
+  def __init__(self, name, description, metric_type, label_names, collect):
+    self.name = name
+    self.description = description
+    self.type = metric_type
+    self.label_names = tuple(label_names)
+    self.collect = collect
+
+  def samples(self):
+    return [("", format_labels(self.label_names, label_values), value) for label_values, value in self.collect()]
+
+# Keeps every metric and renders them in the Prometheus text format
+class MetricsRegistry:
+  def __init__(self):
+    self.metrics = {}
+    self.lock = Lock()
+
+  def register(self, metric):
+    with self.lock:
+      self.metrics[metric.name] = metric
+    return metric
+
+  def counter(self, name, description, label_names=()):
+    return self.register(Counter(name, description, label_names))
+
+  def histogram(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+    return self.register(Histogram(name, description, label_names, buckets))
+
+  def callback(self, name, description, metric_type, label_names, collect):
+    return self.register(CallbackMetric(name, description, metric_type, label_names, collect))
+
+  # Render every metric, a metric whose callback fails is left out
+  def render(self):
+    with self.lock:
+      metrics = list(self.metrics.values())
+
+    lines = []
+    for metric in metrics:
+      try:
+        samples = metric.samples()
+      except Exception:
+        continue
+
+      lines.append(f"# HELP {metric.name} {metric.description}")
+      lines.append(f"# TYPE {metric.name} {metric.type}")
+      for suffix, labels, value in samples:
+        lines.append(f"{metric.name}{suffix}{labels} {format_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+# Initialize the registry at startup
+metrics_registry = MetricsRegistry()
+
+# Metrics updated by the response pipeline
+requests_total = metrics_registry.counter("assistant_requests_total", "Requests handled, by source", ["source"])
+request_duration = metrics_registry.histogram("assistant_request_duration_seconds", "Time to handle a request, from queueing to the end of playback", ["source"])
+upstream_latency = metrics_registry.histogram("assistant_upstream_latency_seconds", "Latency of calls to upstream providers", ["provider"])
+upstream_errors = metrics_registry.counter("assistant_upstream_errors_total", "Failed calls to upstream providers", ["provider"])
+tts_audio_seconds = metrics_registry.counter("assistant_tts_audio_seconds_total", "Seconds of speech synthesized, cached audio excluded", ["engine"])
+
+# Time a call to an upstream provider and count it as an error if it raises
+@contextmanager
+def track_upstream(provider):
+  start = time.perf_counter()
+  try:
+    yield
+  except Exception:
+    upstream_errors.inc(provider)
+    raise
+  finally:
+    upstream_latency.observe(time.perf_counter() - start, provider)
+
+# Expose the depth of the source queues and the QueueMonitor buffers, and the items the buffers dropped
+def register_queue_metrics(queues, queue_monitor):
+  metrics_registry.callback("assistant_queue_depth", "Items waiting in the source queues", "gauge", ["queue"],
+                            lambda: [((name,), queue.qsize()) for name, queue in queues.items()])
+
+  metrics_registry.callback("assistant_queue_buffered", "Items waiting in the response dispatcher buffers", "gauge", ["buffer"],
+                            lambda: [((name,), stats['pending']) for name, stats in queue_monitor.get_metrics().items()])
+
+  metrics_registry.callback("assistant_queue_dropped_total", "Items dropped because a dispatcher buffer was full", "counter", ["buffer"],
+                            lambda: [((name,), stats['dropped']) for name, stats in queue_monitor.get_metrics().items()])
+
+  metrics_registry.callback("assistant_queue_processed_total", "Items the response dispatcher took from its buffers", "counter", ["buffer"],
+                            lambda: [((name,), stats['processed']) for name, stats in queue_monitor.get_metrics().items()])
+
+  metrics_registry.callback("assistant_queue_wait_seconds_total", "Time the processed items waited in the response dispatcher buffers", "counter", ["buffer"],
+                            lambda: [((name,), stats['avg_wait'] * stats['processed']) for name, stats in queue_monitor.get_metrics().items()])
+
+  metrics_registry.callback("assistant_response_workers_in_flight", "Responses being generated", "gauge", [],
+                            lambda: [((), queue_monitor.get_worker_stats()['in_flight'])])
+
+# Reasons a chat message is dropped before it is answered, and the ingestion stat counting them
+CHAT_DROP_REASONS = {'duplicate': 'duplicates', 'spam': 'spam', 'buffer_full': 'dropped', 'expired': 'expired'}
+
+# Expose the chat ingestion of each watched stream, get_ingest_stats maps a video id to its ChatIngestor stats
+def register_chat_metrics(get_ingest_stats):
+  metrics_registry.callback("assistant_chat_messages_received_total", "Chat messages received, by stream", "counter", ["stream"],
+                            lambda: [((video_id,), stats['received']) for video_id, stats in get_ingest_stats().items()])
+
+  metrics_registry.callback("assistant_chat_messages_dropped_total", "Chat messages dropped before they were answered, by stream and reason", "counter", ["stream", "reason"],
+                            lambda: [((video_id, reason), stats[stat]) for video_id, stats in get_ingest_stats().items() for reason, stat in CHAT_DROP_REASONS.items()])
+
+  metrics_registry.callback("assistant_chat_buffered", "Chat messages ranked and waiting to be answered, by stream", "gauge", ["stream"],
+                            lambda: [((video_id,), stats['buffered']) for video_id, stats in get_ingest_stats().items()])
+
+# Expose the hits and misses of the caches, cache_stats maps a cache name to a function returning a dict with hits and misses
+def register_cache_metrics(cache_stats):
+  metrics_registry.callback("assistant_cache_hits_total", "Cache lookups served from the cache", "counter", ["cache"],
+                            lambda: [((name,), get_stats()['hits']) for name, get_stats in cache_stats.items()])
+
+  metrics_registry.callback("assistant_cache_misses_total", "Cache lookups that missed", "counter", ["cache"],
+                            lambda: [((name,), get_stats()['misses']) for name, get_stats in cache_stats.items()])
+
+# Expose the moderation policy's decisions, get_policy_stats returns its stats: replies per category, flagged messages
+# under the thresholds (passed) and messages that weren't flagged (clean)
+def register_moderation_metrics(get_policy_stats):
+  def collect():
+    stats = get_policy_stats()
+    samples = [((category,), count) for category, count in stats['decisions'].items()]
+    return samples + [(("passed",), stats['passed']), (("clean",), stats['clean'])]
+
+  metrics_registry.callback("assistant_moderation_decisions_total", "Moderation decisions, by the category a canned reply was given for, passed or clean", "counter", ["decision"], collect)
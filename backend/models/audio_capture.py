@@ -0,0 +1,302 @@
+# Import necessary libraries
+import time
+import logging
+import statistics
+from collections import deque
+from threading import Thread, Condition, Lock, Event
+import speech_recognition as sr
+from .streaming_listener import SpeechSegmenter
+
+# Import settings
+from ..config.load_settings import settings
+
+# Import settings variables
+LISTEN_RECALIBRATE_DRIFT = settings['AI_AUDIO_SETTINGS']['LISTEN_RECALIBRATE_DRIFT']
+LISTEN_DEVICE_IDLE_TIMEOUT = settings['AI_AUDIO_SETTINGS']['LISTEN_DEVICE_IDLE_TIMEOUT']
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Energy threshold the calibration starts from, 300 is the default value of the SR library
+INITIAL_ENERGY_THRESHOLD = 400
+
+# Seconds of audio measured to calibrate a microphone that was just opened
+CALIBRATION_SECONDS = 0.5
+
+# Seconds a microphone that was just opened has to deliver its calibration audio, a muted or unplugged one is closed after that
+CALIBRATION_TIMEOUT = 5
+
+# Seconds of audio the ambient noise level is measured over, the median keeps speech from counting as noise
+AMBIENT_WINDOW_SECONDS = 3
+
+# Seconds of audio kept for a listener that isn't reading, older audio is dropped
+BUFFER_SECONDS = 5
+
+# Energy threshold adjust_for_ambient_noise(duration=CALIBRATION_SECONDS) settles on for a steady ambient noise level,
+# starting from INITIAL_ENERGY_THRESHOLD. Worked out directly so a recalibration doesn't have to read the microphone again
+def calibrated_threshold(ambient_energy):
+  recognizer = sr.Recognizer()
+  damping = recognizer.dynamic_energy_adjustment_damping ** CALIBRATION_SECONDS
+  return INITIAL_ENERGY_THRESHOLD * damping + ambient_energy * recognizer.dynamic_energy_ratio * (1 - damping)
+
+# Audio source handed to a listener, it reads the chunks of a shared CaptureDevice.
+# Works as a source for speech_recognition's listen_in_background and for StreamingListener, entering it doesn't reopen the device
+class CaptureStream(sr.AudioSource):
+  def __init__(self, device):
+    self.device = device
+    self.SAMPLE_RATE = device.microphone.SAMPLE_RATE
+    self.SAMPLE_WIDTH = device.microphone.SAMPLE_WIDTH
+    self.CHUNK = device.microphone.CHUNK
+    self.energy_threshold = device.energy_threshold # Calibrated threshold when the listener started
+    self.stream = self
+    self.chunks = deque(maxlen=max(1, int(BUFFER_SECONDS * self.SAMPLE_RATE / self.CHUNK)))
+    self.condition = Condition()
+    self.closed = False
+    self.on_end = None # Called if the device stops while the stream is still being read
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    pass
+
+  # Add a chunk read by the device
+  def push(self, chunk):
+    with self.condition:
+      self.chunks.append(chunk)
+      self.condition.notify()
+
+  # Get the next chunk, b"" once the stream is closed (the end of the stream for speech_recognition)
+  def read(self, size=None):
+    with self.condition:
+      while not self.chunks and not self.closed:
+        self.condition.wait()
+      return self.chunks.popleft() if self.chunks else b""
+
+  # Stop receiving audio, the device stays open for the next listener
+  def close(self):
+    self.device.unsubscribe(self)
+    with self.condition:
+      self.closed = True
+      self.condition.notify_all()
+
+  # The device stopped, wake the reader up with the end of the stream and tell the listener
+  def end(self):
+    with self.condition:
+      if self.closed:
+        return
+      self.closed = True
+      self.condition.notify_all()
+
+    if self.on_end is not None:
+      self.on_end()
+
+# A microphone kept open between listening rounds. Its thread reads the audio continuously, hands it to the listening streams
+# and keeps track of the ambient noise level, the energy threshold is recalibrated when the level drifts.
+# calibrations maps a device index to its last (energy threshold, ambient energy), so a reopened microphone isn't calibrated again
+class CaptureDevice:
+  def __init__(self, device_index, calibrations):
+    self.device_index = device_index
+    self.calibrations = calibrations
+    self.microphone = None
+    self.lock = Lock()
+    self.streams = []
+    self.closed = False
+    self.calibrated = Event()
+    self.energy_threshold = INITIAL_ENERGY_THRESHOLD
+    self.ambient_energy = None # Ambient noise level the threshold was calibrated for
+    self.idle_since = None # Set once the last listener left
+    self.thread = None
+    self.stats = {'calibrations': 0, 'overflows': 0}
+
+    # Reuse the calibration of the last time the microphone was open
+    calibration = calibrations.get(device_index)
+    if calibration is not None:
+      self.energy_threshold, self.ambient_energy = calibration
+      self.calibrated.set()
+
+  # Open the microphone, its thread calibrates it unless it was calibrated before. Raises OSError if it can't be opened
+  def open(self):
+    self.microphone = sr.Microphone(device_index=self.device_index)
+    self.microphone.__enter__()
+
+    # speech_recognition leaves the stream unset when the device can't be opened
+    if self.microphone.stream is None:
+      raise OSError(f"Could not open microphone {self.device_index}")
+
+    self.thread = Thread(target=self.run, name=f"audio_capture_{self.device_index}", daemon=True)
+    self.thread.start()
+
+  # Wait until the microphone is calibrated. Closes it and raises OSError if no calibration audio came within CALIBRATION_TIMEOUT seconds
+  def wait_calibrated(self):
+    if not self.calibrated.wait(CALIBRATION_TIMEOUT):
+      self.close()
+      raise OSError(f"Microphone {self.device_index} sent no audio for {CALIBRATION_TIMEOUT} seconds")
+
+  # Get a stream of the microphone's audio, None if the device was closed.
+  # Taking the device lock makes the idle close and the subscription exclusive, a subscribed stream is never closed as idle
+  def subscribe(self):
+    with self.lock:
+      if self.closed:
+        return None
+      stream = CaptureStream(self)
+      self.streams.append(stream)
+      self.idle_since = None
+      return stream
+
+  def unsubscribe(self, stream):
+    with self.lock:
+      if stream in self.streams:
+        self.streams.remove(stream)
+      if not self.streams:
+        self.idle_since = time.monotonic()
+
+  # Check if the last listener left LISTEN_DEVICE_IDLE_TIMEOUT seconds ago
+  def is_idle(self):
+    return self.idle_since is not None and time.monotonic() - self.idle_since >= LISTEN_DEVICE_IDLE_TIMEOUT
+
+  # Wait for the capture thread to release the microphone
+  def join(self, timeout=1):
+    if self.thread is not None:
+      self.thread.join(timeout)
+
+  # Capture thread
+  def run(self):
+    microphone = self.microphone
+    seconds_per_chunk = microphone.CHUNK / microphone.SAMPLE_RATE
+    calibration_chunks = max(1, round(CALIBRATION_SECONDS / seconds_per_chunk))
+    energies = deque(maxlen=max(calibration_chunks, round(AMBIENT_WINDOW_SECONDS / seconds_per_chunk)))
+    chunks_since_check = 0
+
+    try:
+      while True:
+        with self.lock:
+          if self.closed:
+            break
+
+          # Close once idle, in the same lock as subscribe so no listener gets a stream that is about to end
+          if self.is_idle():
+            self.closed = True
+            break
+
+          streams = list(self.streams)
+
+        chunk = microphone.stream.read(microphone.CHUNK)
+        energies.append(SpeechSegmenter.energy(chunk))
+        for stream in streams:
+          if len(stream.chunks) == stream.chunks.maxlen:
+            self.stats['overflows'] += 1
+          stream.push(chunk)
+
+        # Calibrate on the first half second of audio, like adjust_for_ambient_noise
+        if not self.calibrated.is_set():
+          if len(energies) >= calibration_chunks:
+            self.recalibrate(sum(energies) / len(energies))
+            self.calibrated.set()
+          continue
+
+        # Check the ambient noise level about once a second, and recalibrate once it drifted LISTEN_RECALIBRATE_DRIFT from the calibrated level
+        chunks_since_check += 1
+        if chunks_since_check * seconds_per_chunk >= 1 and len(energies) == energies.maxlen:
+          chunks_since_check = 0
+          ambient_energy = statistics.median(energies)
+          if abs(ambient_energy - self.ambient_energy) > LISTEN_RECALIBRATE_DRIFT * max(self.ambient_energy, 1):
+            self.recalibrate(ambient_energy)
+
+    except Exception as e:
+      logging.error(f"An error occurred while reading microphone {self.device_index}: {e}")
+
+    self.close()
+    self.release()
+
+  # Work out the energy threshold for an ambient noise level, used by the next listening rounds
+  def recalibrate(self, ambient_energy):
+    with self.lock:
+      self.energy_threshold = calibrated_threshold(ambient_energy)
+      self.ambient_energy = ambient_energy
+      self.stats['calibrations'] += 1
+      self.calibrations[self.device_index] = (self.energy_threshold, ambient_energy)
+    logging.info(f"Microphone {self.device_index} calibrated, ambient energy {ambient_energy:.0f}, energy threshold {self.energy_threshold:.0f}")
+
+  # Stop the capture thread and end the streams still reading the microphone
+  def close(self):
+    with self.lock:
+      self.closed = True
+      streams = list(self.streams)
+      self.streams.clear()
+
+    for stream in streams:
+      stream.end()
+
+    # Release the waiting opener if the device failed before it was calibrated
+    self.calibrated.set()
+
+  # Close the microphone once the capture thread stopped reading it
+  def release(self):
+    try:
+      self.microphone.__exit__(None, None, None)
+    except Exception as e:
+      logging.error(f"An error occurred while closing microphone {self.device_index}: {e}")
+
+    logging.info(f"Microphone {self.device_index} closed")
+
+  def get_stats(self):
+    with self.lock:
+      return {
+        'listeners': len(self.streams),
+        'energy_threshold': round(self.energy_threshold),
+        'ambient_energy': round(self.ambient_energy) if self.ambient_energy is not None else None,
+        'calibrations': self.stats['calibrations'],
+        'overflows': self.stats['overflows']
+      }
+
+# Keeps the microphones open and calibrated between listening rounds, one per device index, and the energy threshold
+# of every device once it closed, so a listening round starts without measuring the ambient noise again
+class AudioCaptureManager:
+  def __init__(self):
+    self.devices = {}
+    self.calibrations = {} # Device index -> (energy threshold, ambient energy)
+    self.lock = Lock()
+
+  # Get a stream of a microphone's audio, opening the microphone if needed and calibrating it on first use.
+  # Every listener waits for the calibration before subscribing, so none reads calibration audio or an unset threshold.
+  # The wait happens outside the lock, a microphone that sends no audio only holds up its own listeners.
+  # Raises OSError if it can't be opened or calibrated, AttributeError if PyAudio isn't installed
+  def open(self, device_index):
+
+    # A device can close between the calibration and the subscription (ie. for being idle), it is opened again once
+    for _ in range(2):
+      with self.lock:
+        device = self.devices.get(device_index)
+
+        # The device closed, let it release the microphone before opening it again
+        if device is not None and device.closed:
+          del self.devices[device_index]
+          device.join()
+          device = None
+
+        if device is None:
+          device = CaptureDevice(device_index, self.calibrations)
+          device.open()
+          self.devices[device_index] = device
+
+      device.wait_calibrated()
+      stream = device.subscribe()
+      if stream is not None:
+        return stream
+
+    raise OSError(f"Microphone {device_index} stopped while it was opened")
+
+  # Close every microphone, at shutdown
+  def close_all(self):
+    with self.lock:
+      devices = list(self.devices.values())
+      self.devices.clear()
+    for device in devices:
+      device.close()
+      device.join()
+
+  def get_stats(self):
+    with self.lock:
+      devices = [(device_index, device) for device_index, device in self.devices.items() if not device.closed]
+    return {str(device_index): device.get_stats() for device_index, device in devices}
@@ -0,0 +1,189 @@
+# Import necessary libraries
+import struct
+import logging
+from threading import Lock
+import pyaudio
+import requests
+from requests.adapters import HTTPAdapter
+from google.cloud import texttospeech
+from ..metrics import track_upstream
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Number of frames written into the output stream at a time
+FRAMES_PER_WRITE = 4096
+
+# Read the format and the PCM data of a WAV file held in memory.
+# Returns (pcm, sample width, channels, rate), pcm is a memoryview into the buffer, not a copy
+def parse_wav(buffer):
+  view = memoryview(buffer)
+
+  if bytes(view[0:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+    raise ValueError("Audio is not a WAV file")
+
+  audio_format = None
+  offset = 12
+
+  # Walk the chunks until the audio data is found
+  while offset + 8 <= len(view):
+    chunk_id = bytes(view[offset:offset + 4])
+    chunk_size, = struct.unpack_from("<I", view, offset + 4)
+    chunk_start = offset + 8
+
+    if chunk_id == b"fmt ":
+      _, channels, rate, _, _, bits_per_sample = struct.unpack_from("<HHIIHH", view, chunk_start)
+      audio_format = (bits_per_sample // 8, channels, rate)
+
+    elif chunk_id == b"data":
+      if audio_format is None:
+        raise ValueError("WAV data chunk found before the fmt chunk")
+
+      # Some encoders write an unknown data size, in that case use the rest of the buffer
+      chunk_end = len(view) if chunk_size in (0, 0xFFFFFFFF) else min(chunk_start + chunk_size, len(view))
+      return (view[chunk_start:chunk_end],) + audio_format
+
+    # Chunks are padded to an even size
+    offset = chunk_start + chunk_size + (chunk_size % 2)
+
+  raise ValueError("WAV file has no data chunk")
+
+# Split PCM audio into slices of FRAMES_PER_WRITE frames without copying it
+def iter_pcm_slices(pcm, frame_size):
+  view = memoryview(pcm)
+  step = FRAMES_PER_WRITE * frame_size
+  for start in range(0, len(view), step):
+    yield view[start:start + step]
+
+# Long-lived audio engine. Owns one client per text-to-speech provider, a keep-alive HTTP session for
+# ElevenLabs and one output stream that every utterance is written into
+class AudioEngine:
+  def __init__(self, elabs_api_key):
+    self.elabs_api_key = elabs_api_key
+    self.lock = Lock() # Guards creating the clients and the output stream
+    self.output_lock = Lock() # Only one utterance plays at a time
+
+    # Google Cloud text-to-speech client, created on first use
+    self.google_client = None
+
+    # Pooled HTTP session, keeps the connection to ElevenLabs open between utterances
+    self.http_session = requests.Session()
+    self.http_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+    # Output device
+    self.pyaudio = None
+    self.output_stream = None
+    self.output_format = None # (sample width, channels, rate) of the open stream
+
+  # Get the Google Cloud text-to-speech client
+  def get_google_client(self):
+    with self.lock:
+      if self.google_client is None:
+        self.google_client = texttospeech.TextToSpeechClient()
+      return self.google_client
+
+  # Get the output stream, it is only reopened if the audio format changes
+  def get_output_stream(self, sample_width, channels, rate):
+    with self.lock:
+      output_format = (sample_width, channels, rate)
+
+      if self.output_stream is not None and self.output_format == output_format:
+        return self.output_stream
+
+      if self.pyaudio is None:
+        self.pyaudio = pyaudio.PyAudio()
+
+      # Close the stream opened for a different format
+      if self.output_stream is not None:
+        self.output_stream.stop_stream()
+        self.output_stream.close()
+
+      self.output_stream = self.pyaudio.open(format=self.pyaudio.get_format_from_width(sample_width),
+                                             channels=channels,
+                                             rate=rate,
+                                             output=True)
+      self.output_format = output_format
+      logging.info(f"Audio output stream opened: {rate} Hz, {channels} channel(s), {sample_width * 8} bit")
+
+      return self.output_stream
+
+  # Write a single utterance given as chunks of PCM audio into the output stream
+  def play_pcm(self, chunks, sample_width=2, channels=1, rate=24000):
+    frame_size = sample_width * channels
+
+    with self.output_lock:
+      stream = self.get_output_stream(sample_width, channels, rate)
+
+      # Only write whole frames, keep the rest for the next chunk
+      remainder = b""
+      for chunk in chunks:
+
+        # Write aligned chunks as they are, without copying them
+        if not remainder and len(chunk) % frame_size == 0:
+          stream.write(chunk)
+          continue
+
+        data = remainder + bytes(chunk)
+        whole = len(data) - len(data) % frame_size
+        if whole:
+          stream.write(data[:whole])
+        remainder = data[whole:]
+
+  # Write a WAV file held in memory into the output stream
+  def play_wav(self, buffer):
+    pcm, sample_width, channels, rate = parse_wav(buffer)
+    self.play_pcm(iter_pcm_slices(pcm, sample_width * channels), sample_width=sample_width, channels=channels, rate=rate)
+
+  # Stream PCM audio from ElevenLabs over the pooled session
+  def stream_elevenlabs(self, text, voice_id, model, rate=24000, chunk_size=4096):
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
+
+    headers = {
+      "Accept": "*/*",
+      "Content-Type": "application/json",
+      "xi-api-key": self.elabs_api_key
+    }
+
+    data = {
+      "text": text,
+      "model_id": model,
+      "voice_settings": {
+        "stability": 0.5,
+        "similarity_boost": 0.5
+      }
+    }
+
+    # Request raw PCM so it can be written straight into the output stream.
+    # The upstream latency is the time until the audio starts arriving
+    with track_upstream("elevenlabs"):
+      response = self.http_session.post(url, headers=headers, json=data, params={"output_format": f"pcm_{rate}"}, stream=True)
+      if not response.ok:
+        response.close()
+        response.raise_for_status()
+
+    with response:
+      yield from response.iter_content(chunk_size=chunk_size)
+
+  # Synthesize speech with Google Cloud text-to-speech
+  def synthesize_google(self, text, voice, audio_config):
+    with track_upstream("google_tts"):
+      return self.get_google_client().synthesize_speech(
+        input=texttospeech.SynthesisInput(text=text),
+        voice=voice,
+        audio_config=audio_config
+      )
+
+  # Release the output device and the HTTP session
+  def close(self):
+    with self.lock:
+      if self.output_stream is not None:
+        self.output_stream.stop_stream()
+        self.output_stream.close()
+        self.output_stream = None
+        self.output_format = None
+
+      if self.pyaudio is not None:
+        self.pyaudio.terminate()
+        self.pyaudio = None
+
+    self.http_session.close()
@@ -0,0 +1,101 @@
+# Import necessary libraries
+from collections import deque
+from itertools import islice
+
+# Use tiktoken for exact token counts if it is installed, otherwise estimate them
+try:
+  import tiktoken
+except ImportError:
+  tiktoken = None
+
+# Context window of each OpenAI chat model, in tokens
+MODEL_CONTEXT_WINDOWS = {
+  "gpt-3.5-turbo": 4096,
+  "gpt-3.5-turbo-16k": 16385,
+  "gpt-4": 8192,
+  "gpt-4-32k": 32768
+}
+
+# Context window used for models missing from MODEL_CONTEXT_WINDOWS
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# Extra tokens the chat format adds for every message, and once to prime the reply
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Average number of characters per token, used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+# Cache of tiktoken encodings by model
+encodings = {}
+
+# Get the tiktoken encoding for a model
+def get_encoding(model):
+  if model not in encodings:
+    try:
+      encodings[model] = tiktoken.encoding_for_model(model)
+    except KeyError:
+      encodings[model] = tiktoken.get_encoding("cl100k_base")
+  return encodings[model]
+
+# Count the tokens in a text
+def count_tokens(text, model="gpt-3.5-turbo"):
+  if tiktoken is None:
+    return -(-len(text) // CHARS_PER_TOKEN)
+  return len(get_encoding(model).encode(text))
+
+# Count the tokens a chat message uses in the prompt
+def count_message_tokens(message, model="gpt-3.5-turbo"):
+  return count_tokens(message["content"], model) + TOKENS_PER_MESSAGE
+
+# Trim a text to at most max_tokens tokens
+def truncate_to_tokens(text, max_tokens, model="gpt-3.5-turbo"):
+  if max_tokens <= 0:
+    return ""
+  if tiktoken is None:
+    return text[:max_tokens * CHARS_PER_TOKEN]
+  encoding = get_encoding(model)
+  return encoding.decode(encoding.encode(text)[:max_tokens])
+
+# Get the context window of a chat model
+def get_context_window(model):
+  return MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+# Fixed-capacity chat history that counts each message's tokens once, when it is added
+class ChatHistory:
+  def __init__(self, max_messages, model="gpt-3.5-turbo"):
+    self.max_messages = max_messages
+    self.model = model
+    self.messages = deque() # (message, token count) pairs, oldest first
+    self.total_tokens = 0 # Prompt tokens of every message in the history
+
+  def __len__(self):
+    return len(self.messages)
+
+  # Add a message, dropping the oldest one if the history is full
+  def append(self, message):
+
+    # System messages are never sent back as chat history, so they are not stored
+    if message["role"] == "system":
+      return
+
+    if len(self.messages) == self.max_messages:
+      _, dropped_tokens = self.messages.popleft()
+      self.total_tokens -= dropped_tokens
+
+    tokens = count_message_tokens(message, self.model)
+    self.messages.append((message, tokens))
+    self.total_tokens += tokens
+
+  # Get the newest messages that fit in the token budget, oldest first
+  def get_messages(self, token_budget=None):
+    start = 0
+
+    # Skip the oldest messages until the rest fits in the budget
+    if token_budget is not None:
+      excess = self.total_tokens - token_budget
+      while excess > 0 and start < len(self.messages):
+        excess -= self.messages[start][1]
+        start += 1
+
+    return [message for message, _ in islice(self.messages, start, None)]
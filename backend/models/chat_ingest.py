@@ -0,0 +1,308 @@
+# Import necessary libraries
+import re
+import math
+import time
+import logging
+from collections import deque
+from threading import Lock
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Weights of the signals that make a chat message worth answering
+QUESTION_WEIGHT = 2.0 # Questions invite a reply
+SENTIMENT_WEIGHT = 1.0 # Multiplied by the sentiment intensity, strong feelings make better replies
+MEMBER_WEIGHT = 1.5 # Channel members and moderators
+SUPERCHAT_WEIGHT = 3.0 # Paid messages, plus the log of the amount
+NEW_AUTHOR_WEIGHT = 0.5 # Authors that were not answered recently
+REPEAT_AUTHOR_PENALTY = 2.0 # Authors answered within AUTHOR_COOLDOWN seconds
+SHORT_MESSAGE_PENALTY = 1.0 # Messages of fewer than MIN_WORDS words
+AUTHOR_COOLDOWN = 120
+MIN_WORDS = 3
+
+# Messages kept however slow the measured reply rate is, so chat that just became active isn't cut down to one message
+MIN_BUFFER_SIZE = 5
+
+# Spam patterns
+LINK_PATTERN = re.compile(r"https?://|www\.|\.(com|net|org|gg|ly)\b", re.IGNORECASE)
+REPEATED_CHARACTER_PATTERN = re.compile(r"(.)\1{5,}")
+EMOJI_PATTERN = re.compile(r":[\w-]+:")
+
+# Normalize a message so trivial variations of the same text are recognized as duplicates
+def normalize_message(text):
+  return " ".join(re.sub(r"[^\w\s]", "", text.lower()).split())
+
+# Check if a message looks like spam: links, character floods, emoji only or shouting
+def is_spam(text):
+  if LINK_PATTERN.search(text) or REPEATED_CHARACTER_PATTERN.search(text):
+    return True
+
+  # Messages made only of emoji codes and symbols
+  words = EMOJI_PATTERN.sub("", text)
+  if sum(character.isalpha() for character in words) < 2:
+    return True
+
+  # Long messages in all caps
+  letters = [character for character in words if character.isalpha()]
+  return len(letters) > 12 and all(character.isupper() for character in letters)
+
+# Keeps the best chat messages waiting to be answered. When full, the lowest scored message is dropped.
+# Scores fade with age, so old messages give way to newer ones and expire after max_age seconds
+class ChatBuffer:
+  def __init__(self, max_size, max_age):
+    self.max_size = max_size
+    self.max_age = max_age
+    self.items = []
+    self.dropped = 0
+    self.expired = 0
+
+  def __len__(self):
+    return len(self.items)
+
+  # Score of a message after fading with age
+  def effective_score(self, item, now):
+    return item['score'] * (1 - (now - item['received_at']) / self.max_age)
+
+  # Drop messages that are too old to answer
+  def expire(self, now):
+    kept = [item for item in self.items if now - item['received_at'] < self.max_age]
+    self.expired += len(self.items) - len(kept)
+    self.items = kept
+
+  # Add messages and keep only the best limit of them
+  def add(self, items, now, limit=None):
+    self.expire(now)
+    self.items.extend(items)
+
+    limit = min(limit or self.max_size, self.max_size)
+    if len(self.items) > limit:
+      self.items.sort(key=lambda item: self.effective_score(item, now), reverse=True)
+      self.dropped += len(self.items) - limit
+      del self.items[limit:]
+
+  # Take the best message, None if the buffer is empty
+  def pop_best(self, now):
+    self.expire(now)
+    if not self.items:
+      return None
+
+    best = max(range(len(self.items)), key=lambda index: self.effective_score(self.items[index], now))
+    return self.items.pop(best)
+
+# Matches the polling rate to how fast replies are actually spoken.
+# Polls back off while the response queue is full and speed up again when it runs dry,
+# and the reply rate it measures bounds how many messages are worth keeping.
+# The rate is only measured while messages were waiting, a quiet chat says nothing about how fast replies are spoken
+class AdaptiveRateController:
+  def __init__(self, min_interval, max_interval, smoothing=0.2, min_buffer_size=MIN_BUFFER_SIZE):
+    self.min_interval = min_interval
+    self.max_interval = max_interval
+    self.interval = min_interval
+    self.smoothing = smoothing
+    self.min_buffer_size = min_buffer_size
+    self.reply_rate = None # Messages handed off per second while messages were waiting, smoothed
+    self.last_update = None
+
+  # Update the interval after a poll, given how many messages were handed off, whether the queue pushed back
+  # and whether messages were waiting to be answered since the last poll
+  def update(self, delivered, backpressure, now, waiting=True):
+    if self.last_update is not None and now > self.last_update and (delivered or backpressure or waiting):
+      rate = delivered / (now - self.last_update)
+      self.reply_rate = rate if self.reply_rate is None else self.reply_rate + self.smoothing * (rate - self.reply_rate)
+    self.last_update = now
+
+    if backpressure:
+      self.interval = min(self.max_interval, self.interval * 1.5)
+    elif delivered:
+      self.interval = max(self.min_interval, self.interval * 0.7)
+
+  # Number of messages that can be answered before they expire at the measured reply rate, at least min_buffer_size
+  def buffer_limit(self, max_size, max_age):
+    if self.reply_rate is None:
+      return max_size
+    return min(max_size, max(self.min_buffer_size, math.ceil(self.reply_rate * max_age)))
+
+# Token bucket that limits how many messages of a stream are answered per minute, with bursts of up to burst messages
+class RateLimiter:
+  def __init__(self, per_minute, burst=1):
+    self.unlimited = not per_minute # 0 or None never limits
+    self.rate = (per_minute or 0) / 60
+    self.burst = burst
+    self.tokens = burst
+    self.updated_at = time.monotonic()
+
+  # Add the tokens earned since the last update
+  def refill(self, now):
+    self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+    self.updated_at = now
+
+  # Check if a message can be answered now
+  def available(self, now=None):
+    if self.unlimited:
+      return True
+    self.refill(time.monotonic() if now is None else now)
+    return self.tokens >= 1
+
+  # Spend a token
+  def consume(self, now=None):
+    if self.unlimited:
+      return
+    self.refill(time.monotonic() if now is None else now)
+    self.tokens -= 1
+
+  # Seconds until the next token
+  def wait_time(self, now=None):
+    if self.unlimited:
+      return 0.0
+    self.refill(time.monotonic() if now is None else now)
+    if self.tokens >= 1:
+      return 0.0
+    return (1 - self.tokens) / self.rate if self.rate else float("inf")
+
+# Turns raw chat batches into a ranked stream of messages worth answering:
+# deduplicates, filters spam, scores and buffers the best candidates.
+# Messages are added by the chat poller and taken by whoever feeds the response queue
+class ChatIngestor:
+  def __init__(self, is_question, analyze_batch, buffer_size=20, max_age=60, dedupe_window=300, min_interval=1, max_interval=10, max_length=200):
+    self.is_question = is_question # Function that tells if a message is a question
+    self.analyze_batch = analyze_batch # Function that scores the sentiment of a list of messages
+    self.max_length = max_length
+    self.buffer = ChatBuffer(buffer_size, max_age)
+    self.rate_controller = AdaptiveRateController(min_interval, max_interval)
+
+    # Normalized messages seen in the last dedupe_window seconds
+    self.dedupe_window = dedupe_window
+    self.recent_messages = deque()
+    self.recent_keys = {}
+
+    self.answered_authors = {} # author id -> time their last message was handed off
+    self.delivered_since_poll = 0
+    self.waiting_since_poll = False # Messages were waiting when the last poll finished
+    self.stats = {'received': 0, 'duplicates': 0, 'spam': 0, 'delivered': 0}
+    self.lock = Lock() # Guards the buffer, the authors and the stats
+
+  # Forget messages older than the dedupe window
+  def forget_old_messages(self, now):
+    while self.recent_messages and now - self.recent_messages[0][0] > self.dedupe_window:
+      _, key = self.recent_messages.popleft()
+      self.recent_keys[key] -= 1
+      if not self.recent_keys[key]:
+        del self.recent_keys[key]
+
+  # Drop duplicates, spam and all but the latest message of each author in the batch
+  def filter_batch(self, messages, now):
+    self.forget_old_messages(now)
+
+    latest_by_author = {}
+    for message in messages:
+      latest_by_author[message['author_id']] = message
+
+    kept = []
+    for message in latest_by_author.values():
+      key = normalize_message(message['message'])
+
+      if not key or key in self.recent_keys:
+        self.stats['duplicates'] += 1
+        continue
+
+      self.recent_messages.append((now, key))
+      self.recent_keys[key] = self.recent_keys.get(key, 0) + 1
+
+      if is_spam(message['message']):
+        self.stats['spam'] += 1
+        continue
+
+      kept.append(message)
+
+    self.stats['duplicates'] += len(messages) - len(latest_by_author)
+    return kept
+
+  # Score how worth answering a message is
+  def score(self, message, now):
+    score = 1.0
+
+    if self.is_question(message['message']):
+      score += QUESTION_WEIGHT
+
+    _, intensity = message['sentiment']
+    score += SENTIMENT_WEIGHT * intensity
+
+    if message.get('is_member'):
+      score += MEMBER_WEIGHT
+
+    if message.get('amount'):
+      score += SUPERCHAT_WEIGHT + math.log1p(message['amount'])
+
+    answered_at = self.answered_authors.get(message['author_id'])
+    if answered_at is None:
+      score += NEW_AUTHOR_WEIGHT
+    elif now - answered_at < AUTHOR_COOLDOWN:
+      score -= REPEAT_AUTHOR_PENALTY
+
+    if len(message['message'].split()) < MIN_WORDS:
+      score -= SHORT_MESSAGE_PENALTY
+
+    # Keep scores positive so fading with age always lowers them
+    return max(score, 0.1)
+
+  # Add a polled batch of messages, given as dicts with author, author_id, message, is_member and amount
+  def ingest(self, messages, now=None):
+    now = time.time() if now is None else now
+
+    # Score the sentiment outside the lock, it is the slow part
+    with self.lock:
+      self.stats['received'] += len(messages)
+      candidates = self.filter_batch(messages, now)
+    sentiments = self.analyze_batch([message['message'] for message in candidates])
+
+    with self.lock:
+      for message, sentiment in zip(candidates, sentiments):
+        message['message'] = message['message'][:self.max_length]
+        message['sentiment'] = sentiment
+        message['received_at'] = now
+        message['score'] = self.score(message, now)
+
+      # The whole batch is ranked together with the buffered messages before the lowest scored ones are dropped
+      self.buffer.add(candidates, now, self.rate_controller.buffer_limit(self.buffer.max_size, self.buffer.max_age))
+
+  # Check if any message is waiting to be answered
+  def has_candidates(self):
+    with self.lock:
+      return len(self.buffer) > 0
+
+  # Take the best message to answer, None if the buffer is empty
+  def pop_best(self, now=None):
+    now = time.time() if now is None else now
+
+    with self.lock:
+      message = self.buffer.pop_best(now)
+      if message is not None:
+        self.answered_authors[message['author_id']] = now
+        self.delivered_since_poll += 1
+        self.stats['delivered'] += 1
+      return message
+
+  # Adapt the polling rate after a poll, backpressure tells if the response queue is pushing back.
+  # Returns the number of seconds to wait before the next poll
+  def next_poll_interval(self, backpressure, now=None):
+    now = time.time() if now is None else now
+
+    with self.lock:
+
+      # Forget authors once their cooldown is over
+      self.answered_authors = {author: answered_at for author, answered_at in self.answered_authors.items() if now - answered_at < AUTHOR_COOLDOWN}
+
+      self.rate_controller.update(self.delivered_since_poll, backpressure, now, self.waiting_since_poll)
+      self.delivered_since_poll = 0
+      self.waiting_since_poll = len(self.buffer) > 0
+      return self.rate_controller.interval
+
+  # Get the ingestion stats
+  def get_stats(self):
+    with self.lock:
+      return dict(self.stats,
+                  buffered=len(self.buffer),
+                  dropped=self.buffer.dropped,
+                  expired=self.buffer.expired,
+                  poll_interval=self.rate_controller.interval,
+                  reply_rate=self.rate_controller.reply_rate)
@@ -0,0 +1,75 @@
+# Import necessary libraries
+import os
+import json
+import time
+from types import SimpleNamespace
+
+# Replays recorded live chat with the same interface as a pytchat chat, for testing without a live stream.
+# Records are dicts with time (seconds since the start of the recording), author, author_id, message and
+# optionally type ("textMessage" or "superChat"), amount and member. speed > 1 replays faster than real time
+class ReplayChat:
+  def __init__(self, records, speed=1.0, loop=False):
+    self.records = sorted(records, key=lambda record: record.get('time', 0))
+    self.speed = speed
+    self.loop = loop
+    self.position = 0
+    self.started_at = time.monotonic()
+    self.clock_offset = time.time() - time.monotonic() # Turns replay times into timestamps
+    self.terminated = False
+
+  # Load a recording saved as JSON lines
+  @classmethod
+  def from_file(cls, path, speed=1.0, loop=False):
+    with open(path, "r") as file:
+      return cls([json.loads(line) for line in file if line.strip()], speed, loop)
+
+  def is_alive(self):
+    return not self.terminated and (self.loop or self.position < len(self.records))
+
+  def terminate(self):
+    self.terminated = True
+
+  # Build a chat item shaped like the ones pytchat returns, posted_at is the time.monotonic() the message is replayed at
+  def make_item(self, record, posted_at):
+    return SimpleNamespace(
+      author=SimpleNamespace(
+        name=record['author'],
+        channelId=record.get('author_id', record['author']),
+        isChatSponsor=record.get('member', False),
+        isChatModerator=False
+      ),
+      message=record['message'],
+      type=record.get('type', "textMessage"),
+      amountValue=record.get('amount', 0),
+      timestamp=int((posted_at + self.clock_offset) * 1000)
+    )
+
+  # Get the messages recorded up to the current replay time
+  def get(self):
+    elapsed = (time.monotonic() - self.started_at) * self.speed
+    items = []
+
+    while self.records and not self.terminated:
+      if self.position == len(self.records):
+        if not self.loop:
+          break
+
+        # Start the recording over, shifted past the last message
+        self.started_at += max(self.records[-1].get('time', 0), 1) / self.speed
+        elapsed = (time.monotonic() - self.started_at) * self.speed
+        self.position = 0
+
+      record = self.records[self.position]
+      if record.get('time', 0) > elapsed:
+        break
+
+      items.append(self.make_item(record, self.started_at + record.get('time', 0) / self.speed))
+      self.position += 1
+
+    return SimpleNamespace(sync_items=lambda: iter(items))
+
+# Get a function that creates replay chats in place of pytchat.create, reading <video id>.jsonl from replay_dir
+def make_replay_chat_factory(replay_dir, speed=1.0, loop=False):
+  def create_chat(video_id, **kwargs):
+    return ReplayChat.from_file(os.path.join(replay_dir, f"{video_id}.jsonl"), speed, loop)
+  return create_chat
@@ -0,0 +1,89 @@
+# Import necessary libraries
+import random
+import logging
+from threading import Lock
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Decides which violated category a flagged message is answered for, and with which of the personality's canned replies.
+# The category table is built once per personality: categories are kept in priority order with their score threshold and
+# replies, categories the personality has no replies for fall back to its profanity reply. Flagged categories missing from
+# the table (ie. new endpoint categories) are blocked with that reply too
+class ModerationPolicy:
+  def __init__(self, name, replies, fallback_reply, priority, thresholds, default_threshold=None):
+    self.name = name
+    self.fallback_reply = fallback_reply
+
+    # (category, threshold, replies) in priority order, the first one wins when scores tie or are missing.
+    # A threshold of None keeps the endpoint's own decision for the category
+    self.rules = [
+      (category, thresholds.get(category, default_threshold), tuple(replies.get(category) or [fallback_reply]))
+      for category in priority
+    ]
+    self.rank = {category: rank for rank, (category, _, _) in enumerate(self.rules)}
+
+    self.lock = Lock()
+    self.decisions = {category: 0 for category in priority} # Replies given per category
+    self.passed = 0 # Flagged messages whose scores were all under the thresholds
+    self.clean = 0 # Messages that were allowed without being flagged
+
+  # Build the policy of a personality
+  @classmethod
+  def from_personality(cls, personality, priority, thresholds, default_threshold=None):
+    return cls(personality["name"], personality["ai_moderation"], personality["profanity_moderation"], priority, thresholds, default_threshold)
+
+  # Pick the most severe violated category, the one with the highest score. Returns None if nothing was violated.
+  # A category with a threshold counts once its score reaches the threshold, the others count when the endpoint
+  # flagged them. Without scores (e.g. local moderation) the flagged categories are taken in priority order
+  def resolve(self, categories, category_scores=None):
+    category_scores = category_scores or {}
+    best = None
+    best_score = None
+
+    for category, threshold, _ in self.rules:
+      score = category_scores.get(category, 0.0)
+
+      if threshold is not None and category_scores:
+        if score < threshold:
+          continue
+      elif not categories.get(category):
+        continue
+
+      if best is None or score > best_score:
+        best, best_score = category, score
+
+    # Fail closed on flagged categories the table doesn't know
+    if best is None:
+      best = next((category for category, violated in categories.items() if violated and category not in self.rank), None)
+      if best is not None:
+        logging.warning(f"Unknown moderation category {best} was flagged, blocking it")
+
+    return best
+
+  # Decide how to answer a moderation verdict. Returns (category, canned reply), both None if the message is allowed
+  def decide(self, flagged, categories, category_scores=None):
+    category = self.resolve(categories, category_scores)
+
+    with self.lock:
+      if category is not None:
+        self.decisions[category] = self.decisions.get(category, 0) + 1
+      elif flagged:
+        self.passed += 1
+      else:
+        self.clean += 1
+
+    if category is None:
+      if flagged:
+        logging.info(f"Flagged content is under the {self.name} moderation thresholds, allowing it")
+      return None, None
+
+    if category not in self.rank:
+      return category, self.fallback_reply
+
+    return category, random.choice(self.rules[self.rank[category]][2])
+
+  # Get the decision counts
+  def get_stats(self):
+    with self.lock:
+      return {'personality': self.name, 'decisions': dict(self.decisions), 'passed': self.passed, 'clean': self.clean}
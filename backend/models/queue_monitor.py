@@ -0,0 +1,241 @@
+# Import necessary libraries
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Condition, Semaphore
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Marker put into the queues to shut the monitor down
+SENTINEL = None
+
+# Turn of a single response in the playback order
+class PlaybackTurn:
+  def __init__(self, gate=None, sequence=None):
+    self.gate = gate # No gate means the response plays as soon as it is ready
+    self.sequence = sequence
+    self.finished = False
+
+  # Block until every earlier response has finished playing
+  def wait(self):
+    if self.gate is not None:
+      self.gate.wait_turn(self.sequence)
+
+  # Let the next response play. Safe to call more than once
+  def finish(self):
+    if self.gate is not None and not self.finished:
+      self.finished = True
+      self.gate.finish_turn(self.sequence)
+
+# Hands out turns so responses generated concurrently still play and commit in arrival order
+class PlaybackGate:
+  def __init__(self):
+    self.condition = Condition()
+    self.next_sequence = 0 # Sequence number of the next turn handed out
+    self.playing_sequence = 0 # Sequence number allowed to play
+    self.finished_sequences = set() # Turns that finished before it was their turn
+
+  # Get a turn at the end of the playback order
+  def next_turn(self):
+    with self.condition:
+      turn = PlaybackTurn(self, self.next_sequence)
+      self.next_sequence += 1
+      return turn
+
+  def wait_turn(self, sequence):
+    with self.condition:
+      self.condition.wait_for(lambda: self.playing_sequence == sequence)
+
+  def finish_turn(self, sequence):
+    with self.condition:
+      self.finished_sequences.add(sequence)
+
+      # Move past every turn that is already finished
+      while self.playing_sequence in self.finished_sequences:
+        self.finished_sequences.remove(self.playing_sequence)
+        self.playing_sequence += 1
+
+      self.condition.notify_all()
+
+# Monitor Queue Class
+# Feeder threads block on the source queues and hand items to a single dispatcher thread,
+# which sleeps until an item arrives and always serves the priority queue first.
+# Items are processed by a pool of workers, their PlaybackTurn keeps the replies in arrival order.
+# With regular_backpressure, a full regular buffer stops the feeder instead of dropping items, so the
+# regular source queue fills up and its producer can tell that replies aren't keeping up
+class QueueMonitor:
+  def __init__(self, regular_queue, priority_queue, handle_item, regular_buffer_size=2, pool_size=1, regular_backpressure=False, playback_gate=None):
+    self.regular_queue = regular_queue
+    self.priority_queue = priority_queue
+    self.handle_item = handle_item # Function called with each queue item and its PlaybackTurn
+    self.condition = Condition() # Wakes the dispatcher when an item is ready, and a blocked feeder when there is room
+    self.regular_backpressure = regular_backpressure
+    self.stopping = False
+
+    # Response workers
+    self.pool_size = pool_size
+    self.free_workers = Semaphore(pool_size)
+    self.in_flight = 0
+    self.executor = None
+    self.playback_gate = playback_gate or PlaybackGate() # Shared with the responses given outside the queues
+
+    # Items waiting to be dispatched. The regular buffer drops the oldest item when full, like the YouTube queue
+    self.pending = {
+      'priority': deque(),
+      'regular': deque(maxlen=regular_buffer_size)
+    }
+
+    # Wait time metrics per queue
+    self.metrics = {name: self.empty_metrics() for name in self.pending}
+
+    self.threads = []
+
+  # Initial metrics for a single queue
+  def empty_metrics(self):
+    return {'received': 0, 'processed': 0, 'dropped': 0, 'total_wait': 0.0, 'max_wait': 0.0, 'last_wait': 0.0}
+
+  def start(self):
+    self.executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="response_worker")
+    self.threads = [
+      Thread(target=self.feed, args=('priority', self.priority_queue), daemon=True),
+      Thread(target=self.feed, args=('regular', self.regular_queue), daemon=True),
+      Thread(target=self.dispatch, daemon=True)
+    ]
+
+    for thread in self.threads:
+      thread.start()
+
+  def stop(self):
+
+    # Release a feeder waiting for room
+    with self.condition:
+      self.stopping = True
+      self.condition.notify_all()
+
+    # Unblock the feeders, they pass the sentinel on to the dispatcher
+    self.priority_queue.put(SENTINEL)
+    self.regular_queue.put(SENTINEL)
+
+    for thread in self.threads:
+      thread.join()
+
+    self.threads = []
+
+    # Let the workers finish the items they already started
+    if self.executor:
+      self.executor.shutdown(wait=True)
+      self.executor = None
+
+  # Worker that moves items from a source queue into the dispatcher's buffer
+  def feed(self, name, source_queue):
+    while True:
+
+      # Block until the next item arrives
+      queue_item = source_queue.get()
+
+      # Stamp the time the item was queued if the producer did not
+      if queue_item is not SENTINEL:
+        queue_item.setdefault('queued_at', time.time())
+
+      with self.condition:
+        buffer = self.pending[name]
+
+        # Wait for room instead of dropping, the sentinel always goes through
+        if name == 'regular' and self.regular_backpressure and queue_item is not SENTINEL:
+          self.condition.wait_for(lambda: len(buffer) < buffer.maxlen or self.stopping)
+
+        # Count the oldest item as dropped if the buffer is full
+        if buffer.maxlen is not None and len(buffer) == buffer.maxlen:
+          self.metrics[name]['dropped'] += 1
+
+        buffer.append(queue_item)
+        if queue_item is not SENTINEL:
+          self.metrics[name]['received'] += 1
+
+        self.condition.notify_all()
+
+      if queue_item is SENTINEL:
+        break
+
+  # Worker that hands items to the response workers as soon as they are ready, priority items first
+  def dispatch(self):
+    while True:
+
+      # Wait for a free worker first, so the next item is picked as late as possible
+      self.free_workers.acquire()
+
+      # Sleep until either buffer has an item
+      with self.condition:
+        self.condition.wait_for(lambda: self.pending['priority'] or self.pending['regular'])
+        name = 'priority' if self.pending['priority'] else 'regular'
+        queue_item = self.pending[name].popleft()
+
+        # Wake a feeder waiting for room
+        self.condition.notify_all()
+
+      # Stop once the sentinel comes through
+      if queue_item is SENTINEL:
+        self.free_workers.release()
+        break
+
+      self.record_wait(name, time.time() - queue_item['queued_at'])
+
+      # Reserve the item's place in the playback order before it starts
+      turn = self.playback_gate.next_turn()
+
+      with self.condition:
+        self.in_flight += 1
+
+      self.executor.submit(self.process_item, queue_item, turn)
+
+  # Run a single item on a response worker
+  def process_item(self, queue_item, turn):
+    try:
+      self.handle_item(queue_item, turn)
+
+    # Keep the monitor alive if a single item fails
+    except Exception as e:
+      logging.error(f"An error occurred while processing a queue item: {e}", exc_info=True)
+
+    finally:
+
+      # Never hold up later replies, even if this one failed
+      turn.finish()
+
+      with self.condition:
+        self.in_flight -= 1
+
+      self.free_workers.release()
+
+  # Record how long an item waited before processing started
+  def record_wait(self, name, wait_time):
+    with self.condition:
+      metrics = self.metrics[name]
+      metrics['processed'] += 1
+      metrics['total_wait'] += wait_time
+      metrics['max_wait'] = max(metrics['max_wait'], wait_time)
+      metrics['last_wait'] = wait_time
+
+  # Get the wait time metrics per queue
+  def get_metrics(self):
+    with self.condition:
+      stats = {}
+      for name, metrics in self.metrics.items():
+        processed = metrics['processed']
+        stats[name] = {
+          'pending': sum(queue_item is not SENTINEL for queue_item in self.pending[name]),
+          'received': metrics['received'],
+          'processed': processed,
+          'dropped': metrics['dropped'],
+          'avg_wait': metrics['total_wait'] / processed if processed else 0.0,
+          'max_wait': metrics['max_wait'],
+          'last_wait': metrics['last_wait']
+        }
+      return stats
+
+  # Get the response worker pool stats
+  def get_worker_stats(self):
+    with self.condition:
+      return {'pool_size': self.pool_size, 'in_flight': self.in_flight}
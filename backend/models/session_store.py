@@ -0,0 +1,93 @@
+# Import necessary libraries
+import logging
+from collections import OrderedDict
+from threading import Lock
+from flask import request, has_request_context
+from .chat_history import ChatHistory
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Session used by callers that don't provide one
+DEFAULT_SESSION_ID = "default"
+
+# Session used for YouTube live chat comments
+YOUTUBE_SESSION_ID = "youtube"
+
+# Conversation state of a single session
+class ConversationSession:
+  __slots__ = ('session_id', 'chat_history', 'ai_mood', 'accumulated_sentiment', 'lock')
+
+  def __init__(self, session_id, max_messages, ai_mood, accumulated_sentiment, model):
+    self.session_id = session_id
+    self.chat_history = ChatHistory(max_messages, model) # Latest messages, the oldest are dropped automatically
+    self.ai_mood = ai_mood
+    self.accumulated_sentiment = accumulated_sentiment
+    self.lock = Lock() # Guards the chat history, mood and sentiment
+
+  # Get the newest chat history messages that fit in the token budget
+  def get_chat_history(self, token_budget=None):
+    with self.lock:
+      return self.chat_history.get_messages(token_budget)
+
+  # Save the latest exchange to the chat history
+  def save_chat_history(self, message_input, message_role, ai_response):
+    with self.lock:
+      self.chat_history.append({"role": message_role, "content": message_input})
+      self.chat_history.append({"role": "assistant", "content": ai_response})
+
+# Bounded store of conversation sessions, the least recently used session is evicted when full
+class SessionStore:
+  def __init__(self, max_sessions, max_messages, ai_mood, accumulated_sentiment, model):
+    self.max_sessions = max_sessions
+    self.max_messages = max_messages
+    self.model = model # Chat model used to count history tokens
+    self.initial_ai_mood = ai_mood
+    self.initial_accumulated_sentiment = accumulated_sentiment
+    self.sessions = OrderedDict()
+    self.lock = Lock()
+
+  # Get a session, creating it if it doesn't exist
+  def get(self, session_id=DEFAULT_SESSION_ID):
+    with self.lock:
+      session = self.sessions.get(session_id)
+
+      if session is not None:
+
+        # Mark the session as recently used
+        self.sessions.move_to_end(session_id)
+        return session
+
+      session = ConversationSession(session_id, self.max_messages, self.initial_ai_mood, self.initial_accumulated_sentiment, self.model)
+      self.sessions[session_id] = session
+
+      # Evict the least recently used session
+      if len(self.sessions) > self.max_sessions:
+        evicted_id, _ = self.sessions.popitem(last=False)
+        logging.info(f"Session evicted: {evicted_id}")
+
+      return session
+
+  # Remove a session
+  def remove(self, session_id):
+    with self.lock:
+      self.sessions.pop(session_id, None)
+
+  # Get the session store stats
+  def get_stats(self):
+    with self.lock:
+      return {'sessions': len(self.sessions), 'max_sessions': self.max_sessions}
+
+# Get the session id for the current request: a client-provided session id, the Socket.IO sid, or the default session
+def get_session_id(data=None):
+  if data and data.get('session_id'):
+    return data['session_id']
+
+  if has_request_context():
+    if request.args.get('session_id'):
+      return request.args['session_id']
+
+    if getattr(request, 'sid', None):
+      return request.sid
+
+  return DEFAULT_SESSION_ID
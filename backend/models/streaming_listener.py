@@ -0,0 +1,219 @@
+# Import necessary libraries
+import math
+import time
+import logging
+from collections import deque
+from threading import Thread, Event, Lock
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import speech_recognition as sr
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Longest utterance kept, Whisper only looks at 30 seconds of audio at a time
+MAX_PHRASE_SECONDS = 30
+
+# Audio kept from before the speech started, so the first syllable isn't cut off
+PRE_ROLL_SECONDS = 0.3
+
+# Utterances with less speech than this are treated as noise
+MIN_SPEECH_SECONDS = 0.25
+
+# Splits microphone audio into utterances with an energy threshold, like speech_recognition's listen().
+# feed returns "start" when speech starts, "pause" on the first silent chunk after speech,
+# "resume" when speech continues after a pause, "end" once the pause is long enough, otherwise None
+class SpeechSegmenter:
+  def __init__(self, sample_rate, chunk_frames, energy_threshold, pause_threshold):
+    self.chunk_seconds = chunk_frames / sample_rate
+    self.energy_threshold = energy_threshold
+    self.pause_chunks = max(1, math.ceil(pause_threshold / self.chunk_seconds))
+    self.max_chunks = math.ceil(MAX_PHRASE_SECONDS / self.chunk_seconds)
+    self.pre_roll = deque(maxlen=math.ceil(PRE_ROLL_SECONDS / self.chunk_seconds))
+    self.chunks = []
+    self.speaking = False
+    self.silent_chunks = 0
+    self.voiced_chunks = 0
+    self.voiced_end = 0 # Number of chunks up to the last voiced one
+
+  # Energy of a chunk of 16 bit PCM, same measure as the recognizer's energy threshold
+  @staticmethod
+  def energy(chunk):
+    samples = np.frombuffer(chunk, dtype=np.int16).astype(np.float64)
+    return math.sqrt(np.mean(samples * samples)) if len(samples) else 0.0
+
+  def feed(self, chunk):
+    voiced = self.energy(chunk) > self.energy_threshold
+
+    # Wait for speech, keeping the last moment of silence
+    if not self.speaking:
+      if not voiced:
+        self.pre_roll.append(chunk)
+        return None
+
+      self.chunks = list(self.pre_roll) + [chunk]
+      self.pre_roll.clear()
+      self.speaking = True
+      self.silent_chunks = 0
+      self.voiced_chunks = 1
+      self.voiced_end = len(self.chunks)
+      return "start"
+
+    self.chunks.append(chunk)
+
+    if voiced:
+      resumed = self.silent_chunks > 0
+      self.silent_chunks = 0
+      self.voiced_chunks += 1
+      self.voiced_end = len(self.chunks)
+      if len(self.chunks) >= self.max_chunks:
+        self.speaking = False
+        return "end"
+      return "resume" if resumed else None
+
+    self.silent_chunks += 1
+    if self.silent_chunks >= self.pause_chunks or len(self.chunks) >= self.max_chunks:
+      self.speaking = False
+      return "end"
+    return "pause" if self.silent_chunks == 1 else None
+
+  # Check if the utterance had enough speech to be worth transcribing
+  def has_speech(self):
+    return self.voiced_chunks * self.chunk_seconds >= MIN_SPEECH_SECONDS
+
+  # Get the audio of the utterance so far
+  def audio(self):
+    return b"".join(self.chunks)
+
+# Listens to a microphone in the background and transcribes the speech while it is still being spoken.
+# A transcription of the utterance so far is started every partial_interval seconds and as soon as the speaker
+# pauses, so by the time the pause is long enough to end the utterance its transcript is usually ready.
+# on_partial is called with each partial transcript, on_utterance with a function that returns the final transcript
+# and the time the speech ended. is_final tells if a partial transcript should end the utterance right away (ie. the quit keyword)
+class StreamingListener:
+  def __init__(self, source, energy_threshold, pause_threshold, partial_interval, transcribe, on_partial, on_utterance, is_final=None):
+    self.source = source
+    self.energy_threshold = energy_threshold
+    self.pause_threshold = pause_threshold
+    self.partial_interval = partial_interval
+    self.transcribe = transcribe
+    self.on_partial = on_partial
+    self.on_utterance = on_utterance
+    self.is_final = is_final
+    self.stop_event = Event()
+    self.thread = None
+
+    # Transcriptions run one at a time, in the order they were started
+    self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="partial_transcriber")
+    self.lock = Lock()
+    self.latest = None # (number of chunks transcribed, future) of the latest transcription
+    self.final_partial = None # Partial transcript that ended the utterance early
+
+  # Start listening, returns a function that stops it like the one returned by listen_in_background
+  def start(self):
+    self.thread = Thread(target=self.run, name="streaming_listener", daemon=True)
+    self.thread.start()
+
+    def stopper(wait_for_stop=True):
+      self.stop_event.set()
+      if wait_for_stop:
+        self.thread.join()
+
+    return stopper
+
+  # Convert the chunks into AudioData and transcribe them
+  def transcribe_chunks(self, audio, sample_rate, sample_width):
+    return self.transcribe(sr.AudioData(audio, sample_rate, sample_width))
+
+  # Start transcribing the utterance so far
+  def submit(self, segmenter, chunk_count):
+    future = self.executor.submit(self.transcribe_chunks, segmenter.audio(), self.source.SAMPLE_RATE, self.source.SAMPLE_WIDTH)
+    future.add_done_callback(self.handle_partial)
+    with self.lock:
+      self.latest = (chunk_count, future)
+
+  # Send each partial transcript on, and end the utterance if it is final
+  def handle_partial(self, future):
+    try:
+      transcription = future.result()
+    except Exception as e:
+      logging.error(f"An error occurred while transcribing partial speech: {e}")
+      return
+
+    if not transcription or self.stop_event.is_set():
+      return
+
+    self.on_partial(transcription)
+
+    if self.is_final is not None and self.is_final(transcription):
+      with self.lock:
+        self.final_partial = transcription
+
+  # Check if a transcription is running
+  def is_busy(self):
+    with self.lock:
+      return self.latest is not None and not self.latest[1].done()
+
+  # Microphone thread
+  def run(self):
+    with self.source as source:
+      segmenter = SpeechSegmenter(source.SAMPLE_RATE, source.CHUNK, self.energy_threshold, self.pause_threshold)
+      last_submit = 0.0
+
+      while not self.stop_event.is_set():
+        chunk = source.stream.read(source.CHUNK)
+
+        # End of the stream, the microphone was closed
+        if not chunk:
+          break
+
+        event = segmenter.feed(chunk)
+
+        # End the utterance on a final partial transcript (ie. the quit keyword) without waiting for the pause
+        with self.lock:
+          final_partial = self.final_partial
+        if final_partial is not None:
+          self.finish(lambda: final_partial)
+          break
+
+        if event == "start":
+          with self.lock:
+            self.latest = None
+          last_submit = time.monotonic()
+
+        # Transcribe as soon as the speaker pauses, it is most likely the end of the utterance
+        elif event == "pause":
+          self.submit(segmenter, segmenter.voiced_end)
+          last_submit = time.monotonic()
+
+        elif event == "end":
+          if not segmenter.has_speech():
+            continue
+
+          self.finish(self.final_transcription(segmenter))
+          break
+
+        # Transcribe the utterance so far every partial_interval seconds, skipped while a transcription is running
+        elif segmenter.speaking and time.monotonic() - last_submit >= self.partial_interval and not self.is_busy():
+          self.submit(segmenter, segmenter.voiced_end)
+          last_submit = time.monotonic()
+
+    self.executor.shutdown(wait=False)
+
+  # Get a function returning the final transcript, it reuses the latest transcription if it covered all of the speech
+  def final_transcription(self, segmenter):
+    with self.lock:
+      latest = self.latest
+
+    if latest is None or latest[0] < segmenter.voiced_end:
+      self.submit(segmenter, segmenter.voiced_end)
+      with self.lock:
+        latest = self.latest
+
+    future = latest[1]
+    return future.result
+
+  # Stop listening and hand the utterance over
+  def finish(self, get_transcription):
+    self.stop_event.set()
+    self.on_utterance(get_transcription, time.time())
@@ -1,98 +1,209 @@
 # Import settings
+import time
 import logging
-import tempfile
-import openai
-import os
+import random
+from threading import Condition, Lock
 import speech_recognition as sr
+from flask import request
 from ..app import socketio
-from ..ai_response import get_ai_response
+from ..ai_response import get_ai_response, prefetch_user_message, session_store
+from .session_store import get_session_id
+from .streaming_listener import StreamingListener
+from ..transcription import transcribe_speech
+from ..tracing import traced_request, span
 
 # Import settings
 from ..personalities import AI_PERSONALITY
 from ..config.load_settings import settings
 
 # Import settings variables
-OPENAI_WHISPER_MODEL = settings['AI_AUDIO_SETTINGS']['OPENAI_WHISPER_MODEL']
 LISTEN_KEYWORD_QUIT = settings['AI_AUDIO_SETTINGS']['LISTEN_KEYWORD_QUIT']
 LISTEN_PERIODIC_MESSAGE_TIMER = settings['AI_AUDIO_SETTINGS']['LISTEN_PERIODIC_MESSAGE_TIMER']
-
-# Listen mode
+LISTEN_STREAMING = settings['AI_AUDIO_SETTINGS']['LISTEN_STREAMING']
+LISTEN_PARTIAL_INTERVAL = settings['AI_AUDIO_SETTINGS']['LISTEN_PARTIAL_INTERVAL']
+LISTEN_PAUSE_THRESHOLD = settings['AI_AUDIO_SETTINGS']['LISTEN_PAUSE_THRESHOLD']
+
+# Check if a transcription is the quit keyword LISTEN_KEYWORD_QUIT said by itself
+def is_quit_keyword(transcription):
+  transcription_lower = transcription.lower()
+  return transcription_lower == f"{LISTEN_KEYWORD_QUIT}" or f"{LISTEN_KEYWORD_QUIT}." in transcription_lower
+
+# Listen mode state of one Socket.IO client. The recognizer thread records what it heard and wakes the listening thread,
+# which otherwise sleeps until the periodic message is due. Every listening round has a number, so a recognizer callback
+# of an earlier round that finishes late can't hand its transcript to the current one
+class ListenState:
+  def __init__(self, sid):
+    self.sid = sid # Socket.IO client the listen events are sent to
+    self.session = None # Conversation session of the listening client
+    self.condition = Condition() # Guards the fields below and wakes the listening thread
+    self.round = 0 # Number of the current listening round
+    self.outcome = None # (event name, data) to send once the voice input was handled
+    self.stop_requested = False # Frontend deactivated listen mode
+    self.speech_heard = False # Pauses the periodic message timer
+    self.consecutive_periodic_messages = 0 # Number of consecutive periodic messages, kept across listening rounds
+
+  # Start a new listening round, returns its number
+  def reset(self, session):
+    with self.condition:
+      self.round += 1
+      self.session = session
+      self.outcome = None
+      self.stop_requested = False
+      self.speech_heard = False
+      return self.round
+
+  # Check if a listening round is still the current one
+  def is_current(self, listen_round):
+    with self.condition:
+      return listen_round == self.round
+
+  # Pause the periodic message timer, the voice input is being handled. Ignored for an earlier round
+  def mark_speech_heard(self, listen_round):
+    with self.condition:
+      if listen_round == self.round:
+        self.speech_heard = True
+        self.condition.notify_all()
+
+  # Record the outcome of the voice input and wake the listening thread. Ignored for an earlier round
+  def finish(self, listen_round, event, data):
+    with self.condition:
+      if listen_round != self.round:
+        logging.info(f"Dropping the outcome of an earlier listening round: {event}")
+        return
+      self.outcome = (event, data)
+      self.condition.notify_all()
+
+  def request_stop(self):
+    with self.condition:
+      self.stop_requested = True
+      self.condition.notify_all()
+
+  # Sleep until the voice input was handled, a stop was requested, or the deadline (time.monotonic()) passed
+  # without any speech being heard. Returns "stop", "outcome" or "timeout"
+  def wait(self, deadline):
+    with self.condition:
+      while True:
+        if self.stop_requested:
+          return "stop"
+        if self.outcome is not None:
+          return "outcome"
+
+        # The periodic message timer is paused while the voice input is handled
+        if self.speech_heard:
+          self.condition.wait()
+          continue
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          return "timeout"
+        self.condition.wait(remaining)
+
+# Listen mode, each client listens in its own round with its own state so several clients can listen at once
 class VoiceListener:
-  def __init__(self):
-    self.shared_data = {'result': None, 'error': None, 'quit': None} # Initialize data set to pass between the listener and the listen events
-    self.background_thread_end = False # Indicate to listen while loop that a voice input has been detected
-    self.should_stop = False # Stop listen while loop
-    self.periodic_message_timer = 0 # Initialize timer
-    self.should_pause_counter = False # Pause timer
-    self.consecutive_periodic_messages = 0 # Initialize counter to track number of consectutive periodic messages
-
-  # Create a temporary audio file
-  def create_temp_file(self, speech):
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-      temp_file.write(speech.get_wav_data())
-      return temp_file.name
-
-  # Read from the temporary audio file
-  def transcribe_audio(self, temp_file_path):
-    with open(temp_file_path, 'rb') as speech:
-      transcription_result = openai.Audio.transcribe(model=OPENAI_WHISPER_MODEL, file=speech)
-      return transcription_result['text']
+  def __init__(self, audio_capture, playback_gate):
+    self.audio_capture = audio_capture # Keeps the microphones open and calibrated between listening rounds
+    self.playback_gate = playback_gate # Plays the listen mode responses in turn with the queued responses
+    self.states = {} # Socket.IO client id -> ListenState
+    self.lock = Lock()
+
+  # Get the listen state of a client, created on its first listening round
+  def get_state(self, sid):
+    with self.lock:
+      state = self.states.get(sid)
+      if state is None:
+        state = self.states[sid] = ListenState(sid)
+      return state
 
   def handle_stop_listening(self):
     logging.info("Listen Mode Deactivated")
-    self.should_stop = True
+    with self.lock:
+      state = self.states.get(request.sid)
+    if state is not None:
+      state.request_stop()
+
+  # Get the AI response, played in turn with the queued responses
+  def get_response(self, message_input, message_role, session):
+    turn = self.playback_gate.next_turn()
+    try:
+      return get_ai_response(message_input, message_role, turn=turn, session=session)
+    finally:
+      turn.finish()
+
+  # Stop the listening round of a client that disconnected and forget its state
+  def remove_client(self, sid):
+    with self.lock:
+      state = self.states.pop(sid, None)
+    if state is not None:
+      state.request_stop()
+
+  # Stop every listening round, at shutdown
+  def stop_all(self):
+    with self.lock:
+      states = list(self.states.values())
+    for state in states:
+      state.request_stop()
 
   # Background listening thread
-  def callback(self, recognizer, speech):
+  def callback(self, state, listen_round, speech):
+
+    # Transcribe the speech straight from memory, downsampled and compressed
+    self.handle_speech(state, listen_round, lambda: transcribe_speech(speech))
+
+  # Send a partial transcript to the client and start the lookups the response will need while the user is still speaking
+  def handle_partial_transcription(self, state, listen_round, transcription):
+    if not state.is_current(listen_round):
+      return
+    socketio.emit('listening_partial', {"transcription": transcription}, to=state.sid)
+    prefetch_user_message(transcription)
+
+  # Answer the speech heard, get_transcription returns its transcript.
+  # In streaming mode the trace starts when the speech ended, so it shows how long the final transcript took after that
+  def handle_speech(self, state, listen_round, get_transcription, speech_ended_at=None):
+
+    # Speech heard after the round ended belongs to no one
+    if not state.is_current(listen_round):
+      return
 
     logging.info("\n==========================\nUser voice input heard")
 
     # Pause Periodic Message Timer
-    self.should_pause_counter = True
+    state.mark_speech_heard(listen_round)
     
     try:
+      with traced_request("listen", started_at=speech_ended_at):
 
-      # Create a temporary file
-      temp_file_path = self.create_temp_file(speech)
-      
-      # Read from the temporary file
-      transcription = self.transcribe_audio(temp_file_path)
-      
-      # Remove the saved audio file
-      os.remove(temp_file_path)
-      
-      # Generate the AI response based on the transcription
-      ai_response = get_ai_response(transcription, 'user')
+        with span("final_transcription"):
+          transcription = get_transcription()
+        
+        # Generate the AI response based on the transcription
+        ai_response = self.get_response(transcription, 'user', state.session)
 
       # Quit listen mode if keyword LISTEN_KEYWORD_QUIT is heard by itself
-      transcription_lower = transcription.lower()
-      
-      if transcription_lower == f"{LISTEN_KEYWORD_QUIT}" or f"{LISTEN_KEYWORD_QUIT}." in transcription_lower:
+      if is_quit_keyword(transcription):
         logging.info("Quitting Listen Mode")
-        self.shared_data['quit'] = {
+        state.finish(listen_round, 'listening_quit', {
           "transcription": transcription,
           "ai_response": ai_response
-        }
+        })
         
       else:
-        self.shared_data['result'] = {
+        state.finish(listen_round, 'listening_result', {
           "transcription": transcription,
           "ai_response": ai_response
-        }
+        })
 
     except Exception as e:
       logging.error(f"Specific error: {e}")
-      self.shared_data['error'] = "Could not process audio"
+      state.finish(listen_round, 'listening_error', "Could not process audio")
 
-    # End background thread loop
-    self.background_thread_end = True
     logging.info("Background Thread Ended!")
 
   # Main listening thread
   def handle_start_listening(self, data):
 
-    # Reset shared_data
-    self.shared_data = {'result': None, 'error': None, 'quit': None}
+    # Start a new listening round with the conversation session of the listening client
+    state = self.get_state(request.sid)
+    listen_round = state.reset(session_store.get(get_session_id(data)))
 
     # Default to 1 if not provided
     device_index = data.get('device_index', 1) 
@@ -100,130 +211,93 @@ class VoiceListener:
     # Check microphone device_index number, make sure to use the correct one
     logging.info(f"Microphone number: {device_index}")
 
-    # Initialize counter for periodic messages
-    self.periodic_message_timer = 0
-    self.should_pause_counter = False
-
-    # Initialize Mic
-    r = sr.Recognizer()
-    r.dynamic_energy_threshold=False # set to 'True', the program will continuously try to re-adjust the energy threshold to match the environment based on the ambient noise level at that time.
-    r.energy_threshold = 400 # 300 is the default value of the SR library
-    mic = sr.Microphone()
-
+    # Get the audio of the microphone, it is only opened and calibrated for ambience the first time
     try:
-      with sr.Microphone(device_index=device_index) as source:
-        logging.info(device_index)
-        logging.info("Adjusting audio for ambience...")
-        r.adjust_for_ambient_noise(source, duration=0.5)
+      mic = self.audio_capture.open(device_index)
 
-    except AttributeError:
+    except (AttributeError, AssertionError, OSError) as e:
+      logging.error(f"Specific error: {e}")
       logging.error("An error occurred while initializing the microphone. Deactivating listening mode.")
       
       # Notify the frontend that listening mode is being deactivated
       system_input = "Seems that the user's Microphone is not compatible with Listen Mode. Inform the user of this and tell them to try using the record function."
-      ai_response = get_ai_response(system_input, "system")
-      socketio.emit('listening_deactivated', ai_response)
-      
-      # Set the flag to stop listening
-      self.should_stop = True
+      with traced_request("listen_error"):
+        ai_response = self.get_response(system_input, "system", state.session)
+      socketio.emit('listening_deactivated', ai_response, to=state.sid)
       return
 
     logging.info("\n==========================\nListening in background...")
-    stop_listening = r.listen_in_background(mic, self.callback)
-
-    while True:
-      socketio.sleep(0.1)
-
-      # Check the pause flag before incrementing the counter
-      if not self.should_pause_counter:
-
-        # Increment the counter
-        self.periodic_message_timer += 0.1
-
-      # Check if it's time to send a periodic message
-      if self.periodic_message_timer >= LISTEN_PERIODIC_MESSAGE_TIMER:
-
-        # Increment the consecutive_periodic_messages counter
-        self.consecutive_periodic_messages += 1
-
-        # Stop listening mode
-        logging.info("\n==========================\nStopped Listening")
-        stop_listening(wait_for_stop=False)
-
-        # Pause Periodic Message Timer
-        self.should_pause_counter = True
-
-        if self.consecutive_periodic_messages < 3:
-          system_input = AI_PERSONALITY["periodic_messages"]["passive"]
-          ai_response = get_ai_response(system_input, "system")
-          logging.info(f"Periodic message sent: {ai_response}")
 
-          # Send periodic message
-          socketio.emit('listening_periodic_message', ai_response)
+    # End the round if the microphone stops while it is being listened to
+    mic.on_end = lambda: state.finish(listen_round, 'listening_error', "The microphone stopped")
 
-        else:
-          system_input = AI_PERSONALITY["periodic_messages"]["final"]
-          ai_response = get_ai_response(system_input, "system")
-          logging.info("Periodic message triggered 3 times consecutively. Stopping listen mode.")
-    
-          # Notify the frontend that listening mode is being deactivated
-          socketio.emit('listening_deactivated', ai_response)
-
-          # Reset Consecutive Periodic Message Counter
-          self.consecutive_periodic_messages = 0
-          break
+    # Initialize the recognizer with the microphone's calibrated energy threshold
+    r = sr.Recognizer()
+    r.dynamic_energy_threshold=False # set to 'True', the program will continuously try to re-adjust the energy threshold to match the environment based on the ambient noise level at that time.
+    r.energy_threshold = mic.energy_threshold
 
-        break
+    # The periodic message is due LISTEN_PERIODIC_MESSAGE_TIMER seconds from now, unless speech is heard first
+    deadline = time.monotonic() + LISTEN_PERIODIC_MESSAGE_TIMER
 
-      # Check if frontend deactivated listen mode
-      if self.should_stop:
+    # Transcribe while the user is speaking, or once the whole phrase was heard
+    if LISTEN_STREAMING:
+      streaming_listener = StreamingListener(mic, r.energy_threshold, LISTEN_PAUSE_THRESHOLD, LISTEN_PARTIAL_INTERVAL, transcribe_speech,
+                                             lambda transcription: self.handle_partial_transcription(state, listen_round, transcription),
+                                             lambda get_transcription, speech_ended_at: self.handle_speech(state, listen_round, get_transcription, speech_ended_at),
+                                             is_quit_keyword)
+      stop_listening = streaming_listener.start()
+    else:
+      stop_listening = r.listen_in_background(mic, lambda recognizer, speech: self.callback(state, listen_round, speech))
 
-        # Stop listening mode
-        logging.info("\n==========================\nStopped Listening")
-        stop_listening(wait_for_stop=False)
+    # Sleep until voice input was handled, the frontend deactivated listen mode or the periodic message is due
+    reason = state.wait(deadline)
 
-        # Pause Periodic Message Timer
-        self.should_pause_counter = True
-        self.should_stop = False
+    # Stop listening mode, the microphone stays open for the next round
+    logging.info("\n==========================\nStopped Listening")
+    stop_listening(wait_for_stop=False)
+    mic.close()
 
-        # Reset Consecutive Periodic Message Counter
-        self.consecutive_periodic_messages = 0
+    # Check if it's time to send a periodic message
+    if reason == "timeout":
 
-        break
+      # Increment the consecutive_periodic_messages counter
+      state.consecutive_periodic_messages += 1
 
-      # Check listen mode recorded voice input
-      if self.background_thread_end:
+      if state.consecutive_periodic_messages < 3:
+        system_input = random.choice(AI_PERSONALITY["periodic_messages"]["passive"])
+        with traced_request("listen_periodic_message"):
+          ai_response = self.get_response(system_input, "system", state.session)
+        logging.info(f"Periodic message sent: {ai_response}")
 
-        # Stop listening mode
-        logging.info("\n==========================\nStopped Listening")
-        stop_listening(wait_for_stop=False)
+        # Send periodic message
+        socketio.emit('listening_periodic_message', ai_response, to=state.sid)
 
-        # Paused Periodic Message Timer in stop_listening callback function
+      else:
+        system_input = AI_PERSONALITY["periodic_messages"]["final"]
+        with traced_request("listen_periodic_message"):
+          ai_response = self.get_response(system_input, "system", state.session)
+        logging.info("Periodic message triggered 3 times consecutively. Stopping listen mode.")
+  
+        # Notify the frontend that listening mode is being deactivated
+        socketio.emit('listening_deactivated', ai_response, to=state.sid)
 
         # Reset Consecutive Periodic Message Counter
-        self.consecutive_periodic_messages = 0
-
-        # Check if the thread finished successfully
-        if self.shared_data['result'] is not None:
-          logging.info("\n==========================")
-          socketio.emit('listening_result', self.shared_data['result'])
-
-          break
-
-        elif self.shared_data['quit'] is not None:
-          socketio.emit('listening_quit', self.shared_data['quit'])
+        state.consecutive_periodic_messages = 0
 
-          break
+    # Check if frontend deactivated listen mode
+    elif reason == "stop":
 
-        elif self.shared_data['error'] is not None:
-          socketio.emit('listening_error', self.shared_data['error'])
+      # Reset Consecutive Periodic Message Counter
+      state.consecutive_periodic_messages = 0
 
-          break
-          
-        else:
-          socketio.emit('listening_error', "Listening timed out or no audio detected")
+    # Listen mode recorded voice input
+    else:
 
-          break
+      # Reset Consecutive Periodic Message Counter
+      state.consecutive_periodic_messages = 0
 
-    # Reset Background Thread flag
-    self.background_thread_end = False
+      # Send the result, the quit message or the error
+      event, event_data = state.outcome
+      if event == 'listening_result':
+        logging.info("\n==========================")
+      socketio.emit(event, event_data, to=state.sid)
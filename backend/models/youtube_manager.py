@@ -0,0 +1,323 @@
+# Import necessary libraries
+import time
+import logging
+from collections import deque
+from threading import Thread, Event, Condition
+from queue import Full
+import pytchat
+from ..ai_response import is_question
+from ..sentiment_analysis import analyze_sentiment_vader_batch
+from .chat_ingest import ChatIngestor, RateLimiter
+from .session_store import YOUTUBE_SESSION_ID
+from ..tracing import new_request_id
+
+# Import settings
+from ..config.load_settings import settings
+
+# Import settings variables
+YOUTUBE_BUFFER_SIZE = settings['YOUTUBE_SETTINGS']['YOUTUBE_BUFFER_SIZE']
+YOUTUBE_MAX_MESSAGE_AGE = settings['YOUTUBE_SETTINGS']['YOUTUBE_MAX_MESSAGE_AGE']
+YOUTUBE_MIN_POLL_INTERVAL = settings['YOUTUBE_SETTINGS']['YOUTUBE_MIN_POLL_INTERVAL']
+YOUTUBE_MAX_POLL_INTERVAL = settings['YOUTUBE_SETTINGS']['YOUTUBE_MAX_POLL_INTERVAL']
+YOUTUBE_STREAM_RATE_LIMIT = settings['YOUTUBE_SETTINGS']['YOUTUBE_STREAM_RATE_LIMIT']
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Seconds the scheduler waits on a full response queue before checking if it was stopped
+PUT_TIMEOUT = 1
+
+# Split the video ids sent by the client, several streams can be given separated by commas
+def parse_video_ids(video_ids):
+  if isinstance(video_ids, str):
+    video_ids = video_ids.split(",")
+  return [video_id.strip() for video_id in video_ids or [] if video_id and video_id.strip()]
+
+# Polls the live chat of a single stream on a background thread and keeps its best messages ranked.
+# Stopping sets an event the thread sleeps on, so it exits right away instead of at the end of its sleep
+class ChatPoller:
+  def __init__(self, video_id, queue, on_candidates, create_chat=pytchat.create, rate_limit=YOUTUBE_STREAM_RATE_LIMIT):
+    self.video_id = video_id
+    self.queue = queue # Only checked for backpressure, the YouTubeManager puts the messages
+    self.on_candidates = on_candidates # Called after each poll so the scheduler can pick up new messages
+    self.create_chat = create_chat
+    self.stop_event = Event()
+    self.thread = None
+
+    # Ranks the chat messages of the stream
+    self.ingestor = ChatIngestor(is_question, analyze_sentiment_vader_batch,
+                                 buffer_size=YOUTUBE_BUFFER_SIZE,
+                                 max_age=YOUTUBE_MAX_MESSAGE_AGE,
+                                 min_interval=YOUTUBE_MIN_POLL_INTERVAL,
+                                 max_interval=YOUTUBE_MAX_POLL_INTERVAL)
+
+    # Replies per minute this stream may get
+    self.rate_limiter = RateLimiter(rate_limit)
+
+    # Reply latency, from the message being posted to the reply being sent
+    self.latency = {'replies': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0}
+
+  def start(self):
+    self.thread = Thread(target=self.run, name=f"youtube_chat_{self.video_id}", daemon=True)
+    self.thread.start()
+
+  # Ask the poller to stop and wait for it
+  def stop(self, timeout=None):
+    self.stop_event.set()
+    if self.thread is not None:
+      self.thread.join(timeout)
+
+  def is_alive(self):
+    return self.thread is not None and self.thread.is_alive()
+
+  # Build the response queue item of a chat message
+  def make_queue_item(self, message):
+    return {
+      'source': 'youtube',
+      'video_id': self.video_id,
+      'author': message['author'],
+      'message': message['message'],
+      'sentiment': message['sentiment'],
+      'posted_at': message.get('posted_at', message['received_at']),
+      'received_at': message['received_at'],
+      'queued_at': time.time(),
+      'request_id': new_request_id(),
+      'session_id': YOUTUBE_SESSION_ID
+    }
+
+  # Function to manage YouTube live chat
+  def run(self):
+    logging.info(f"Starting YouTube live chat management for {self.video_id}.")
+
+    chat = None
+
+    try:
+
+      # Loop to fetch chat as long as the chat and stream are alive
+      while not self.stop_event.is_set():
+        try:
+
+          # Connect to the chat, retried after a failure (ie. the stream isn't live yet).
+          # pytchat can only install its interrupt handler on the main thread
+          if chat is None:
+            chat = self.create_chat(video_id=self.video_id, interruptable=False)
+
+          # The stream ended
+          if not chat.is_alive():
+            break
+
+          # Initialize an empty list to collect chat messages
+          chat_messages = []
+
+          # Fetch each chat item
+          for c in chat.get().sync_items():
+
+            # Collect the chat messages in the list
+            chat_messages.append({
+              'author': c.author.name,
+              'author_id': c.author.channelId,
+              'message': c.message,
+              'is_member': c.author.isChatSponsor or c.author.isChatModerator,
+              'amount': c.amountValue if c.type == "superChat" else 0,
+              'posted_at': c.timestamp / 1000
+            })
+
+          # Deduplicate, filter, score and buffer the new messages
+          self.ingestor.ingest(chat_messages)
+          self.on_candidates()
+
+          # Poll less often while the response queue is full
+          delay = self.ingestor.next_poll_interval(self.queue.full())
+
+        # Print any exceptions
+        except Exception as e:
+          logging.error(f"An error occurred while polling {self.video_id}: {e}")
+          delay = YOUTUBE_MAX_POLL_INTERVAL
+
+        # Sleep until the next poll, or until the poller is stopped
+        self.stop_event.wait(delay)
+
+    finally:
+      if chat is not None:
+        chat.terminate()
+      logging.info(f"Stopped YouTube live chat management for {self.video_id}.")
+
+  # Record the latency of a reply to this stream
+  def record_reply(self, latency):
+    self.latency['replies'] += 1
+    self.latency['total'] += latency
+    self.latency['max'] = max(self.latency['max'], latency)
+    self.latency['last'] = latency
+
+  # Get the poller stats: messages seen, selected and dropped, and the reply latency
+  def get_stats(self):
+    ingest_stats = self.ingestor.get_stats()
+    replies = self.latency['replies']
+    return {
+      'alive': self.is_alive(),
+      'seen': ingest_stats['received'],
+      'selected': ingest_stats['delivered'],
+      'dropped': ingest_stats['duplicates'] + ingest_stats['spam'] + ingest_stats['dropped'] + ingest_stats['expired'],
+      'buffered': ingest_stats['buffered'],
+      'replies': replies,
+      'avg_latency': self.latency['total'] / replies if replies else 0.0,
+      'max_latency': self.latency['max'],
+      'last_latency': self.latency['last'],
+      'poll_interval': ingest_stats['poll_interval']
+    }
+
+# YouTube Manager Class
+# Keeps a registry of the streams being watched, each polled on its own thread in this process.
+# A single scheduler thread moves messages into the response queue, taking turns between the streams
+# that have a message waiting and a rate limit token, so a busy chat can't crowd out the others
+class YouTubeManager:
+
+  # Initialization function
+  def __init__(self, queue, create_chat=pytchat.create):
+    logging.info("YouTubeManager initialized.")
+
+    # Instance variable for the queue
+    self.queue = queue
+    self.create_chat = create_chat
+
+    # Chat pollers by video id, and the order they take turns in
+    self.pollers = {}
+    self.turns = deque()
+
+    # Guards the registry and wakes the scheduler when a poller has new messages or a stream is added or removed
+    self.condition = Condition()
+    self.scheduler = None
+    self.stopping = False
+
+  # Function to start streaming, video_ids is a single id, a comma separated string or a list
+  def start_streaming(self, video_ids):
+    logging.info("Attempting to start streaming.")
+
+    with self.condition:
+      for video_id in parse_video_ids(video_ids):
+
+        # Check if the stream is already watched
+        poller = self.pollers.get(video_id)
+        if poller is not None and poller.is_alive():
+          continue
+
+        poller = ChatPoller(video_id, self.queue, self.notify_scheduler, self.create_chat)
+        self.pollers[video_id] = poller
+        if video_id not in self.turns:
+          self.turns.append(video_id)
+        poller.start()
+
+      # Start the scheduler with the first stream
+      if self.scheduler is None and self.pollers:
+        self.stopping = False
+        self.scheduler = Thread(target=self.schedule, name="youtube_scheduler", daemon=True)
+        self.scheduler.start()
+
+      self.condition.notify_all()
+
+  # Function to stop streaming, every stream if no video id is given
+  def stop_streaming(self, video_ids=None):
+    logging.info("Attempting to stop streaming.")
+
+    with self.condition:
+      video_ids = parse_video_ids(video_ids) or list(self.pollers)
+      pollers = [self.pollers.pop(video_id) for video_id in video_ids if video_id in self.pollers]
+      for video_id in video_ids:
+        if video_id in self.turns:
+          self.turns.remove(video_id)
+
+      # Stop the scheduler with the last stream
+      scheduler = None
+      if not self.pollers:
+        self.stopping = True
+        scheduler, self.scheduler = self.scheduler, None
+
+      self.condition.notify_all()
+
+    # Signal every poller first, so they stop in parallel
+    for poller in pollers:
+      poller.stop_event.set()
+    for poller in pollers:
+      poller.stop()
+
+    if scheduler is not None:
+      scheduler.join()
+
+  # Function to check if streaming is active
+  def is_streaming_active(self):
+    with self.condition:
+      return any(poller.is_alive() for poller in self.pollers.values())
+
+  # Wake the scheduler
+  def notify_scheduler(self):
+    with self.condition:
+      self.condition.notify_all()
+
+  # Find the next stream whose turn it is. Returns (poller, None), or (None, seconds until a rate limit token is available)
+  def next_poller(self):
+    wait_time = None
+
+    for _ in range(len(self.turns)):
+      video_id = self.turns[0]
+      self.turns.rotate(-1)
+      poller = self.pollers[video_id]
+
+      if not poller.ingestor.has_candidates():
+        continue
+
+      token_wait = poller.rate_limiter.wait_time()
+      if token_wait == 0:
+        return poller, None
+
+      wait_time = token_wait if wait_time is None else min(wait_time, token_wait)
+
+    return None, wait_time
+
+  # Scheduler thread, moves one message at a time into the response queue, taking turns between the streams
+  def schedule(self):
+    while True:
+      with self.condition:
+        poller, wait_time = self.next_poller()
+
+        # Sleep until a poller has new messages, a rate limit token is earned or the manager stops
+        while poller is None and not self.stopping:
+          self.condition.wait(wait_time)
+          poller, wait_time = self.next_poller()
+
+        if self.stopping:
+          break
+
+      message = poller.ingestor.pop_best()
+      if message is None:
+        continue
+      poller.rate_limiter.consume()
+
+      # Block while the response queue is full, this is what holds the streams back
+      queue_item = poller.make_queue_item(message)
+      while True:
+        try:
+          self.queue.put(queue_item, timeout=PUT_TIMEOUT)
+          break
+        except Full:
+          with self.condition:
+            if self.stopping:
+              return
+
+  # Record the latency of a reply to a stream
+  def record_reply(self, video_id, latency):
+    with self.condition:
+      poller = self.pollers.get(video_id)
+      if poller is not None:
+        poller.record_reply(latency)
+
+  # Get the stats of every watched stream
+  def get_stats(self):
+    with self.condition:
+      pollers = list(self.pollers.items())
+    return {video_id: poller.get_stats() for video_id, poller in pollers}
+
+  # Get the chat ingestion stats of every watched stream
+  def get_ingest_stats(self):
+    with self.condition:
+      pollers = list(self.pollers.items())
+    return {video_id: poller.ingestor.get_stats() for video_id, poller in pollers}
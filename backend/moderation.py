@@ -1,16 +1,28 @@
 # Import necessary libraries
+import re
 import openai
+import hashlib
 import logging
-import random
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import Lock, BoundedSemaphore
 
 # Import settings
 from .personalities import AI_PERSONALITY
 from better_profanity import profanity
+from better_profanity.utils import get_complete_path_of_file, read_wordlist
 from .config.load_settings import settings
+from .models.moderation_policy import ModerationPolicy
+from .metrics import track_upstream
 
 # Import settings variables
 MOD_REPLACE_RESPONSE = settings['MODERATION_SETTINGS']['MOD_REPLACE_RESPONSE']
 MOD_REPLACE_PROFANITY = settings['MODERATION_SETTINGS']['MOD_REPLACE_PROFANITY']
+LOCAL_MODERATION = settings['MODERATION_SETTINGS']['LOCAL_MODERATION']
+MODERATION_CACHE_SIZE = settings['MODERATION_SETTINGS']['MODERATION_CACHE_SIZE']
+MODERATION_TIMEOUT = settings['MODERATION_SETTINGS']['MODERATION_TIMEOUT']
+MODERATION_PRIORITY = settings['MODERATION_SETTINGS']['MODERATION_PRIORITY']
+MODERATION_THRESHOLDS = settings['MODERATION_SETTINGS']['MODERATION_THRESHOLDS']
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,80 +30,244 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Optionally, you can load a custom profanity wordlist
 # profanity.load_censor_words(["custom_word1", "custom_word2"])
 
+# Categories reported by OpenAI's moderation endpoint
+MODERATION_CATEGORIES = [
+  "sexual", "hate", "harassment", "self-harm", "sexual/minors", "hate/threatening",
+  "violence/graphic", "self-harm/intent", "self-harm/instructions", "harassment/threatening", "violence"
+]
+
+# Words that send text to the remote moderation endpoint, grouped by the category they hint at. They are matched
+# as whole words (plus a plural or verb ending) and only flag text by themselves while the remote endpoint is unavailable
+LOCAL_MODERATION_KEYWORDS = {
+  "sexual": ["sex", "porn", "nude", "naked", "horny", "fetish", "erotic", "orgasm", "strip"],
+  "hate": ["nazi", "racist", "racism", "slur", "supremacist", "supremacy", "inferior race", "genocide"],
+  "harassment": ["idiot", "stupid", "loser", "moron", "ugly", "shut up", "hate you", "pathetic"],
+  "self-harm": ["suicide", "suicidal", "self harm", "self-harm", "cut myself", "kill myself", "end my life", "overdose", "anorexia", "anorexic"],
+  "sexual/minors": ["minor", "underage", "child", "children", "kid", "teen", "loli"],
+  "hate/threatening": ["exterminate", "extermination", "ethnic cleansing", "lynch"],
+  "violence/graphic": ["gore", "blood", "dismember", "mutilate", "mutilation", "behead", "corpse"],
+  "self-harm/intent": ["want to die", "wanna die"],
+  "self-harm/instructions": ["how to kill", "painless way"],
+  "harassment/threatening": ["i will find you", "watch your back", "you're dead", "youre dead"],
+  "violence": ["kill", "murder", "shoot", "stab", "bomb", "attack", "weapon", "gun", "torture", "assault", "rape"]
+}
+
+# Remote moderation calls running at once, a call that would wait for a free worker gets the local verdict instead
+MODERATION_WORKERS = 4
+
+# Characters commonly swapped in for letters to get around word filters
+LEET_CHARACTERS = str.maketrans({"4": "a", "@": "a", "1": "i", "!": "i", "0": "o", "3": "e", "$": "s", "5": "s", "7": "t"})
+
 # Function to filter and replace responses with profanity
 def contains_profanity(text):
   return profanity.contains_profanity(text)
 
+# Local first moderation. A keyword automaton and the profanity word list are compiled into regular expressions once,
+# text that matches neither is cleared locally and everything else is checked by the remote moderation endpoint.
+# Verdicts are cached by the hash of the text, so repeated messages are never checked twice
+class TieredModerator:
+  def __init__(self, cache_size, timeout, use_local=True):
+    self.cache_size = cache_size
+    self.timeout = timeout # Seconds to wait for the remote endpoint before falling back to the local verdict
+    self.use_local = use_local
+    self.cache = OrderedDict() # text hash -> moderation verdict
+    self.lock = Lock()
+    self.executor = ThreadPoolExecutor(max_workers=MODERATION_WORKERS, thread_name_prefix="moderation")
+    self.slots = BoundedSemaphore(MODERATION_WORKERS) # Free workers, a stalled endpoint can't queue up calls behind it
+    self.stats = {'local_clean': 0, 'escalated': 0, 'cache_hits': 0, 'remote_flagged': 0, 'remote_errors': 0}
+
+    # One alternation per category, the named group of the match tells which category it hints at
+    self.keyword_pattern = re.compile("|".join(
+      f"(?P<c{i}>\\b(?:{'|'.join(re.escape(keyword) for keyword in LOCAL_MODERATION_KEYWORDS[category])})(?:s|es|d|ed|ing)?\\b)"
+      for i, category in enumerate(MODERATION_CATEGORIES)
+    ), re.IGNORECASE)
+
+    # The better-profanity word list as a set of words and phrases, looked up one word group at a time
+    self.profane_words = frozenset(word.lower() for word in read_wordlist(get_complete_path_of_file("profanity_wordlist.txt")))
+    self.max_phrase_length = max(len(word.split()) for word in self.profane_words)
+    self.word_pattern = re.compile(r"[a-z0-9']+")
+
+    # Masked words such as "f*ck" can't be matched against the word list
+    self.masked_pattern = re.compile(r"\w\*+\w")
+
+  # Hash used as the cache key
+  @staticmethod
+  def make_key(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+  # Check the text locally. Returns (categories hinted at, contains profanity)
+  def classify_local(self, text):
+    normalized = text.translate(LEET_CHARACTERS)
+
+    categories = {category: False for category in MODERATION_CATEGORIES}
+    for match in self.keyword_pattern.finditer(normalized):
+      categories[MODERATION_CATEGORIES[int(match.lastgroup[1:])]] = True
+
+    has_profanity = self.contains_profane_words(normalized) or self.contains_profane_words(text) or bool(self.masked_pattern.search(text))
+
+    return categories, has_profanity
+
+  # Check every run of up to max_phrase_length words against the word list
+  def contains_profane_words(self, text):
+    words = self.word_pattern.findall(text.lower())
+    for start in range(len(words)):
+      for end in range(start + 1, min(start + self.max_phrase_length, len(words)) + 1):
+        if " ".join(words[start:end]) in self.profane_words:
+          return True
+    return False
+
+  # Ask the remote moderation endpoint
+  @staticmethod
+  def moderate_remote(text):
+    with track_upstream("openai_moderation"):
+      response = openai.Moderation.create(
+        input=text
+      )
+
+    # Uncomment this code block to simulate moderation
+    # response = {
+    #   "results": [
+    #     {
+    #       "flagged": True,
+    #       "categories": {
+    #         "sexual": True,
+    #         "hate": False,
+    #         "harassment": False,
+    #         "self-harm": False,
+    #         "sexual/minors": False,
+    #         "hate/threatening": False,
+    #         "violence/graphic": False,
+    #         "self-harm/intent": False,
+    #         "self-harm/instructions": False,
+    #         "harassment/threatening": False,
+    #         "violence": False,
+    #       }
+    #     }
+    #   ]
+    # }
+
+    output = response["results"][0]
+    return {
+      'flagged': output["flagged"],
+      'categories': dict(output["categories"]),
+      'category_scores': dict(output.get("category_scores", {}))
+    }
+
+  # Moderate the text. Returns a verdict with flagged, categories, category_scores, profanity and source
+  def moderate(self, text):
+    key = self.make_key(text)
+
+    with self.lock:
+      verdict = self.cache.get(key)
+      if verdict is not None:
+        self.cache.move_to_end(key)
+        self.stats['cache_hits'] += 1
+        return verdict
+
+    categories, has_profanity = self.classify_local(text)
+
+    # Clear obviously clean text without a network round trip
+    if self.use_local and not has_profanity and not any(categories.values()):
+      verdict = {'flagged': False, 'categories': categories, 'category_scores': {}, 'profanity': False, 'source': "local"}
+      self.store(key, verdict, 'local_clean')
+      return verdict
+
+    # Escalate ambiguous text to the remote endpoint, unless every worker is still busy with earlier calls
+    if self.slots.acquire(blocking=False):
+      future = self.executor.submit(self.moderate_remote, text)
+      future.add_done_callback(lambda _: self.slots.release())
+      try:
+        verdict = future.result(timeout=self.timeout)
+      except TimeoutError:
+        future.cancel()
+        logging.warning(f"Moderation endpoint timed out after {self.timeout} seconds, using the local verdict")
+      except Exception as e:
+        logging.error(f"An error occurred while calling the moderation endpoint, using the local verdict: {e}")
+      else:
+        verdict.update(profanity=has_profanity, source="remote")
+        self.store(key, verdict, 'remote_flagged' if verdict['flagged'] else 'escalated')
+        return verdict
+    else:
+      logging.warning("Every moderation worker is busy, using the local verdict")
+
+    # The remote endpoint is unavailable, the categories the keywords hinted at are flagged so nothing they caught is spoken unchecked.
+    # Not cached, so the text is checked again once the endpoint is back
+    with self.lock:
+      self.stats['remote_errors'] += 1
+    return {'flagged': any(categories.values()), 'categories': categories, 'category_scores': {}, 'profanity': has_profanity, 'source': "local"}
+
+  # Cache a verdict, evicting the least recently used one when full
+  def store(self, key, verdict, stat):
+    with self.lock:
+      self.stats[stat] += 1
+      self.cache[key] = verdict
+      if len(self.cache) > self.cache_size:
+        self.cache.popitem(last=False)
+
+  # Get the moderation stats
+  def get_stats(self):
+    with self.lock:
+      return dict(self.stats, size=len(self.cache), max_size=self.cache_size)
+
+# Initialize the moderator at startup, so the patterns are only compiled once
+moderator = TieredModerator(MODERATION_CACHE_SIZE, MODERATION_TIMEOUT, LOCAL_MODERATION)
+
+# Moderation policies, built once per personality
+moderation_policies = {}
+
+# Get the moderation policy of a personality
+def get_moderation_policy(personality=AI_PERSONALITY):
+  policy = moderation_policies.get(personality["name"])
+  if policy is None:
+    policy = ModerationPolicy.from_personality(personality, MODERATION_PRIORITY or MODERATION_CATEGORIES, MODERATION_THRESHOLDS)
+    moderation_policies[personality["name"]] = policy
+  return policy
+
+# Get the moderation stats
+def get_moderation_stats():
+  return {'moderator': moderator.get_stats(), 'policy': get_moderation_policy().get_stats()}
+
 # Function to filter profane text
 def censor_profanity(text):
   return profanity.censor(text, MOD_REPLACE_PROFANITY)
 
 # Moderation function
 def moderate_output(ai_response):
-  response = openai.Moderation.create(
-    input=ai_response
-  )
-
-  # Uncomment this code block to simulate moderation
-  # response = {
-  #   "results": [
-  #     {
-  #       "flagged": True,
-  #       "categories": {
-  #         "sexual": True,
-  #         "hate": False,
-  #         "harassment": False,
-  #         "self-harm": False,
-  #         "sexual/minors": False,
-  #         "hate/threatening": False,
-  #         "violence/graphic": False,
-  #         "self-harm/intent": False,
-  #         "self-harm/instructions": False,
-  #         "harassment/threatening": False,
-  #         "violence": False,
-  #       }
-  #     }
-  #   ]
-  # }
-
-  output = response["results"][0]
-  flagged = output["flagged"]
-  categories = output["categories"]
+  ai_response, _ = check_moderation(ai_response)
+  return ai_response
+
+# Check an incoming message before it is sent to the chat model. Returns the canned reply if it is flagged, otherwise None
+def screen_input(message_input):
+  verdict = moderator.moderate(message_input)
+  category, reply = get_moderation_policy().decide(verdict['flagged'], verdict['categories'], verdict['category_scores'])
+  if category is None:
+    return None
+
+  logging.warning(f"User message: {message_input}; Content violates OpenAI's usage policies. Violated category: {category}")
+  return reply
+
+# Moderation function that also reports whether the content was flagged
+def check_moderation(ai_response):
+  verdict = moderator.moderate(ai_response)
+
+  # Pick the most severe violated category and the personality's reply for it
+  category, reply = get_moderation_policy().decide(verdict['flagged'], verdict['categories'], verdict['category_scores'])
+  flagged = category is not None
 
   if flagged:
 
     # Show the violation in terminal
-    logging.warning(f"AI Resposne: {ai_response}; Content violates OpenAI's usage policies. Violated categories: {categories}")
+    logging.warning(f"AI Resposne: {ai_response}; Content violates OpenAI's usage policies. Violated category: {category}")
 
     # Craft new response based on Personality
-    moderation = AI_PERSONALITY["ai_moderation"]
-    
-    # Customize the response based on the violated category
-    if categories["sexual"]:
-      ai_response = random.choice(moderation["sexual"])
-    elif categories["hate"]:
-      ai_response = random.choice(moderation["hate"])
-    elif categories["harassment"]:
-      ai_response = random.choice(moderation["harassment"])
-    elif categories["self-harm"]:
-      ai_response = random.choice(moderation["self-harm"])
-    elif categories["sexual/minors"]:
-      ai_response = random.choice(moderation["sexual/minors"])
-    elif categories["hate/threatening"]:
-      ai_response = random.choice(moderation["hate/threatening"])
-    elif categories["violence/graphic"]:
-      ai_response = random.choice(moderation["violence/graphic"])
-    elif categories["self-harm/intent"]:
-      ai_response = random.choice(moderation["self-harm/intent"])
-    elif categories["self-harm/instructions"]:
-      ai_response = random.choice(moderation["self-harm/instructions"])
-    elif categories["harassment/threatening"]:
-      ai_response = random.choice(moderation["harassment/threatening"])
-    elif categories["violence"]:
-      ai_response = random.choice(moderation["violence"])
+    ai_response = reply
       
   else:
-    logging.info("Content complies with OpenAI's usage policies.")
+    logging.info(f"Content complies with OpenAI's usage policies ({verdict['source']} check).")
+
+  # Text the local check found free of profanity doesn't need to go through better-profanity, without LOCAL_MODERATION it always does
+  if LOCAL_MODERATION and not verdict['profanity']:
+    return ai_response, flagged
 
   # Uncomment this code block to simulate profanity
   # ai_response = "what the fuck is that? WTF!"
@@ -110,4 +286,4 @@ def moderate_output(ai_response):
     # Set MOD_REPLACE_RESPONSE to False if you want the profane words in ai_response to be filtered
     ai_response = censor_profanity(ai_response)
   
-  return ai_response
+  return ai_response, flagged
@@ -1,12 +1,15 @@
 # Import necessary libraries
 import os
+import io
+import re
+import wave
+import time
+import hashlib
+import tempfile
+from collections import OrderedDict
+from threading import Lock
 from dotenv import load_dotenv
-import requests
-import subprocess
 import logging
-import tempfile
-import pyaudio
-import wave
 
 # Load environment variables from .env file
 load_dotenv("config/.env")
@@ -17,8 +20,9 @@ google_app_creds = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 # Import Google Cloud text-to-speech
 from google.cloud import texttospeech
 
-# Set the environment variable
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = google_app_creds
+# Set the environment variable, if the credentials are configured (they aren't needed offline, e.g. by the benchmark)
+if google_app_creds:
+  os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = google_app_creds
 
 # Import ElevenLabs text-to-speech
 from elevenlabs import generate, play
@@ -34,25 +38,211 @@ AI_VOICE_ID = settings['AI_AUDIO_SETTINGS']['AI_VOICE_ID']
 AI_VOICE = settings['AI_AUDIO_SETTINGS']['AI_VOICE']
 ELABS_MODEL = settings['AI_AUDIO_SETTINGS']['ELABS_MODEL']
 MIN_SENTENCE_LENGTH = settings['MAIN_AI_SETTINGS']['MIN_SENTENCE_LENGTH']
+AUDIO_SAMPLE_RATE = settings['AI_AUDIO_SETTINGS']['AUDIO_SAMPLE_RATE']
+GOOGLE_RAW_PCM = settings['AI_AUDIO_SETTINGS']['GOOGLE_RAW_PCM']
+AUDIO_CACHE_MEMORY_MB = settings['AI_AUDIO_SETTINGS']['AUDIO_CACHE_MEMORY_MB']
+AUDIO_CACHE_DISK_MB = settings['AI_AUDIO_SETTINGS']['AUDIO_CACHE_DISK_MB']
+AUDIO_CACHE_DIR = settings['AI_AUDIO_SETTINGS']['AUDIO_CACHE_DIR']
+
+# Google text-to-speech voice settings
+GOOGLE_VOICE_NAME = "en-US-Standard-F"
+GOOGLE_SPEAKING_RATE = 1.25  # Increase this number to speed up speech
+GOOGLE_AUDIO_EXTENSION = "pcm" if GOOGLE_RAW_PCM else "wav"
+
+# ElevenLabs returns 128 kbps MP3 by default, used to estimate how long the audio is without decoding it
+ELABS_MP3_BYTES_PER_SECOND = 128000 / 8
+
+# Import the audio engine
+from .models.audio_engine import AudioEngine, iter_pcm_slices, parse_wav
+from .tracing import span
+from .metrics import track_upstream, tts_audio_seconds
+
+# Initialize the audio engine shared by every utterance
+audio_engine = AudioEngine(os.environ.get("ELEVEN_API_KEY"))
+
+# Cache of synthesized audio, with an in-memory LRU tier and an on-disk tier
+class AudioCache:
+  def __init__(self, memory_max_bytes, disk_dir, disk_max_bytes):
+    self.memory_max_bytes = memory_max_bytes
+    self.disk_dir = disk_dir
+    self.disk_max_bytes = disk_max_bytes
+    self.memory = OrderedDict() # key -> audio bytes, least recently used first
+    self.memory_bytes = 0
+    self.lock = Lock()
+    self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    if disk_dir:
+      os.makedirs(disk_dir, exist_ok=True)
+
+      # Delete the partial files of writes interrupted by a crash
+      for entry in os.scandir(disk_dir):
+        if entry.name.endswith(".tmp"):
+          os.remove(entry.path)
+
+  # Cache key for an utterance. Whitespace is normalized so the same line always maps to the same audio
+  def make_key(self, text, engine, voice, model, speaking_rate=None):
+    normalized_text = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha256(f"{engine}|{voice}|{model}|{speaking_rate}|{normalized_text}".encode()).hexdigest()
+
+  # Path of a cached file on disk
+  def disk_path(self, key, extension):
+    return os.path.join(self.disk_dir, f"{key}.{extension}")
+
+  # Get cached audio, checking memory first and then disk
+  def get(self, key, extension):
+    with self.lock:
+      audio = self.memory.get(key)
+      if audio is not None:
+        self.memory.move_to_end(key)
+        self.stats['memory_hits'] += 1
+        return audio
+
+    # The file can be evicted by another worker at any point, that counts as a miss
+    if self.disk_dir:
+      path = self.disk_path(key, extension)
+      try:
+        with open(path, "rb") as audio_file:
+          audio = audio_file.read()
+
+        # Mark the file as recently used for disk eviction
+        os.utime(path)
+      except FileNotFoundError:
+        pass
+      else:
+        with self.lock:
+          self.stats['disk_hits'] += 1
+        self.put_memory(key, audio)
+        return audio
+
+    with self.lock:
+      self.stats['misses'] += 1
+    return None
+
+  # Store audio in both tiers
+  def put(self, key, extension, audio):
+    self.put_memory(key, audio)
+
+    if self.disk_dir:
+
+      # Write to a temporary file and move it into place, so a crash or a concurrent reader never sees a partial file
+      temp_fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.disk_dir)
+      try:
+        with os.fdopen(temp_fd, "wb") as audio_file:
+          audio_file.write(audio)
+        os.replace(temp_path, self.disk_path(key, extension))
+      except OSError:
+        os.remove(temp_path)
+        raise
+      self.evict_disk()
+
+  # Store audio in memory, evicting the least recently used entries
+  def put_memory(self, key, audio):
+    with self.lock:
+      if key in self.memory:
+        self.memory_bytes -= len(self.memory.pop(key))
+
+      self.memory[key] = audio
+      self.memory_bytes += len(audio)
+
+      while self.memory_bytes > self.memory_max_bytes and self.memory:
+        _, evicted = self.memory.popitem(last=False)
+        self.memory_bytes -= len(evicted)
+
+  # Delete the least recently used files until the disk tier fits its size limit
+  def evict_disk(self):
+    with self.lock:
+      entries = []
+      for entry in os.scandir(self.disk_dir):
+
+        # Files still being written are left alone
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+          stat = entry.stat()
+          entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+      total_bytes = sum(size for _, size, _ in entries)
+      for _, size, path in sorted(entries):
+        if total_bytes <= self.disk_max_bytes:
+          break
+        os.remove(path)
+        total_bytes -= size
+
+  # Get the cache stats
+  def get_stats(self):
+    with self.lock:
+      return dict(self.stats, memory_entries=len(self.memory), memory_bytes=self.memory_bytes)
+
+# Initialize the audio cache, relative cache folders are kept next to this file
+audio_cache = AudioCache(
+  AUDIO_CACHE_MEMORY_MB * 1024 * 1024,
+  os.path.join(os.path.dirname(os.path.abspath(__file__)), AUDIO_CACHE_DIR) if AUDIO_CACHE_DIR else None,
+  AUDIO_CACHE_DISK_MB * 1024 * 1024
+)
+
+# Seconds of 16-bit mono PCM or WAV audio
+def audio_duration(audio, raw_pcm=False, rate=AUDIO_SAMPLE_RATE):
+  if raw_pcm:
+    return len(audio) / (2 * rate)
+
+  pcm, sample_width, channels, rate = parse_wav(audio)
+  return len(pcm) / (sample_width * channels * rate)
+
+# Wrap PCM audio in a WAV header so it can be cached and played back like Google TTS audio
+def make_wav(pcm, sample_width=2, channels=1, rate=AUDIO_SAMPLE_RATE):
+  buffer = io.BytesIO()
+  with wave.open(buffer, "wb") as wav_file:
+    wav_file.setsampwidth(sample_width)
+    wav_file.setnchannels(channels)
+    wav_file.setframerate(rate)
+    wav_file.writeframes(pcm)
+  return buffer.getvalue()
 
 # Generate audio using ElevenLabs client
 def generate_audio(text, voice=AI_VOICE, model=ELABS_MODEL):
-  return generate(
-    text=text,
-    voice=voice,
-    model=model
-  )
+  key = audio_cache.make_key(text, "elevenlabs", voice, model)
+
+  with span("tts_synthesis", engine="elevenlabs", characters=len(text)) as attributes:
+
+    # Reuse audio that was already generated for this line
+    ai_audio = audio_cache.get(key, "mp3")
+    attributes['cached'] = ai_audio is not None
+    if ai_audio is None:
+      with track_upstream("elevenlabs"):
+        ai_audio = generate(
+          text=text,
+          voice=voice,
+          model=model
+        )
+      audio_cache.put(key, "mp3", ai_audio)
+      tts_audio_seconds.inc("elevenlabs", amount=len(ai_audio) / ELABS_MP3_BYTES_PER_SECOND)
+
+  return ai_audio
 
 # Check if AI response has multiple long messages. Use with ElevenLabs client
 def speak_sentences(sentences):
   if len(sentences) == 1:
     ai_audio = generate_audio(sentences[0])
-    play(ai_audio)
+    with span("playback", engine="elevenlabs"):
+      play(ai_audio)
   else:
     # Handle multiple sentences
     for sentence in sentences:
       ai_audio = generate_audio(sentence)
-      play(ai_audio)
+      with span("playback", engine="elevenlabs"):
+        play(ai_audio)
+
+# Find where the first sentence ends after max_length. Returns None if no punctuation mark was found
+def find_sentence_end(text, max_length=MIN_SENTENCE_LENGTH):
+
+  # Find the nearest punctuation mark after max_length
+  split_at = max_length
+  while split_at < len(text) and text[split_at] not in ['.', '!', '?']:
+    split_at += 1
+
+  # If we found a punctuation mark, we include it in the current chunk
+  if split_at < len(text):
+    return split_at + 1
+
+  return None
 
 # Split sentences into text chuncks. Use with ElevenLabs client (non-streaming mode)
 def split_text(text, max_length=MIN_SENTENCE_LENGTH):
@@ -62,133 +252,147 @@ def split_text(text, max_length=MIN_SENTENCE_LENGTH):
       sentences.append(text)
       break
 
-    # Find the nearest punctuation mark after max_length
-    split_at = max_length
-    while split_at < len(text) and text[split_at] not in ['.', '!', '?']:
-      split_at += 1
-
-    # If we found a punctuation mark, we include it in the current chunk
-    if split_at < len(text):
-      split_at += 1
+    # Split at the nearest punctuation mark, or keep the rest of the text if there is none
+    split_at = find_sentence_end(text, max_length)
+    if split_at is None:
+      split_at = len(text)
 
     sentences.append(text[:split_at].strip())
     text = text[split_at:].strip()
 
   return sentences
 
+# Split a stream of text tokens into sentences as soon as they are complete. Uses the same rules as split_text
+def split_text_stream(tokens, max_length=MIN_SENTENCE_LENGTH):
+  buffer = ""
+  has_split = False
+  for token in tokens:
+    buffer += token
+
+    # Like split_text, every sentence after the first one starts without leading whitespace
+    if has_split:
+      buffer = buffer.lstrip()
+
+    # Yield every sentence that has been completed by the latest token
+    split_at = find_sentence_end(buffer, max_length)
+    while split_at is not None:
+      yield buffer[:split_at].strip()
+      buffer = buffer[split_at:].lstrip()
+      has_split = True
+      split_at = find_sentence_end(buffer, max_length)
+
+  # Yield whatever is left once the stream is finished
+  if buffer.strip():
+    yield buffer.strip()
+
 # Stream audio using ElevenLabs API
-def stream_audio(text, voice=AI_VOICE_ID, model=ELABS_MODEL, api_key=os.environ.get("ELEVEN_API_KEY")):
-  CHUNK_SIZE = 1096
-  url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice}/stream"
-
-  headers = {
-    "Accept": "*/*",
-    "Content-Type": "application/json",
-    "xi-api-key": api_key
-  }
-
-  data = {
-    "text": text,
-    "model_id": model,
-    "voice_settings": {
-      "stability": 0.5,
-      "similarity_boost": 0.5
-    }
-  }
-
-  response = requests.post(url, headers=headers, json=data, stream=True)
-  response.raise_for_status()
+def stream_audio(text, voice=AI_VOICE_ID, model=ELABS_MODEL):
+  key = audio_cache.make_key(text, "elevenlabs-stream", voice, model, AUDIO_SAMPLE_RATE)
+
+  # Play cached audio right away
+  cached_audio = audio_cache.get(key, "wav")
+  if cached_audio is not None:
+    logging.info(f"Playing cached audio for text: {text}")
+    with span("playback", engine="elevenlabs-stream", cached=True):
+      audio_engine.play_wav(cached_audio)
+    return
 
   logging.info(f"Streaming audio for text: {text}")
 
-  # use subprocess to pipe the audio data to ffplay and play it
-  ffplay_cmd = ['ffplay', '-nodisp', '-autoexit', '-']
-  ffplay_proc = subprocess.Popen(ffplay_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  # Keep the chunks while they play, so the audio can be cached once the stream is complete
+  chunks = []
+  def collect_chunks():
+    for chunk in audio_engine.stream_elevenlabs(text, voice, model, rate=AUDIO_SAMPLE_RATE):
+      if not chunks:
+        attributes['first_chunk'] = round(time.time() - start, 6)
+      chunks.append(chunk)
+      yield chunk
 
-  for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-    ffplay_proc.stdin.write(chunk)
+  # Write the PCM audio into the output stream while it is still downloading.
+  # Synthesis and playback overlap here, so they are timed as a single span
+  start = time.time()
+  with span("tts_stream", engine="elevenlabs-stream", characters=len(text)) as attributes:
+    audio_engine.play_pcm(collect_chunks(), rate=AUDIO_SAMPLE_RATE)
 
-  # close the ffplay process when finished
-  ffplay_proc.stdin.close()
-  ffplay_proc.wait()
+  pcm = b"".join(chunks)
+  audio_cache.put(key, "wav", make_wav(pcm))
+  tts_audio_seconds.inc("elevenlabs-stream", amount=len(pcm) / (2 * AUDIO_SAMPLE_RATE))
 
-# Function to generate audio using Google Text-to-Speech
-def google_generate_audio(text):
-    
-  # Initialize the TextToSpeech client
-  client = texttospeech.TextToSpeechClient()
-  
-  # Prepare the text input for the Text-to-Speech API
-  input_text = texttospeech.SynthesisInput(text=text)
+# Function to synthesize speech with Google Text-to-Speech. Returns raw PCM or WAV audio, cached by text and voice
+def google_synthesize(text):
+  key = audio_cache.make_key(text, "google", GOOGLE_VOICE_NAME, AUDIO_SAMPLE_RATE, GOOGLE_SPEAKING_RATE)
+
+  cached_audio = audio_cache.get(key, GOOGLE_AUDIO_EXTENSION)
+  if cached_audio is not None:
+    with span("tts_synthesis", engine="google", characters=len(text), cached=True):
+      return cached_audio
   
   # Configure voice settings such as language, voice type, and gender
   voice = texttospeech.VoiceSelectionParams(
     language_code="en-US",
-    name="en-US-Standard-F",
+    name=GOOGLE_VOICE_NAME,
     ssml_gender=texttospeech.SsmlVoiceGender.FEMALE
   )
   
   # Configure audio settings like the audio file format and speaking rate
+  # PCM is LINEAR16 without the WAV header
   audio_config = texttospeech.AudioConfig(
-    audio_encoding=texttospeech.AudioEncoding.LINEAR16,
-    speaking_rate=1.25  # Increase this number to speed up speech
-  )
-  
-  # Make the API call to generate speech
-  response = client.synthesize_speech(
-    input=input_text, 
-    voice=voice, 
-    audio_config=audio_config
+    audio_encoding=texttospeech.AudioEncoding.PCM if GOOGLE_RAW_PCM else texttospeech.AudioEncoding.LINEAR16,
+    sample_rate_hertz=AUDIO_SAMPLE_RATE, # Same rate as the open output stream
+    speaking_rate=GOOGLE_SPEAKING_RATE
   )
   
-  # Create a temporary file to store the audio
-  with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-      
-    # Write the audio data to the temporary file
-    temp_file.write(response.audio_content)
-    
-    # Store the path to the temporary file
-    temp_file_path = temp_file.name
+  # Make the API call to generate speech with the shared client
+  with span("tts_synthesis", engine="google", characters=len(text), cached=False):
+    response = audio_engine.synthesize_google(text, voice, audio_config)
+
+  audio_cache.put(key, GOOGLE_AUDIO_EXTENSION, response.audio_content)
+  tts_audio_seconds.inc("google", amount=audio_duration(response.audio_content, GOOGLE_RAW_PCM))
+
+  return response.audio_content
+
+# Function to generate audio using Google Text-to-Speech
+def google_generate_audio(text):
+  audio = google_synthesize(text)
 
   try:
-    
-    # Play the audio using your existing 'play' function
-    play_audio_with_pyaudio(temp_file_path)
-    
-    # Delete the temporary file after playing
-    os.remove(temp_file_path)
+
+    # Play the audio straight from the buffer
+    with span("playback", engine="google"):
+      if GOOGLE_RAW_PCM:
+        audio_engine.play_pcm(iter_pcm_slices(audio, 2), rate=AUDIO_SAMPLE_RATE)
+      else:
+        audio_engine.play_wav(audio)
       
   except Exception as e:
-    
-    # If something goes wrong, delete the temporary file and log the error
-    os.remove(temp_file_path)
     logging.error("Error processing Google TTS request:", exc_info=True)
 
-# Function to play temp audio files
+# Synthesize lines ahead of time so they play instantly from the cache
+def prewarm_audio_cache(lines, use_elabs, elabs_stream, use_google):
+  for line in lines:
+    try:
+      if use_elabs and elabs_stream:
+        key = audio_cache.make_key(line, "elevenlabs-stream", AI_VOICE_ID, ELABS_MODEL, AUDIO_SAMPLE_RATE)
+        if audio_cache.get(key, "wav") is None:
+          pcm = b"".join(audio_engine.stream_elevenlabs(line, AI_VOICE_ID, ELABS_MODEL, rate=AUDIO_SAMPLE_RATE))
+          audio_cache.put(key, "wav", make_wav(pcm))
+
+      elif use_elabs:
+        for sentence in split_text(line):
+          generate_audio(sentence)
+
+      elif use_google:
+        google_synthesize(line)
+
+    except Exception as e:
+      logging.error(f"An error occurred while prewarming the audio cache: {e}")
+
+  logging.info(f"Audio cache prewarmed with {len(lines)} lines")
+
+# Function to play audio files
 def play_audio_with_pyaudio(file_path):
-    
-  # Open the file
-  wf = wave.open(file_path, 'rb')
-
-  # Initialize PyAudio
-  p = pyaudio.PyAudio()
-
-  # Open a streaming stream
-  stream = p.open(format=p.get_format_from_width(wf.getsampwidth()),
-                  channels=wf.getnchannels(),
-                  rate=wf.getframerate(),
-                  output=True)
-
-  # Play audio
-  data = wf.readframes(1024)
-  while len(data) > 0:
-    stream.write(data)
-    data = wf.readframes(1024)
-
-  # Close stream and PyAudio
-  stream.stop_stream()
-  stream.close()
-  p.terminate()
+  with open(file_path, 'rb') as audio_file:
+    audio_engine.play_wav(audio_file.read())
 
 # Set default voice engine
 def default_audio(text):
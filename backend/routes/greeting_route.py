@@ -1,7 +1,10 @@
 # Import necessary libraries
 from flask import Blueprint, jsonify
 import logging
-from ..ai_response import get_ai_response  # Replace 'your_project_name' with the actual name or path
+from ..ai_response import get_ai_response, session_store  # Replace 'your_project_name' with the actual name or path
+from ..app import playback_gate
+from ..models.session_store import get_session_id
+from ..tracing import traced_request
 
 # Create a Blueprint
 greeting_app = Blueprint('greeting_app', __name__)
@@ -13,8 +16,13 @@ def greeting():
   # Set greeting command
   user_input = "Give the User a warm welcome"
 
-  # Get AI response
-  ai_response = get_ai_response(user_input, 'system')
+  # Get AI response, played in turn with the queued responses
+  turn = playback_gate.next_turn()
+  try:
+    with traced_request("greeting"):
+      ai_response = get_ai_response(user_input, 'system', turn=turn, session=session_store.get(get_session_id()))
+  finally:
+    turn.finish()
 
   logging.info(f"Greeting request received: {ai_response}")
 
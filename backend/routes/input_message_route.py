@@ -1,9 +1,12 @@
 # Import necessary libraries
-from flask import Blueprint
+from flask import Blueprint, request
 from html import escape
 import logging
+import time
 from ..app import socketio, high_priority_queue
 from ..image_reader import upload_image
+from ..models.session_store import get_session_id
+from ..tracing import new_request_id
 
 # Create a Blueprint
 input_message_app = Blueprint('input_message_app', __name__)
@@ -33,5 +36,5 @@ def handle_input_message(json_data):
     return
 
   # Insert the message into the shared queue
-  high_priority_queue.put({"source": "input", "input": user_input, "image_description": image_description})
+  high_priority_queue.put({"source": "input", "input": user_input, "image_description": image_description, "queued_at": time.time(), "request_id": new_request_id(), "session_id": get_session_id(json_data), "sid": request.sid})
   logging.info(f"Added high priority item to queue: input_message")
@@ -0,0 +1,11 @@
+# Import necessary libraries
+from flask import Blueprint, Response
+from ..metrics import metrics_registry
+
+# Create a Blueprint
+metrics_app = Blueprint('metrics_app', __name__)
+
+# Endpoint to scrape the backend metrics in the Prometheus text format
+@metrics_app.route('', methods=['GET'])
+def metrics():
+  return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
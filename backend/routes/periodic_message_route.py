@@ -2,7 +2,10 @@
 from flask import Blueprint, jsonify
 import logging
 import random
-from ..ai_response import get_ai_response  # Replace with the actual name or path
+from ..ai_response import get_ai_response, session_store  # Replace with the actual name or path
+from ..app import playback_gate
+from ..models.session_store import get_session_id
+from ..tracing import traced_request
 
 # Import settings
 from ..personalities import AI_PERSONALITY
@@ -17,7 +20,12 @@ def periodic_message():
   # Set periodic message command based on AI personality
   system_input = random.choice(AI_PERSONALITY["periodic_messages"]["passive"])
 
-  # Get AI response
-  ai_response = get_ai_response(system_input, 'system')
+  # Get AI response, played in turn with the queued responses
+  turn = playback_gate.next_turn()
+  try:
+    with traced_request("periodic_message"):
+      ai_response = get_ai_response(system_input, 'system', turn=turn, session=session_store.get(get_session_id()))
+  finally:
+    turn.finish()
   logging.info(f"Banter request received: {ai_response}")
   return jsonify(ai_response)
@@ -1,17 +1,12 @@
 # Import necessary libraries
 from flask import Blueprint, jsonify, request
 import logging
-import tempfile
 import time
-import os
-import openai
-from ..ai_response import get_ai_response
-
-# Import settings
-from ..config.load_settings import settings
-
-# Import settings variables
-OPENAI_WHISPER_MODEL = settings['AI_AUDIO_SETTINGS']['OPENAI_WHISPER_MODEL']
+from ..ai_response import get_ai_response, session_store
+from ..app import playback_gate
+from ..models.session_store import get_session_id
+from ..transcription import transcribe_upload
+from ..tracing import traced_request
 
 # Create a Blueprint
 voice_app = Blueprint('voice_app', __name__)
@@ -30,30 +25,26 @@ def voice():
   if audio_file.filename == '':
     return jsonify(error="No selected file"), 400
 
-  # Create a temporary file
-  with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-    audio_file.save(temp_file.name)
-    temp_file_path = temp_file.name
-
   try:
-    # Start the monitoring timer
-    start_transcription_time = time.time()
+    with traced_request("voice"):
+
+      # Start the monitoring timer
+      start_transcription_time = time.time()
 
-    # Transcribe the audio file to text
-    with open(temp_file_path, "rb") as file_to_send:
-      transcription_result = openai.Audio.transcribe(model=OPENAI_WHISPER_MODEL, file=file_to_send)
-      transcription = transcription_result['text']
-    
-    # End the transcription monitoring timer
-    end_transcription_time = time.time()
-    transcription_time = end_transcription_time - start_transcription_time
-    logging.info(f"Audio Transcription Time: {transcription_time:.2f} seconds")
+      # Transcribe the recording straight from memory
+      transcription = transcribe_upload(audio_file.read())
 
-    # Generate the AI response based on the transcription
-    ai_response = get_ai_response(transcription, 'user')
+      # End the transcription monitoring timer
+      end_transcription_time = time.time()
+      transcription_time = end_transcription_time - start_transcription_time
+      logging.info(f"Audio Transcription Time: {transcription_time:.2f} seconds")
 
-    # Remove the temporary audio file
-    os.remove(temp_file_path)
+      # Generate the AI response based on the transcription, played in turn with the queued responses
+      turn = playback_gate.next_turn()
+      try:
+        ai_response = get_ai_response(transcription, 'user', turn=turn, session=session_store.get(get_session_id(request.form)))
+      finally:
+        turn.finish()
 
     return jsonify({
       "transcription": transcription,
@@ -61,7 +52,5 @@ def voice():
     })
 
   except Exception as e:
-    # Remove the temporary audio file in case of an exception
-    os.remove(temp_file_path)
     logging.error("Error processing voice request:", exc_info=True)
     return jsonify(error=str(e)), 500
@@ -1,7 +1,9 @@
 # Import necessary libraries
+import os
 import openai
 import nltk
 import logging
+from functools import lru_cache
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 
 # Configure logging
@@ -15,21 +17,54 @@ from .config.load_settings import settings
 SENTIMENT_SCORES = settings['SENTIMENT_ANALYSIS_SETTINGS']['SENTIMENT_SCORES']
 MAX_LEVEL = settings['SENTIMENT_ANALYSIS_SETTINGS']['MAX_LEVEL']
 MIN_LEVEL = settings['SENTIMENT_ANALYSIS_SETTINGS']['MIN_LEVEL']
+SENTIMENT_CACHE_SIZE = settings['SENTIMENT_ANALYSIS_SETTINGS']['SENTIMENT_CACHE_SIZE']
+
+# Add the bundled NLTK data to the search path once
+NLTK_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', 'nltk_data')
+if NLTK_DATA_PATH not in nltk.data.path:
+  nltk.data.path.append(NLTK_DATA_PATH)
+
+# VADER sentiment engine. Loads the lexicon once and caches the scores of repeated messages
+class SentimentEngine:
+  def __init__(self, cache_size):
+    self.analyzer = SentimentIntensityAnalyzer()
+    self.cached_classify = lru_cache(maxsize=cache_size)(self.classify)
+
+  # Classify sentiment and intensity based on the compound score
+  def classify(self, text):
+    compound_score = self.analyzer.polarity_scores(text)['compound']
+
+    if compound_score >= 0.05:
+      return "positive", compound_score
+    elif compound_score <= -0.05:
+      return "negative", -compound_score
+    else:
+      return "neutral", 0
+
+  # Score a single message
+  def analyze(self, text):
+    return self.cached_classify(text)
+
+  # Score a list of messages, each distinct message is only scored once
+  def analyze_batch(self, texts):
+    scores = {text: self.cached_classify(text) for text in dict.fromkeys(texts)}
+    return [scores[text] for text in texts]
+
+  # Get the cache stats
+  def get_stats(self):
+    cache_info = self.cached_classify.cache_info()
+    return {'hits': cache_info.hits, 'misses': cache_info.misses, 'size': cache_info.currsize, 'max_size': cache_info.maxsize}
+
+# Initialize the sentiment engine at startup
+sentiment_engine = SentimentEngine(SENTIMENT_CACHE_SIZE)
 
 # Sentiment analysis 2.0
 def analyze_sentiment_vader(text):
-  nltk.data.path.append('./resources/nltk_data')
-  sia = SentimentIntensityAnalyzer()
-  sentiment_score = sia.polarity_scores(text)
-  compound_score = sentiment_score['compound']
+  return sentiment_engine.analyze(text)
 
-  # Classify sentiment and intensity based on the compound score
-  if compound_score >= 0.05:
-    return "positive", compound_score
-  elif compound_score <= -0.05:
-    return "negative", -compound_score
-  else:
-    return "neutral", 0
+# Score a list of messages with VADER
+def analyze_sentiment_vader_batch(texts):
+  return sentiment_engine.analyze_batch(texts)
 
 # Sentiment analysis 1.0
 # todo: Further testing required, sometimes will use other words and that will break the system. This NEEDS to be consistent
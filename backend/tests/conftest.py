@@ -0,0 +1,8 @@
+# Import necessary libraries
+import os
+
+# Folder the app runs from, settings are loaded relative to it
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run the tests from the backend folder, before any module loads the settings
+os.chdir(BACKEND_DIR)
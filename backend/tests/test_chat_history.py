@@ -0,0 +1,61 @@
+# Import necessary libraries
+from backend.models.chat_history import ChatHistory, count_message_tokens, count_tokens, truncate_to_tokens, get_context_window, DEFAULT_CONTEXT_WINDOW
+
+def message(role, content):
+  return {"role": role, "content": content}
+
+MESSAGES = [message("user" if index % 2 == 0 else "assistant", f"message number {index} " + "word " * index) for index in range(6)]
+
+def test_history_keeps_the_newest_messages():
+  history = ChatHistory(max_messages=3)
+  for chat_message in MESSAGES:
+    history.append(chat_message)
+
+  assert len(history) == 3
+  assert history.get_messages() == MESSAGES[-3:]
+
+  # The token count follows the messages that are dropped
+  assert history.total_tokens == sum(count_message_tokens(chat_message) for chat_message in MESSAGES[-3:])
+
+def test_system_messages_are_not_stored():
+  history = ChatHistory(max_messages=3)
+  history.append(message("system", "You are a helpful assistant"))
+  history.append(MESSAGES[0])
+
+  assert history.get_messages() == [MESSAGES[0]]
+
+def test_budget_keeps_the_newest_messages_that_fit():
+  history = ChatHistory(max_messages=10)
+  for chat_message in MESSAGES:
+    history.append(chat_message)
+
+  # Exactly the last three messages fit
+  budget = sum(count_message_tokens(chat_message) for chat_message in MESSAGES[-3:])
+  assert history.get_messages(budget) == MESSAGES[-3:]
+
+  # One token less drops the oldest of them
+  assert history.get_messages(budget - 1) == MESSAGES[-2:]
+
+  # A budget that fits everything keeps everything, one that fits nothing keeps nothing
+  assert history.get_messages(history.total_tokens) == MESSAGES
+  assert history.get_messages(0) == []
+
+def test_budget_never_changes_the_history():
+  history = ChatHistory(max_messages=10)
+  for chat_message in MESSAGES:
+    history.append(chat_message)
+
+  history.get_messages(1)
+  assert history.get_messages() == MESSAGES
+
+def test_truncate_to_tokens():
+  text = "one two three four five six seven eight nine ten " * 10
+
+  truncated = truncate_to_tokens(text, 5)
+  assert text.startswith(truncated)
+  assert 0 < count_tokens(truncated) <= 5
+  assert truncate_to_tokens(text, 0) == ""
+
+def test_context_window_of_unknown_models():
+  assert get_context_window("gpt-4") == 8192
+  assert get_context_window("some-new-model") == DEFAULT_CONTEXT_WINDOW
@@ -0,0 +1,107 @@
+# Import necessary libraries
+import json
+import time
+import pytest
+from queue import Queue
+from backend.models.chat_replay import ReplayChat, make_replay_chat_factory
+
+RECORDS = [
+  {'time': 0, 'author': "alice", 'message': "what do you think about cats?"},
+  {'time': 0, 'author': "bob", 'author_id': "bob-id", 'message': "I love this stream so much", 'member': True},
+  {'time': 0, 'author': "carol", 'message': "thanks for the stream", 'type': "superChat", 'amount': 5},
+  {'time': 30, 'author': "dave", 'message': "how was your day today?"}
+]
+
+def write_recording(path, records):
+  path.write_text("\n".join(json.dumps(record) for record in records) + "\n")
+
+# Poll a replay until it has returned count messages
+def collect(chat, count, timeout=2):
+  messages = []
+  deadline = time.monotonic() + timeout
+  while len(messages) < count and time.monotonic() < deadline:
+    messages.extend(chat.get().sync_items())
+    time.sleep(0.01)
+  return messages
+
+def test_replay_returns_the_messages_posted_so_far():
+  chat = ReplayChat(RECORDS)
+
+  items = list(chat.get().sync_items())
+  assert [item.message for item in items] == [record['message'] for record in RECORDS[:3]]
+  assert chat.is_alive()
+
+  # Nothing new until the replay time reaches the next message
+  assert list(chat.get().sync_items()) == []
+
+def test_replay_items_look_like_pytchat_items():
+  bob, carol = list(ReplayChat(RECORDS).get().sync_items())[1:3]
+
+  assert bob.author.name == "bob"
+  assert bob.author.channelId == "bob-id"
+  assert bob.author.isChatSponsor
+  assert bob.type == "textMessage"
+  assert carol.type == "superChat"
+  assert carol.amountValue == 5
+  assert abs(carol.timestamp / 1000 - time.time()) < 5
+
+def test_replay_speed_and_end_of_recording():
+  chat = ReplayChat(RECORDS, speed=1000)
+
+  assert len(collect(chat, len(RECORDS))) == len(RECORDS)
+  assert not chat.is_alive()
+
+def test_replay_loops_and_terminates():
+  chat = ReplayChat(RECORDS[:1], speed=1000, loop=True)
+
+  assert len(collect(chat, 3)) >= 3
+  assert chat.is_alive()
+  chat.terminate()
+  assert not chat.is_alive()
+  assert list(chat.get().sync_items()) == []
+
+def test_replay_factory_reads_one_recording_per_video(tmp_path):
+  write_recording(tmp_path / "stream-a.jsonl", RECORDS[:2])
+  create_chat = make_replay_chat_factory(str(tmp_path), speed=1000)
+
+  chat = create_chat(video_id="stream-a", interruptable=False)
+  assert [item.author.name for item in collect(chat, 2)] == ["alice", "bob"]
+
+def test_replayed_streams_are_ingested_into_the_response_queue(tmp_path, monkeypatch):
+
+  # The YouTube manager imports the whole response pipeline
+  youtube_manager = pytest.importorskip("backend.models.youtube_manager")
+  monkeypatch.setattr(youtube_manager, "analyze_sentiment_vader_batch", lambda texts: [("neutral", 0.5)] * len(texts))
+
+  # Each stream has a duplicate and a spam message that are filtered out
+  for video_id in ["stream-a", "stream-b"]:
+    write_recording(tmp_path / f"{video_id}.jsonl", [
+      {'time': 0, 'author': f"{video_id}-viewer{index}", 'message': f"what do you think about topic {index} on {video_id}?"}
+      for index in range(3)
+    ] + [
+      {'time': 0, 'author': f"{video_id}-copycat", 'message': f"what do you think about topic 0 on {video_id}?"},
+      {'time': 0, 'author': f"{video_id}-spammer", 'message': "check out www.free-subs.com"}
+    ])
+
+  queue = Queue()
+  manager = youtube_manager.YouTubeManager(queue, create_chat=make_replay_chat_factory(str(tmp_path), speed=1000))
+  manager.start_streaming("stream-a, stream-b")
+
+  try:
+    items = [queue.get(timeout=5) for _ in range(6)]
+    stats = manager.get_ingest_stats()
+  finally:
+    manager.stop_streaming()
+
+  assert queue.empty()
+  for video_id in ["stream-a", "stream-b"]:
+    assert stats[video_id]['received'] == 5
+    assert stats[video_id]['duplicates'] == 1
+    assert stats[video_id]['spam'] == 1
+    assert stats[video_id]['delivered'] == 3
+
+  assert sorted(item['video_id'] for item in items) == ["stream-a"] * 3 + ["stream-b"] * 3
+  for item in items:
+    assert item['source'] == "youtube"
+    assert item['author'].startswith(item['video_id'])
+    assert item['posted_at'] <= item['received_at'] <= item['queued_at']
@@ -0,0 +1,117 @@
+# Import necessary libraries
+import json
+import pytest
+
+# The ingestion script imports the OpenAI client, python-dotenv and tqdm
+pytest.importorskip("openai")
+pytest.importorskip("dotenv")
+pytest.importorskip("tqdm")
+
+from backend.embeddings import generate_pinecone_embeddings as ingestion
+from backend.embeddings.local_index import InMemoryIndex
+
+# Index that records every upserted and deleted id
+class RecordingIndex(InMemoryIndex):
+  def __init__(self, path):
+    super().__init__(path)
+    self.upserted = []
+    self.deleted = []
+
+  def upsert(self, vectors):
+    self.upserted.extend(vector_id for vector_id, _, _ in vectors)
+    return super().upsert(vectors)
+
+  def delete(self, ids=(), delete_all=False):
+    self.deleted.extend(ids)
+    return super().delete(ids, delete_all)
+
+@pytest.fixture
+def paths(tmp_path):
+  return {
+    'input': tmp_path / "embeddings.txt",
+    'checkpoint': tmp_path / "ingest_checkpoint.json",
+    'index': tmp_path / "local_index.json"
+  }
+
+# Run the ingestion with the stub embedder into a local index, returns the index it used
+def run(paths, lines, monkeypatch, *extra):
+  paths['input'].write_text("\n".join(lines) + "\n")
+  index = RecordingIndex(str(paths['index']))
+  monkeypatch.setattr(ingestion, "connect_index", lambda index_type, local_index_path: index)
+
+  ingestion.ingest(ingestion.parse_args([
+    "--index", "local", "--embedder", "stub",
+    "--input", str(paths['input']),
+    "--checkpoint", str(paths['checkpoint']),
+    "--local-index-path", str(paths['index']),
+    "--embed-batch-size", "2", "--upsert-batch-size", "1",
+    *extra
+  ]))
+  return index
+
+def stored_contents(paths):
+  return sorted(record['metadata']['content'] for record in InMemoryIndex(str(paths['index'])).records.values())
+
+def test_ingest_stores_every_line_once(paths, monkeypatch):
+  index = run(paths, ["alpha", "beta", "alpha", "", "gamma"], monkeypatch)
+
+  assert sorted(index.upserted) == sorted(ingestion.line_id(line) for line in ["alpha", "beta", "gamma"])
+  assert stored_contents(paths) == ["alpha", "beta", "gamma"]
+
+  # The checkpoint lists every stored id with the embedder it was made with
+  checkpoint = json.loads(paths['checkpoint'].read_text())
+  assert checkpoint['index'] == str(paths['index'])
+  assert set(checkpoint['ids'].values()) == {ingestion.embedder_key("stub")}
+  assert len(checkpoint['ids']) == 3
+
+def test_ingest_skips_stored_lines_and_deletes_removed_ones(paths, monkeypatch):
+  run(paths, ["alpha", "beta", "gamma"], monkeypatch)
+
+  # Moving a line is free, editing one deletes the old vector and inserts the new one
+  index = run(paths, ["gamma", "alpha", "beta edited"], monkeypatch)
+
+  assert index.upserted == [ingestion.line_id("beta edited")]
+  assert index.deleted == [ingestion.line_id("beta")]
+  assert stored_contents(paths) == ["alpha", "beta edited", "gamma"]
+  assert ingestion.line_id("beta") not in json.loads(paths['checkpoint'].read_text())['ids']
+
+def test_ingest_resumes_after_an_interruption(paths, monkeypatch):
+  embed_batch = ingestion.embed_batch
+  batches = []
+
+  # Fail on the second embedding request, after the first batch was saved
+  def failing_embed_batch(lines, embedder):
+    batches.append(lines)
+    if len(batches) == 2:
+      raise RuntimeError("embedding endpoint down")
+    return embed_batch(lines, embedder)
+
+  monkeypatch.setattr(ingestion, "embed_batch", failing_embed_batch)
+  with pytest.raises(RuntimeError):
+    run(paths, ["one", "two", "three", "four"], monkeypatch)
+  assert len(json.loads(paths['checkpoint'].read_text())['ids']) == 2
+
+  # The next run only embeds the lines that were not stored yet
+  monkeypatch.setattr(ingestion, "embed_batch", embed_batch)
+  index = run(paths, ["one", "two", "three", "four"], monkeypatch)
+  assert sorted(index.upserted) == sorted(ingestion.line_id(line) for line in ["three", "four"])
+  assert stored_contents(paths) == ["four", "one", "three", "two"]
+
+def test_ingest_migrates_a_line_number_checkpoint(paths, monkeypatch):
+  InMemoryIndex(str(paths['index'])).upsert([("0", [1.0], {'content': "alpha"}), ("1", [1.0], {'content': "beta"})])
+  paths['checkpoint'].write_text(json.dumps({'index': str(paths['index']), 'hashes': {"0": "old", "1": "old"}}))
+
+  index = run(paths, ["alpha", "beta"], monkeypatch)
+
+  assert sorted(index.deleted) == ["0", "1"]
+  assert stored_contents(paths) == ["alpha", "beta"]
+
+def test_ingest_refuses_an_index_without_a_checkpoint(paths, monkeypatch):
+  InMemoryIndex(str(paths['index'])).upsert([("0", [1.0], {'content': "alpha"})])
+
+  with pytest.raises(SystemExit):
+    run(paths, ["alpha"], monkeypatch)
+
+  # Resetting clears the vectors of the old script
+  run(paths, ["alpha"], monkeypatch, "--reset")
+  assert list(InMemoryIndex(str(paths['index'])).records) == [ingestion.line_id("alpha")]
@@ -0,0 +1,105 @@
+# Import necessary libraries
+import numpy as np
+from backend.embeddings.local_index import LocalVectorIndex, InMemoryIndex, stub_embed, STUB_DIMENSIONS
+
+CORPUS = [
+  "Ronald Lopez is a product designer",
+  "The stream is about cooking pasta",
+  "Cats are the best pets",
+  "Pasta is best cooked al dente"
+]
+
+# Embedder that counts how many lines it was asked to embed
+class CountingEmbedder:
+  def __init__(self):
+    self.calls = 0
+    self.lines = 0
+
+  def __call__(self, texts):
+    self.calls += 1
+    self.lines += len(texts)
+    return stub_embed(texts)
+
+def write_corpus(path, lines):
+  path.write_text("\n".join(lines) + "\n")
+
+def test_stub_embed_is_deterministic():
+  vectors = stub_embed(["hello world", "hello world", "something else"])
+
+  assert vectors.shape == (3, STUB_DIMENSIONS)
+  assert np.array_equal(vectors[0], vectors[1])
+  assert not np.array_equal(vectors[0], vectors[2])
+
+def test_query_returns_top_k_in_score_order():
+  index = LocalVectorIndex(stub_embed(CORPUS), [{'content': line} for line in CORPUS])
+
+  matches = index.query(stub_embed(["how is pasta cooked"])[0], top_k=3)
+
+  assert len(matches) == 3
+  assert [match['score'] for match in matches] == sorted((match['score'] for match in matches), reverse=True)
+  assert {matches[0]['metadata']['content'], matches[1]['metadata']['content']} == {CORPUS[1], CORPUS[3]}
+
+def test_query_matches_have_the_pinecone_shape():
+  index = LocalVectorIndex(stub_embed(CORPUS), [{'content': line} for line in CORPUS])
+
+  for match in index.query(stub_embed(["cats"])[0], top_k=2):
+    assert set(match) == {'id', 'score', 'metadata'}
+    assert isinstance(match['id'], str)
+    assert isinstance(match['score'], float)
+    assert match['metadata']['content'] in CORPUS
+
+def test_query_caps_top_k_and_handles_an_empty_index():
+  index = LocalVectorIndex(stub_embed(CORPUS), [{'content': line} for line in CORPUS])
+  assert len(index.query(stub_embed(["cats"])[0], top_k=10)) == len(CORPUS)
+
+  empty = LocalVectorIndex(np.zeros((0, STUB_DIMENSIONS)), [])
+  assert empty.query(stub_embed(["cats"])[0]) == []
+
+def test_from_file_reuses_the_cached_vectors(tmp_path):
+  corpus_path = tmp_path / "embeddings.txt"
+  cache_path = str(tmp_path / "local_index.npz")
+  write_corpus(corpus_path, CORPUS)
+
+  embedder = CountingEmbedder()
+  first = LocalVectorIndex.from_file(str(corpus_path), embedder, "model-a", cache_path, batch_size=2)
+  assert embedder.calls == 2
+  assert embedder.lines == len(CORPUS)
+
+  # Same corpus and model, nothing is embedded again
+  second = LocalVectorIndex.from_file(str(corpus_path), embedder, "model-a", cache_path, batch_size=2)
+  assert embedder.lines == len(CORPUS)
+  assert np.allclose(first.vectors, second.vectors)
+  assert second.metadata == [{'content': line} for line in CORPUS]
+
+def test_from_file_embeds_again_when_the_corpus_or_model_changes(tmp_path):
+  corpus_path = tmp_path / "embeddings.txt"
+  cache_path = str(tmp_path / "local_index.npz")
+  write_corpus(corpus_path, CORPUS)
+
+  embedder = CountingEmbedder()
+  LocalVectorIndex.from_file(str(corpus_path), embedder, "model-a", cache_path)
+
+  # A changed corpus invalidates the cache
+  write_corpus(corpus_path, CORPUS + ["A brand new line"])
+  index = LocalVectorIndex.from_file(str(corpus_path), embedder, "model-a", cache_path)
+  assert embedder.lines == 2 * len(CORPUS) + 1
+  assert len(index) == len(CORPUS) + 1
+
+  # So does a different embedding model
+  LocalVectorIndex.from_file(str(corpus_path), embedder, "model-b", cache_path)
+  assert embedder.lines == 3 * len(CORPUS) + 2
+
+def test_in_memory_index_matches_pinecone(tmp_path):
+  path = str(tmp_path / "local_index.json")
+  index = InMemoryIndex(path)
+  index.upsert([(f"id{i}", vector, {'content': line}) for i, (line, vector) in enumerate(zip(CORPUS, stub_embed(CORPUS)))])
+
+  result = index.query([stub_embed(["cats pets"])[0].tolist()], top_k=2, include_metadata=True)
+  assert result['matches'][0]['id'] == "id2"
+  assert result['matches'][0]['metadata'] == {'content': CORPUS[2]}
+
+  # Deletes are saved to the JSON file
+  index.delete(ids=["id2"])
+  assert InMemoryIndex(path).describe_index_stats() == {'total_vector_count': len(CORPUS) - 1}
+  index.delete(delete_all=True)
+  assert InMemoryIndex(path).describe_index_stats() == {'total_vector_count': 0}
@@ -0,0 +1,224 @@
+# Import necessary libraries
+import time
+from queue import Queue
+from threading import Thread, Event, Lock
+from backend.models.queue_monitor import QueueMonitor, PlaybackGate, PlaybackTurn
+
+# Wait until a condition holds, fails the test after timeout seconds
+def wait_until(condition, timeout=2):
+  deadline = time.monotonic() + timeout
+  while not condition():
+    assert time.monotonic() < deadline, "timed out"
+    time.sleep(0.005)
+
+# Handler that records the items it was given, the first one blocks until released
+class RecordingHandler:
+  def __init__(self):
+    self.handled = []
+    self.started = Event()
+    self.release = Event()
+    self.lock = Lock()
+
+  def __call__(self, queue_item, turn):
+    if not self.started.is_set():
+      self.started.set()
+      self.release.wait(2)
+    with self.lock:
+      self.handled.append(queue_item['name'])
+
+def start_monitor(handler, **kwargs):
+  monitor = QueueMonitor(Queue(), Queue(), handler, **kwargs)
+  monitor.start()
+  return monitor
+
+def test_items_are_handled_as_soon_as_they_arrive():
+  handler = RecordingHandler()
+  handler.release.set()
+  monitor = start_monitor(handler)
+
+  try:
+    started_at = time.monotonic()
+    monitor.regular_queue.put({'name': "first"})
+    wait_until(lambda: handler.handled == ["first"])
+
+    # No polling interval between the item arriving and being handled
+    assert time.monotonic() - started_at < 0.5
+  finally:
+    monitor.stop()
+
+def test_priority_items_are_served_first():
+  handler = RecordingHandler()
+  monitor = start_monitor(handler)
+
+  try:
+
+    # Keep the only worker busy while the other items queue up
+    monitor.regular_queue.put({'name': "regular 1"})
+    assert handler.started.wait(2)
+    monitor.regular_queue.put({'name': "regular 2"})
+    monitor.priority_queue.put({'name': "priority 1"})
+    monitor.priority_queue.put({'name': "priority 2"})
+    wait_until(lambda: sum(metrics['pending'] for metrics in monitor.get_metrics().values()) == 3)
+
+    handler.release.set()
+    wait_until(lambda: len(handler.handled) == 4)
+  finally:
+    monitor.stop()
+
+  assert handler.handled == ["regular 1", "priority 1", "priority 2", "regular 2"]
+
+  metrics = monitor.get_metrics()
+  assert metrics['priority']['processed'] == 2
+  assert metrics['regular']['processed'] == 2
+
+def test_full_regular_buffer_drops_the_oldest_item():
+  handler = RecordingHandler()
+  monitor = start_monitor(handler, regular_buffer_size=2)
+
+  try:
+    monitor.regular_queue.put({'name': "busy"})
+    assert handler.started.wait(2)
+    for name in ["old", "newer", "newest"]:
+      monitor.regular_queue.put({'name': name})
+    wait_until(lambda: monitor.get_metrics()['regular']['received'] == 4)
+
+    handler.release.set()
+    wait_until(lambda: len(handler.handled) == 3)
+  finally:
+    monitor.stop()
+
+  assert handler.handled == ["busy", "newer", "newest"]
+  assert monitor.get_metrics()['regular']['dropped'] == 1
+
+def test_backpressure_holds_items_in_the_source_queue():
+  handler = RecordingHandler()
+  monitor = start_monitor(handler, regular_buffer_size=1, regular_backpressure=True)
+
+  try:
+    monitor.regular_queue.put({'name': "busy"})
+    assert handler.started.wait(2)
+    for name in ["buffered", "waiting in the feeder", "waiting in the queue"]:
+      monitor.regular_queue.put({'name': name})
+
+    # The buffer and the feeder are full, the last item stays in the source queue
+    wait_until(lambda: monitor.regular_queue.qsize() == 1)
+
+    handler.release.set()
+    wait_until(lambda: len(handler.handled) == 4)
+  finally:
+    monitor.stop()
+
+  assert monitor.get_metrics()['regular']['dropped'] == 0
+  assert handler.handled == ["busy", "buffered", "waiting in the feeder", "waiting in the queue"]
+
+def test_playback_gate_plays_turns_in_order():
+  gate = PlaybackGate()
+  turns = [gate.next_turn() for _ in range(3)]
+  played = []
+
+  # Each turn plays once every earlier one finished
+  def play(turn):
+    turn.wait()
+    played.append(turn.sequence)
+    turn.finish()
+
+  threads = [Thread(target=play, args=(turn,)) for turn in reversed(turns)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join(2)
+
+  assert played == [0, 1, 2]
+
+def test_playback_gate_skips_turns_finished_early():
+  gate = PlaybackGate()
+  first, second, third = [gate.next_turn() for _ in range(3)]
+
+  # A turn finished before its time (ie. a failed response) doesn't hold up the later ones
+  second.finish()
+  second.finish()
+  first.finish()
+  third.wait()
+  assert gate.playing_sequence == 2
+
+def test_turn_without_a_gate_never_waits():
+  turn = PlaybackTurn()
+  turn.wait()
+  turn.finish()
+
+def test_workers_run_concurrently_but_play_in_arrival_order():
+  played = []
+  running = []
+  peak = []
+  lock = Lock()
+
+  # Later items are ready sooner, they still play after the earlier ones
+  def handle_item(queue_item, turn):
+    with lock:
+      running.append(queue_item['name'])
+      peak.append(len(running))
+    time.sleep(queue_item['delay'])
+    turn.wait()
+    with lock:
+      played.append(queue_item['name'])
+      running.remove(queue_item['name'])
+
+  monitor = start_monitor(handle_item, regular_buffer_size=5, pool_size=3)
+  try:
+    for index, delay in enumerate([0.15, 0.1, 0.05, 0.0]):
+      monitor.regular_queue.put({'name': index, 'delay': delay})
+    wait_until(lambda: len(played) == 4)
+  finally:
+    monitor.stop()
+
+  assert played == [0, 1, 2, 3]
+  assert max(peak) == 3
+
+def test_failed_item_doesnt_hold_up_the_next_ones():
+  played = []
+
+  def handle_item(queue_item, turn):
+    if queue_item['name'] == "broken":
+      raise RuntimeError("response failed")
+    turn.wait()
+    played.append(queue_item['name'])
+
+  monitor = start_monitor(handle_item, regular_buffer_size=3, pool_size=2)
+  try:
+    for name in ["broken", "after", "last"]:
+      monitor.regular_queue.put({'name': name})
+    wait_until(lambda: len(played) == 2)
+  finally:
+    monitor.stop()
+
+  assert played == ["after", "last"]
+
+def test_direct_responses_take_turns_with_queued_ones():
+  gate = PlaybackGate()
+  played = []
+  handler = RecordingHandler()
+
+  # The queued response holds its turn until released
+  def handle_item(queue_item, turn):
+    handler(queue_item, turn)
+    turn.wait()
+    played.append(queue_item['name'])
+
+  monitor = start_monitor(handle_item, playback_gate=gate)
+  try:
+    monitor.regular_queue.put({'name': "queued"})
+    assert handler.started.wait(2)
+
+    # A response given outside the queues (ie. the greeting) plays after it
+    direct_turn = gate.next_turn()
+    direct = Thread(target=lambda: (direct_turn.wait(), played.append("direct"), direct_turn.finish()))
+    direct.start()
+    time.sleep(0.05)
+    assert played == []
+
+    handler.release.set()
+    direct.join(2)
+  finally:
+    monitor.stop()
+
+  assert played == ["queued", "direct"]
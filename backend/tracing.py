@@ -0,0 +1,223 @@
+# Import necessary libraries
+import os
+import json
+import time
+import uuid
+import logging
+import contextvars
+from contextlib import contextmanager
+from queue import Queue, Full, Empty
+from threading import Thread, Lock, current_thread
+import requests
+from .metrics import requests_total, request_duration
+
+# Import settings
+from .config.load_settings import settings
+
+# Import settings variables
+TRACING_ENABLED = settings['TRACING_SETTINGS']['TRACING_ENABLED']
+TRACE_FILE = settings['TRACING_SETTINGS']['TRACE_FILE']
+TRACE_FILE_MAX_MB = settings['TRACING_SETTINGS']['TRACE_FILE_MAX_MB']
+TRACE_COLLECTOR_URL = settings['TRACING_SETTINGS']['TRACE_COLLECTOR_URL']
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Max number of finished traces waiting to be exported, more are dropped rather than slowing responses down
+EXPORT_QUEUE_SIZE = 1000
+
+# Max number of traces sent to the collector at once
+EXPORT_BATCH_SIZE = 50
+
+# Trace of the request being handled by the current thread
+current_trace_var = contextvars.ContextVar("current_trace", default=None)
+
+# Timings of a single request, from the moment it is queued until its reply finishes playing.
+# Spans can be recorded from any thread, the request id ties them together
+class Trace:
+  def __init__(self, source, request_id=None, started_at=None):
+    self.request_id = request_id or new_request_id()
+    self.source = source
+    self.started_at = started_at or time.time()
+    self.spans = []
+    self.attributes = {}
+    self.lock = Lock()
+
+  # Record a span that was already measured, start and end are time.time() values
+  def add_span(self, name, start, end, error=None, **attributes):
+    span = {
+      'name': name,
+      'start': round(start - self.started_at, 6),
+      'duration': round(end - start, 6),
+      'thread': current_thread().name
+    }
+    if attributes:
+      span['attributes'] = attributes
+    if error is not None:
+      span['error'] = error
+
+    with self.lock:
+      self.spans.append(span)
+
+  # Time a block of code as a span
+  @contextmanager
+  def span(self, name, **attributes):
+    start = time.time()
+    try:
+      yield attributes # The block can add attributes to the span
+    except Exception as e:
+      self.add_span(name, start, time.time(), error=repr(e), **attributes)
+      raise
+    else:
+      self.add_span(name, start, time.time(), **attributes)
+
+  # Get the trace as a dict for export
+  def to_dict(self):
+    with self.lock:
+      return {
+        'request_id': self.request_id,
+        'source': self.source,
+        'start': self.started_at,
+        'duration': round(time.time() - self.started_at, 6),
+        'attributes': dict(self.attributes),
+        'spans': sorted(self.spans, key=lambda span: span['start'])
+      }
+
+# Writes finished traces to a JSON lines file and/or posts them to a collector, on a background thread.
+# The file is rotated to <path>.1 once it reaches max_bytes, so at most two files are kept
+class TraceExporter:
+  def __init__(self, path=None, collector_url=None, max_bytes=None):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.collector_url = collector_url
+    self.queue = Queue(maxsize=EXPORT_QUEUE_SIZE)
+    self.exported = 0
+    self.dropped = 0
+    self.errors = 0
+    self.thread = None
+    self.lock = Lock() # Guards starting the thread, a single thread appends to the trace file
+
+  # Queue a finished trace, never blocks the response
+  def export(self, trace_dict):
+    if self.thread is None:
+      with self.lock:
+        if self.thread is None:
+          self.thread = Thread(target=self.run, name="trace_exporter", daemon=True)
+          self.thread.start()
+
+    try:
+      self.queue.put_nowait(trace_dict)
+    except Full:
+      self.dropped += 1
+
+  # Export the queued traces in batches
+  def run(self):
+    while True:
+      batch = [self.queue.get()]
+      while len(batch) < EXPORT_BATCH_SIZE:
+        try:
+          batch.append(self.queue.get_nowait())
+        except Empty:
+          break
+
+      try:
+        if self.path:
+          self.rotate()
+          with open(self.path, "a") as file:
+            file.writelines(json.dumps(trace_dict) + "\n" for trace_dict in batch)
+
+        if self.collector_url:
+          requests.post(self.collector_url, json=batch, timeout=5)
+
+        self.exported += len(batch)
+
+      except Exception as e:
+        self.errors += 1
+        logging.error(f"An error occurred while exporting traces: {e}")
+
+  # Move a full trace file aside, replacing the previous one
+  def rotate(self):
+    if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+      os.replace(self.path, f"{self.path}.1")
+
+  # Get the exporter stats: traces exported, dropped because the export queue was full, failed exports and traces waiting
+  def get_stats(self):
+    return {'exported': self.exported, 'dropped': self.dropped, 'errors': self.errors, 'pending': self.queue.qsize()}
+
+# Initialize the exporter, the trace file is relative to the backend folder
+trace_exporter = TraceExporter(
+  os.path.join(os.path.dirname(os.path.abspath(__file__)), TRACE_FILE) if TRACE_FILE else None,
+  TRACE_COLLECTOR_URL or None,
+  TRACE_FILE_MAX_MB * 1024 * 1024
+)
+
+# Make an id for a new request, used to find all of its spans
+def new_request_id():
+  return uuid.uuid4().hex
+
+# Start a trace for a request and make it the current one. Returns None if tracing is disabled
+def start_trace(source, request_id=None, started_at=None):
+  if not TRACING_ENABLED:
+    return None
+
+  trace = Trace(source, request_id, started_at)
+  current_trace_var.set(trace)
+  return trace
+
+# Finish a trace and export it
+def end_trace(trace):
+  if trace is None:
+    return
+
+  if current_trace_var.get() is trace:
+    current_trace_var.set(None)
+
+  trace_exporter.export(trace.to_dict())
+
+# Get the trace of the current request, None if there is none
+def current_trace():
+  return current_trace_var.get()
+
+# Time a block of code as a span of the current trace, does nothing if there is no trace
+@contextmanager
+def span(name, **attributes):
+  trace = current_trace_var.get()
+  if trace is None:
+    yield attributes
+    return
+
+  with trace.span(name, **attributes) as span_attributes:
+    yield span_attributes
+
+# Record an already measured span on the current trace
+def add_span(name, start, end, **attributes):
+  trace = current_trace_var.get()
+  if trace is not None:
+    trace.add_span(name, start, end, **attributes)
+
+# Wrap a function so it runs with the current trace, for work handed to other threads
+def with_current_trace(function):
+  trace = current_trace_var.get()
+  if trace is None:
+    return function
+
+  def run_with_trace(*args, **kwargs):
+    token = current_trace_var.set(trace)
+    try:
+      return function(*args, **kwargs)
+    finally:
+      current_trace_var.reset(token)
+
+  return run_with_trace
+
+# Trace a whole request handled by the current thread, it is counted in the request metrics even if tracing is disabled
+@contextmanager
+def traced_request(source, request_id=None, started_at=None):
+  started_at = started_at or time.time()
+  requests_total.inc(source)
+  trace = start_trace(source, request_id, started_at)
+  try:
+    yield trace
+  finally:
+    request_duration.observe(time.time() - started_at, source)
+    end_trace(trace)
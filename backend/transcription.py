@@ -0,0 +1,248 @@
+# Import necessary libraries
+import io
+import json
+import logging
+from threading import Lock
+import numpy as np
+import openai
+import speech_recognition as sr
+from .tracing import span
+from .metrics import track_upstream
+
+# Import settings
+from .config.load_settings import settings
+
+# Import settings variables
+OPENAI_WHISPER_MODEL = settings['AI_AUDIO_SETTINGS']['OPENAI_WHISPER_MODEL']
+WHISPER_UPLOAD_SAMPLE_RATE = settings['AI_AUDIO_SETTINGS']['WHISPER_UPLOAD_SAMPLE_RATE']
+WHISPER_UPLOAD_FORMAT = settings['AI_AUDIO_SETTINGS']['WHISPER_UPLOAD_FORMAT']
+STT_ENGINE = settings['AI_AUDIO_SETTINGS']['STT_ENGINE']
+LOCAL_STT_MODEL = settings['AI_AUDIO_SETTINGS']['LOCAL_STT_MODEL']
+LOCAL_STT_COMPUTE_TYPE = settings['AI_AUDIO_SETTINGS']['LOCAL_STT_COMPUTE_TYPE']
+LOCAL_STT_THREADS = settings['AI_AUDIO_SETTINGS']['LOCAL_STT_THREADS']
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Sample rate the local engines work at
+LOCAL_STT_SAMPLE_RATE = 16000
+
+# Leading bytes of the compressed formats Whisper accepts as they are, and their file extension
+AUDIO_SIGNATURES = [
+  (b"\x1a\x45\xdf\xa3", "webm"),
+  (b"OggS", "ogg"),
+  (b"fLaC", "flac"),
+  (b"ID3", "mp3"),
+  (b"\xff\xfb", "mp3"),
+  (b"\xff\xf3", "mp3")
+]
+
+# Set once the FLAC encoder turned out to be unavailable, so it isn't tried on every utterance
+flac_state = {'available': WHISPER_UPLOAD_FORMAT == "flac"}
+
+# Encode recorded speech (speech_recognition AudioData) for upload: downsampled to 16 bit at WHISPER_UPLOAD_SAMPLE_RATE,
+# as FLAC if the encoder is available. Returns (audio bytes, file extension)
+def encode_speech(audio_data):
+
+  # Never upsample, it only makes the upload bigger
+  rate = min(WHISPER_UPLOAD_SAMPLE_RATE, audio_data.sample_rate)
+
+  if flac_state['available']:
+    try:
+      return audio_data.get_flac_data(convert_rate=rate, convert_width=2), "flac"
+    except OSError as e:
+      logging.warning(f"FLAC encoder unavailable, uploading speech as WAV: {e}")
+      flac_state['available'] = False
+
+  return audio_data.get_wav_data(convert_rate=rate, convert_width=2), "wav"
+
+# Get the file extension of a compressed recording, None for WAV, AIFF, FLAC or unknown audio
+def compressed_format(audio_bytes):
+  for signature, extension in AUDIO_SIGNATURES:
+    if audio_bytes.startswith(signature) and extension != "flac":
+      return extension
+
+  # MP4/M4A has its signature after the box size
+  if audio_bytes[4:8] == b"ftyp":
+    return "m4a"
+
+  return None
+
+# Decode a WAV, AIFF or FLAC recording held in memory into AudioData, downmixed to mono. Raises ValueError for other formats
+def decode_upload(audio_bytes):
+  with sr.AudioFile(io.BytesIO(audio_bytes)) as source:
+    return sr.Recognizer().record(source)
+
+# Prepare an uploaded recording for transcription. WAV, AIFF and FLAC recordings are downmixed and downsampled
+# like recorded speech, compressed formats such as WebM/Opus are sent as they are. Returns (audio bytes, file extension)
+def prepare_upload(audio_bytes):
+  extension = compressed_format(audio_bytes)
+  if extension is not None:
+    return audio_bytes, extension
+
+  # Decode uncompressed recordings in memory
+  try:
+    audio_data = decode_upload(audio_bytes)
+  except ValueError:
+    logging.warning("Unrecognized audio upload, sending it as it is")
+    return audio_bytes, "wav"
+
+  return encode_speech(audio_data)
+
+# Speech-to-text engine interface. transcribe_speech takes speech recorded by the microphone (AudioData),
+# transcribe_upload takes the bytes of an uploaded recording. Both return the text
+class Transcriber:
+  name = None
+
+  # Load the engine ahead of the first utterance, does nothing for remote engines
+  def load(self):
+    pass
+
+  def transcribe_speech(self, audio_data):
+    raise NotImplementedError
+
+  def transcribe_upload(self, audio_bytes):
+    raise NotImplementedError
+
+# Transcribes with the OpenAI Whisper API, the audio is uploaded from memory
+class WhisperAPITranscriber(Transcriber):
+  name = "whisper_api"
+
+  def __init__(self, model=OPENAI_WHISPER_MODEL):
+    self.model = model
+
+  # Transcribe audio held in memory, the extension tells Whisper the audio format
+  def transcribe(self, audio_bytes, extension):
+    with span("transcription", engine=self.name, model=self.model, format=extension, bytes=len(audio_bytes)), track_upstream("openai_whisper"):
+      transcription_result = openai.Audio.transcribe_raw(model=self.model, file=audio_bytes, filename=f"speech.{extension}")
+      return transcription_result['text']
+
+  def transcribe_speech(self, audio_data):
+    with span("encode_speech"):
+      audio_bytes, extension = encode_speech(audio_data)
+    return self.transcribe(audio_bytes, extension)
+
+  def transcribe_upload(self, audio_bytes):
+    with span("encode_speech"):
+      audio_bytes, extension = prepare_upload(audio_bytes)
+    return self.transcribe(audio_bytes, extension)
+
+# Base of the engines that run on this machine. The model is loaded once and kept warm,
+# the audio is handed over as 16 kHz 16 bit mono PCM without leaving memory
+class LocalTranscriber(Transcriber):
+  def __init__(self, model):
+    self.model_name = model
+    self.model = None
+    self.lock = Lock() # Only one thread loads the model
+
+  def load(self):
+    with self.lock:
+      if self.model is None:
+        logging.info(f"Loading the {self.name} speech-to-text model {self.model_name}...")
+        self.model = self.load_model()
+        logging.info(f"Loaded the {self.name} speech-to-text model")
+    return self.model
+
+  def load_model(self):
+    raise NotImplementedError
+
+  # Transcribe 16 kHz 16 bit mono PCM with the loaded model
+  def transcribe_pcm(self, model, pcm):
+    raise NotImplementedError
+
+  def transcribe_speech(self, audio_data):
+    pcm = audio_data.get_raw_data(convert_rate=LOCAL_STT_SAMPLE_RATE, convert_width=2)
+    return self.transcribe_timed(pcm)
+
+  def transcribe_upload(self, audio_bytes):
+    return self.transcribe_speech(decode_upload(audio_bytes))
+
+  def transcribe_timed(self, pcm):
+    model = self.load()
+    with span("transcription", engine=self.name, model=self.model_name, seconds=round(len(pcm) / (2 * LOCAL_STT_SAMPLE_RATE), 3)):
+      return self.transcribe_pcm(model, pcm)
+
+# Transcribes with faster-whisper (CTranslate2 Whisper), quantized to int8 by default so it runs well on CPU
+class FasterWhisperTranscriber(LocalTranscriber):
+  name = "faster_whisper"
+
+  def __init__(self, model=LOCAL_STT_MODEL, compute_type=LOCAL_STT_COMPUTE_TYPE, threads=LOCAL_STT_THREADS):
+    super().__init__(model)
+    self.compute_type = compute_type
+    self.threads = threads
+
+  def load_model(self):
+    from faster_whisper import WhisperModel
+    return WhisperModel(self.model_name, device="cpu", compute_type=self.compute_type, cpu_threads=self.threads)
+
+  def transcribe_pcm(self, model, pcm):
+    audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+    # Greedy decoding, short voice commands don't gain much from a beam search
+    segments, _ = model.transcribe(audio, beam_size=1)
+    return "".join(segment.text for segment in segments).strip()
+
+  # faster-whisper decodes compressed uploads itself
+  def transcribe_upload(self, audio_bytes):
+    if compressed_format(audio_bytes) is None:
+      return self.transcribe_speech(decode_upload(audio_bytes))
+
+    model = self.load()
+    with span("transcription", engine=self.name, model=self.model_name, bytes=len(audio_bytes)):
+      segments, _ = model.transcribe(io.BytesIO(audio_bytes), beam_size=1)
+      return "".join(segment.text for segment in segments).strip()
+
+# Transcribes with a Vosk (Kaldi) model, LOCAL_STT_MODEL is the path of the unpacked model folder
+class VoskTranscriber(LocalTranscriber):
+  name = "vosk"
+
+  def __init__(self, model=LOCAL_STT_MODEL, fallback=None):
+    super().__init__(model)
+    self.fallback = fallback # Used for uploads Vosk can't decode
+
+  def load_model(self):
+    from vosk import Model, SetLogLevel
+    SetLogLevel(-1)
+    return Model(self.model_name)
+
+  def transcribe_pcm(self, model, pcm):
+    from vosk import KaldiRecognizer
+    recognizer = KaldiRecognizer(model, LOCAL_STT_SAMPLE_RATE)
+    recognizer.AcceptWaveform(pcm)
+    return json.loads(recognizer.FinalResult())['text']
+
+  # Vosk only takes PCM, compressed uploads go to the fallback engine
+  def transcribe_upload(self, audio_bytes):
+    if compressed_format(audio_bytes) is not None and self.fallback is not None:
+      return self.fallback.transcribe_upload(audio_bytes)
+    return super().transcribe_upload(audio_bytes)
+
+# Create the speech-to-text engine selected by STT_ENGINE
+def create_transcriber(engine=STT_ENGINE):
+  if engine == "faster_whisper":
+    return FasterWhisperTranscriber()
+  if engine == "vosk":
+    return VoskTranscriber(fallback=WhisperAPITranscriber())
+  if engine != "whisper_api":
+    logging.warning(f"Unknown speech-to-text engine {engine}, using the Whisper API")
+  return WhisperAPITranscriber()
+
+# Initialize the speech-to-text engine at startup
+transcriber = create_transcriber()
+
+# Load a local speech-to-text model ahead of the first utterance. Falls back to the Whisper API if it can't be loaded
+def preload_transcriber():
+  global transcriber
+  try:
+    transcriber.load()
+  except Exception as e:
+    logging.error(f"An error occurred while loading the {transcriber.name} speech-to-text engine, using the Whisper API: {e}")
+    transcriber = WhisperAPITranscriber()
+
+# Transcribe speech recorded by the microphone
+def transcribe_speech(audio_data):
+  return transcriber.transcribe_speech(audio_data)
+
+# Transcribe an uploaded recording
+def transcribe_upload(audio_bytes):
+  return transcriber.transcribe_upload(audio_bytes)